@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+from infrastructure import aws_clients, config, deploy_engine
+
+# Defaults shared by the subcommands
+DEFAULT_REGION = "us-east-1"
+DEFAULT_VPC_NAME = "dev"
+
+# Template modules (troposphere) and boto3 are imported inside the commands that need them
+
+
+def tabulate(rows, headers):
+    from tabulate import tabulate as render_table
+    return render_table(rows, headers=headers)
+
+
+def create_update_vpc_stack(args):
+    from infrastructure import create_vpc, preflight
+    if preflight.check([args.vpc_name], args.region):
+        return False
+    stack_name = deploy_engine.stack_name_for(args.vpc_name, "vpc")
+    return create_vpc.create_update_cfn_template(args.vpc_name, args.region, config.dns_name, stack_name)
+
+
+def create_security_group_stack(args):
+    from infrastructure import infra_instances
+    stack_name = deploy_engine.stack_name_for(args.vpc_name, "security-groups")
+    return infra_instances.create_update_security_group_template(args.vpc_name, stack_name)
+
+
+def create_instance_stack(args):
+    from infrastructure import infra_instances
+    stack_name = deploy_engine.stack_name_for(args.vpc_name, "instances", args.instance_type)
+    return infra_instances.create_update_instance_template(args.vpc_name, stack_name, args.instance_type)
+
+
+def blue_green_tiers():
+    return [tier for tier in config.INSTANCE_TIER_COUNT if config.INSTANCE_ROLLOUT.get(tier) == "blue-green"]
+
+
+def delete_stack(args):
+    from infrastructure import teardown
+    if args.stack_name:
+        stack_names = [args.stack_name]
+    else:
+        stack_names = [deploy_engine.stack_name_for(args.vpc_name, "instances", tier) for tier in config.INSTANCE_TIER_COUNT]
+        if blue_green_tiers():
+            from infrastructure import blue_green
+            stack_names += [blue_green.tier_stacks(args.vpc_name, tier)[1] for tier in blue_green_tiers()]
+        stack_names += [deploy_engine.stack_name_for(args.vpc_name, "security-groups"), deploy_engine.stack_name_for(args.vpc_name, "vpc")]
+
+    # Order comes from the importers of each stack's exports; independent stacks delete concurrently.
+    # The plan is checked for outside importers before anything is touched
+    try:
+        tasks = teardown.build_plan(stack_names, retain_failed=args.retain_failed)
+    except ValueError as e:
+        print(f"An error occurred: {e}")
+        return False
+    if not args.stack_name and blue_green_tiers():
+        from infrastructure import blue_green
+        # Weighted records live outside the stacks and would keep the hosted zone from being deleted
+        for tier in blue_green_tiers():
+            blue_green.retire_records(args.vpc_name, tier)
+    deploy_engine.run_plan(tasks, max_workers=args.workers)
+    print(tabulate(deploy_engine.summary_rows(tasks), headers=["Stack", "Status", "Time", "Error"]))
+    return all(task.status == deploy_engine.SUCCEEDED for task in tasks)
+
+
+def rollout(args):
+    from infrastructure import blue_green
+    return blue_green.rollout(args.vpc_name, args.instance_type, check_ports=args.probe, ttl=args.ttl or blue_green.BLUE_GREEN_TTL)
+
+
+def sync_dns(args):
+    from infrastructure import dns_sync
+    dns_sync.sync_tier(args.vpc_name, args.instance_type, dry_run=args.dry_run)
+    return True
+
+
+def inventory(args):
+    from infrastructure import inventory as inv
+    db = inv.connect()
+    counts = inv.refresh(db, max_age=None if args.refresh else args.max_age or inv.INVENTORY_MAX_AGE)
+    if counts:
+        print("Refreshed " + ", ".join(f"{source} ({n})" for source, n in counts.items()))
+    if args.view == "instances":
+        print(tabulate(inv.instance_rows(db, args.vpc_name, args.instance_type, args.tag),
+                       headers=["Environment", "Name", "Instance", "State", "Private IP", "Public IP"]))
+    elif args.view == "exports":
+        print(tabulate(inv.export_rows(db, args.prefix), headers=["Export", "Value"]))
+    else:
+        print(tabulate(inv.status_rows(db, [args.vpc_name] if args.vpc_name else None),
+                       headers=["Environment", "Stacks", "Subnets", "Running Instances"]))
+    return True
+
+
+def preflight_check(args):
+    from infrastructure import preflight
+    problems = preflight.check(args.environments, args.region, auto_allocate=args.auto_allocate)
+    if not problems:
+        print(f"Preflight passed for {', '.join(args.environments)}")
+    return not problems
+
+
+def catalog(args):
+    from infrastructure import ami_catalog
+    regions = args.regions or [args.region]
+    if args.refresh:
+        ami_catalog.refresh(regions)
+    if args.repin:
+        for region in regions:
+            for vpc_name, images in ami_catalog.repin(args.repin, region).items():
+                print(f"{vpc_name} in {region} pinned to {' '.join(f'{key}={value}' for key, value in sorted(images.items()))}")
+        print("In-place tiers replace their instances on their next deploy; use rollout for blue/green tiers")
+    print(tabulate(ami_catalog.catalog_rows(regions), headers=["Region", "Fetched", "AMIs", "Instance Types (AZs Offered)"]))
+    return True
+
+
+def deploy_environments(args):
+    tasks = deploy_engine.build_plan(args.environments, args.tiers, args.region, config.dns_name)
+    from infrastructure import inventory as inv
+    blocked = inv.blocked_stacks([task.stack_name for task in tasks])
+    if blocked:
+        print(tabulate(blocked, headers=["Stack", "Status"]))
+        print("Stacks above must settle or be deleted before deploying")
+        return False
+    from infrastructure import preflight
+    if preflight.check(args.environments, args.region, auto_allocate=args.auto_allocate, persist=True):
+        return False
+    deploy_engine.run_plan(tasks, max_workers=args.workers)
+    print(tabulate(deploy_engine.summary_rows(tasks), headers=["Stack", "Status", "Time", "Error"]))
+    return all(task.status == deploy_engine.SUCCEEDED for task in tasks)
+
+
+def fan_out(args):
+    from infrastructure import fanout
+    if args.targets:
+        targets = [fanout.parse_target(spec) for spec in args.targets]
+    else:
+        targets = fanout.target_matrix(args.accounts, args.regions or [args.region], args.environments)
+    results = fanout.fan_out(targets, args.tiers, max_stacks=args.workers or fanout.MAX_PARALLEL_STACKS,
+                             max_targets=args.max_targets or fanout.MAX_PARALLEL_TARGETS, role_name=args.role_name)
+    rows = fanout.report_rows(results)
+    print(tabulate(rows, headers=["Account", "Region", "Environment", "Stacks", "Status", "Time", "Error"]))
+    return all(row[4] == deploy_engine.SUCCEEDED for row in rows)
+
+
+def render_only(args):
+    if args.command == "deploy-environments":
+        vpc_names, tiers, wanted = args.environments, args.tiers, None
+    else:
+        vpc_names, tiers = [args.vpc_name], list(config.INSTANCE_TIER_COUNT)
+        wanted = {
+            "create-update-vpc-stack": deploy_engine.stack_name_for(args.vpc_name, "vpc"),
+            "create-security-group-stack": deploy_engine.stack_name_for(args.vpc_name, "security-groups"),
+            "create-instance-stack": deploy_engine.stack_name_for(args.vpc_name, "instances", getattr(args, "instance_type", None)),
+        }.get(args.command)
+        if wanted is None:
+            print(f"{args.command} has nothing to render")
+            return False
+
+    from infrastructure import offline
+    rows = offline.render_stacks(vpc_names, tiers, args.region, config.dns_name, args.output_dir)
+    rows = [row for row in rows if wanted is None or row[0] == wanted]
+    print(tabulate([[name, resources, size, "; ".join(problems) or "ok"] for name, resources, size, problems in rows],
+                   headers=["Stack", "Resources", "Bytes", "Validation"]))
+    return not any(problems for _, _, _, problems in rows)
+
+
+def benchmark(args):
+    if args.bulk:
+        from infrastructure import bulk_builder
+        print(tabulate(bulk_builder.compare(args.instances, args.workers),
+                       headers=["Path", "Resources", "Time", "Throughput", "Peak RSS", "Worker Peak RSS"]))
+        return True
+    from infrastructure import benchmark as bench
+    rows = bench.run(instances=args.instances, tiers=args.tiers)
+    print(tabulate(bench.report_rows(rows), headers=["Phase", "Time", "Items", "Throughput"]))
+    total = sum(seconds for _, seconds, _ in rows)
+    if args.budget and total > args.budget:
+        print(f"Benchmark took {total:.2f}s, over the {args.budget:.2f}s budget")
+        return False
+    return True
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Build AWS infrastructure stacks")
+    parser.add_argument("-r", "--region", default=DEFAULT_REGION)
+    parser.add_argument("--render-only", action="store_true", help="Render and validate templates offline without calling AWS")
+    parser.add_argument("-o", "--output-dir", help="Write rendered templates here in --render-only mode")
+    parser.add_argument("--trace", action="store_true", help="Print where the run's wall-clock time went")
+    parser.add_argument("--trace-file", help="Append spans and API calls to this JSON lines file")
+    parser.add_argument("--no-template-cache", action="store_true", help="Rebuild every template and deploy even when its inputs are unchanged")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("create-update-vpc-stack", help="Create or update the VPC stack")
+    sub.add_argument("-v", "--vpc-name", default=DEFAULT_VPC_NAME, choices=list(config.NETWORK_OCTETS))
+    sub.set_defaults(func=create_update_vpc_stack)
+
+    sub = subparsers.add_parser("create-security-group-stack", help="Create or update the security group stack")
+    sub.add_argument("-v", "--vpc-name", default=DEFAULT_VPC_NAME)
+    sub.set_defaults(func=create_security_group_stack)
+
+    sub = subparsers.add_parser("create-instance-stack", help="Create or update an instance tier stack")
+    sub.add_argument("-v", "--vpc-name", default=DEFAULT_VPC_NAME)
+    sub.add_argument("-i", "--instance-type", default="bastion", choices=list(config.INSTANCE_TIER_COUNT))
+    sub.set_defaults(func=create_instance_stack)
+
+    sub = subparsers.add_parser("delete-stack", help="Delete one stack or every stack of an environment")
+    sub.add_argument("-v", "--vpc-name", default=DEFAULT_VPC_NAME)
+    sub.add_argument("-s", "--stack-name")
+    sub.add_argument("-w", "--workers", type=int, default=deploy_engine.MAX_PARALLEL_STACKS)
+    sub.add_argument("--retain-failed", action="store_true", help="On the last retry, leave behind resources that keep failing to delete")
+    sub.set_defaults(func=delete_stack)
+
+    sub = subparsers.add_parser("rollout", help="Blue/green rollout of an instance tier with a health-gated weighted DNS cutover")
+    sub.add_argument("-v", "--vpc-name", default=DEFAULT_VPC_NAME)
+    sub.add_argument("-i", "--instance-type", default="bastion", choices=list(config.INSTANCE_TIER_COUNT))
+    sub.add_argument("--probe", action="store_true", help="Also require a TCP connection to each instance's service port")
+    sub.add_argument("--ttl", type=int, help="TTL of the weighted records (default 60s); each cutover step waits this long")
+    sub.set_defaults(func=rollout)
+
+    sub = subparsers.add_parser("sync-dns", help="Batch-sync an instance tier's Route53 records with its running instances")
+    sub.add_argument("-v", "--vpc-name", default=DEFAULT_VPC_NAME)
+    sub.add_argument("-i", "--instance-type", default="bastion", choices=list(config.INSTANCE_TIER_COUNT))
+    sub.add_argument("-n", "--dry-run", action="store_true")
+    sub.set_defaults(func=sync_dns)
+
+    sub = subparsers.add_parser("inventory", help="Snapshot stacks, exports, subnets and instances locally and query them")
+    sub.add_argument("view", nargs="?", default="status", choices=["status", "instances", "exports"])
+    sub.add_argument("-v", "--vpc-name")
+    sub.add_argument("-i", "--instance-type")
+    sub.add_argument("--tag", help="KEY=VALUE tag instances must carry")
+    sub.add_argument("--prefix", help="Only exports whose name starts with this")
+    sub.add_argument("--refresh", action="store_true", help="Re-sweep every source regardless of age")
+    sub.add_argument("--max-age", type=int, help="Re-sweep sources older than this many seconds")
+    sub.set_defaults(func=inventory)
+
+    sub = subparsers.add_parser("preflight", help="Check CIDR overlap and VPC, EIP and NAT gateway quotas without deploying")
+    sub.add_argument("-e", "--environments", nargs="+", default=list(config.NETWORK_OCTETS), choices=list(config.NETWORK_OCTETS))
+    sub.add_argument("--auto-allocate", action="store_true", help="Show the blocks new clashing environments would be given")
+    sub.set_defaults(func=preflight_check)
+
+    sub = subparsers.add_parser("catalog", help="Show or refresh the cached AMI IDs and instance type offerings")
+    sub.add_argument("--regions", nargs="+", help="Regions to show (default: --region)")
+    sub.add_argument("--refresh", action="store_true", help="Fetch the latest entries even if the cache is fresh")
+    sub.add_argument("--repin", nargs="+", metavar="ENV", choices=list(config.NETWORK_OCTETS),
+                     help="Move these environments to the latest AMIs (deploys otherwise keep the AMI they were first given)")
+    sub.set_defaults(func=catalog)
+
+    sub = subparsers.add_parser("deploy-environments", help="Deploy VPC, security group and instance stacks for several environments in parallel")
+    sub.add_argument("-e", "--environments", nargs="+", default=list(config.NETWORK_OCTETS), choices=list(config.NETWORK_OCTETS))
+    sub.add_argument("-t", "--tiers", nargs="+", default=list(config.INSTANCE_TIER_COUNT), choices=list(config.INSTANCE_TIER_COUNT))
+    sub.add_argument("-w", "--workers", type=int, default=deploy_engine.MAX_PARALLEL_STACKS)
+    sub.add_argument("--auto-allocate", action="store_true", help="Give new environments whose /16 clashes a free block from 10.0.0.0/8 and keep it for later runs")
+    sub.set_defaults(func=deploy_environments)
+
+    sub = subparsers.add_parser("fan-out", help="Deploy environments across several accounts and regions concurrently")
+    sub.add_argument("--targets", nargs="+", metavar="ACCOUNT/REGION/ENV", help="Explicit targets; \"default\" as the account uses the current credentials")
+    sub.add_argument("--accounts", nargs="+", default=["default"], help="Account IDs for the target matrix (default: current credentials)")
+    sub.add_argument("--regions", nargs="+", help="Regions for the target matrix (default: --region)")
+    sub.add_argument("-e", "--environments", nargs="+", default=list(config.NETWORK_OCTETS), choices=list(config.NETWORK_OCTETS))
+    sub.add_argument("-t", "--tiers", nargs="+", default=list(config.INSTANCE_TIER_COUNT), choices=list(config.INSTANCE_TIER_COUNT))
+    sub.add_argument("-w", "--workers", type=int, help="Stack operations running at once across every target (default 8)")
+    sub.add_argument("--max-targets", type=int, help="Account/region groups deployed at once (default 8)")
+    sub.add_argument("--role-name", default=aws_clients.ASSUME_ROLE_NAME, help="Role assumed in each target account")
+    sub.set_defaults(func=fan_out)
+
+    sub = subparsers.add_parser("benchmark", help="Time template generation, serialization and ID resolution offline")
+    sub.add_argument("-n", "--instances", type=int, default=500)
+    sub.add_argument("-t", "--tiers", type=int, default=10)
+    sub.add_argument("-b", "--budget", type=float, help="Fail when the phases take longer than this many seconds")
+    sub.add_argument("--bulk", action="store_true", help="Compare the troposphere path with the bulk builder for one tier of -n instances")
+    sub.add_argument("-w", "--workers", type=int, help="Bulk builder worker processes (default: CPU count)")
+    sub.set_defaults(func=benchmark)
+
+    return parser.parse_args(argv)
+
+
+def print_trace_summary():
+    from infrastructure import tracing
+    print(tabulate(tracing.summary_rows(), headers=["Span", "Count", "Total", "Max", "Share Of Wall", "Errors"]))
+    print(tabulate(tracing.counter_rows(), headers=["Counter", "Value"]))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    aws_clients.configure(region_name=args.region)
+    if args.trace_file:
+        from infrastructure import tracing
+        tracing.TRACE_FILE = args.trace_file
+    if args.no_template_cache:
+        from infrastructure import template_cache
+        template_cache.ENABLED = False
+    func = render_only if args.render_only and args.func is not benchmark else args.func
+    try:
+        return 0 if func(args) is not False else 1
+    finally:
+        if args.trace:
+            print_trace_summary()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
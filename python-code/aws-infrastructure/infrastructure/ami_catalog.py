@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from infrastructure import aws_clients, stack_deploy, state_files
+from infrastructure.config import INSTANCE_BUILD_ITEMS, INSTANCE_TIER_SIZE
+
+# On-disk catalog of AMI IDs and instance type offerings per region
+CATALOG_FILE = os.path.join(stack_deploy.STATE_DIR, "ami_catalog.json")
+
+# AMI ID each environment runs per region and image key. A pin is set on the environment's first
+# deploy and only moves when repin() is asked to, so the catalog refresh never replaces the
+# instances of an in-place tier behind the operator's back
+PINS_FILE = os.path.join(stack_deploy.STATE_DIR, "ami_pins.json")
+
+# Seconds a region's entry is used before it is fetched again; pinned environments keep their AMI
+CATALOG_TTL = int(os.environ.get("INFRA_CATALOG_TTL", str(24 * 3600)))
+
+# Image keys and the SSM public parameters holding their latest AMI IDs
+AMI_PARAMETERS = {
+    "ubuntu22": "/aws/service/canonical/ubuntu/server/22.04/stable/current/amd64/hvm/ebs-gp2/ami-id",
+    "ubuntu24": "/aws/service/canonical/ubuntu/server/24.04/stable/current/amd64/hvm/ebs-gp3/ami-id",
+}
+
+# Image every tier boots
+DEFAULT_IMAGE = "ubuntu22"
+
+# get_parameters accepts at most this many names per call
+SSM_BATCH = 10
+
+_lock = threading.Lock()
+_entries = None
+_pins = None
+_refresh_allowed = True
+
+
+def _load():
+    global _entries
+    if _entries is None:
+        try:
+            with open(CATALOG_FILE) as f:
+                _entries = json.load(f)
+        except (OSError, ValueError):
+            _entries = {}
+    return _entries
+
+
+def _save():
+    state_files.write_json(CATALOG_FILE, _entries, indent=2, sort_keys=True)
+
+
+def _load_pins():
+    global _pins
+    if _pins is None:
+        try:
+            with open(PINS_FILE) as f:
+                _pins = json.load(f)
+        except (OSError, ValueError):
+            _pins = {}
+    return _pins
+
+
+def _save_pins():
+    state_files.write_json(PINS_FILE, _pins, indent=2, sort_keys=True)
+
+
+def instance_size(vpc_name, tier):
+    """ EC2 instance type a tier runs in an environment """
+    return INSTANCE_TIER_SIZE.get(vpc_name, {}).get(tier, INSTANCE_BUILD_ITEMS["baseinstancetype"])
+
+
+def wanted_sizes():
+    """ Every instance type any environment's tiers use """
+    sizes = {INSTANCE_BUILD_ITEMS["baseinstancetype"]}
+    for tiers in INSTANCE_TIER_SIZE.values():
+        sizes.update(tiers.values())
+    return sorted(sizes)
+
+
+def fetch_region(region, sizes=None):
+    """ Latest AMI IDs and the AZs offering each instance type, in one bulk call per API """
+    ssm = aws_clients.client("ssm", region)
+    amis = {}
+    keys = list(AMI_PARAMETERS)
+    for start in range(0, len(keys), SSM_BATCH):
+        batch = keys[start:start + SSM_BATCH]
+        response = ssm.get_parameters(Names=[AMI_PARAMETERS[key] for key in batch])
+        by_name = {parameter["Name"]: parameter["Value"] for parameter in response["Parameters"]}
+        amis.update({key: by_name[AMI_PARAMETERS[key]] for key in batch if AMI_PARAMETERS[key] in by_name})
+
+    offerings = {size: [] for size in sizes or wanted_sizes()}
+    paginator = aws_clients.client("ec2", region).get_paginator("describe_instance_type_offerings")
+    for page in paginator.paginate(LocationType="availability-zone",
+                                   Filters=[{"Name": "instance-type", "Values": list(offerings)}]):
+        for offering in page["InstanceTypeOfferings"]:
+            offerings[offering["InstanceType"]].append(offering["Location"])
+    return {"fetched_at": time.time(), "amis": amis, "offerings": {size: sorted(zones) for size, zones in offerings.items()}}
+
+
+def refresh(regions, sizes=None):
+    """ Fetch and store the catalog entries of the given regions """
+    with _lock:
+        entries = _load()
+        for region in regions:
+            entries[region] = fetch_region(region, sizes)
+        _save()
+        return {region: entries[region] for region in regions}
+
+
+def region_entry(region):
+    """ Cached entry for a region, fetched when missing or older than CATALOG_TTL; None offline without a cache """
+    with _lock:
+        entry = _load().get(region)
+        stale = entry is None or time.time() - entry["fetched_at"] > CATALOG_TTL
+        wanted = set(wanted_sizes())
+        if entry is not None and not wanted <= set(entry["offerings"]):
+            stale = True
+        if not stale or not _refresh_allowed:
+            return entry
+    return refresh([region])[region]
+
+
+@contextmanager
+def cached_only():
+    """ Serve lookups from the disk cache (or config defaults) without calling AWS """
+    global _refresh_allowed
+    previous, _refresh_allowed = _refresh_allowed, False
+    try:
+        yield
+    finally:
+        _refresh_allowed = previous
+
+
+def latest_ami(region, image=DEFAULT_IMAGE):
+    """ Latest AMI ID for an image key, falling back to the IDs in INSTANCE_BUILD_ITEMS """
+    entry = region_entry(region)
+    if entry and image in entry["amis"]:
+        return entry["amis"][image]
+    return INSTANCE_BUILD_ITEMS[f"{image}id"]
+
+
+def pinned(vpc_name, region):
+    """ Image keys and AMI IDs an environment is pinned to in a region """
+    with _lock:
+        return dict(_load_pins().get(aws_clients.scoped(vpc_name), {}).get(region, {}))
+
+
+def ami_id(region, vpc_name, image=DEFAULT_IMAGE):
+    """ AMI ID an environment runs: its pin, else the latest one, pinned from then on """
+    pin = pinned(vpc_name, region).get(image)
+    if pin:
+        return pin
+    latest = latest_ami(region, image)
+    if not _refresh_allowed:
+        # Offline renders show the latest AMI without pinning it
+        return latest
+    with _lock:
+        images = _load_pins().setdefault(aws_clients.scoped(vpc_name), {}).setdefault(region, {})
+        # Another thread may have pinned the environment first
+        pin = images.setdefault(image, latest)
+        _save_pins()
+    return pin
+
+
+def repin(vpc_names, region, images=None):
+    """ Move environments to the region's latest AMIs; in-place tiers replace their instances on the next deploy """
+    entry = refresh([region])[region]
+    with _lock:
+        pins = _load_pins()
+        moved = {}
+        for vpc_name in vpc_names:
+            current = pins.setdefault(aws_clients.scoped(vpc_name), {}).setdefault(region, {})
+            for image in images or sorted(current) or [DEFAULT_IMAGE]:
+                current[image] = entry["amis"].get(image, INSTANCE_BUILD_ITEMS[f"{image}id"])
+            moved[vpc_name] = dict(current)
+        _save_pins()
+        return moved
+
+
+def check_offered(region, size, zones):
+    """ Raise when an instance type is not offered in one of the AZs a tier uses """
+    entry = region_entry(region)
+    if not entry or size not in entry["offerings"]:
+        return
+    missing = sorted(set(zones) - set(entry["offerings"][size]))
+    if missing:
+        raise ValueError(f"{size} is not offered in {', '.join(missing)}")
+
+
+def catalog_rows(regions):
+    """ Rows for a catalog table """
+    rows = []
+    for region in regions:
+        entry = region_entry(region) or {"amis": {}, "offerings": {}, "fetched_at": 0}
+        fetched = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["fetched_at"])) if entry["fetched_at"] else "-"
+        amis = " ".join(f"{key}={value}" for key, value in sorted(entry["amis"].items()))
+        sizes = " ".join(f"{size}:{len(zones)}az" for size, zones in sorted(entry["offerings"].items()))
+        rows.append([region, fetched, amis, sizes])
+    return rows
+
+
+def reset():
+    """ Forget the in-memory copies of the catalog and the pins """
+    global _entries, _pins
+    with _lock:
+        _entries = None
+        _pins = None
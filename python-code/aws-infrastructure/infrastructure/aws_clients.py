@@ -0,0 +1,279 @@
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Connection pool per client; sized for the deploy engine's worker threads
+MAX_POOL_CONNECTIONS = int(os.environ.get("INFRA_MAX_POOL_CONNECTIONS", "20"))
+
+# botocore retry behaviour for every client, the only retry layer; request rates are shaped by the
+# shared buckets below
+RETRY_MODE = os.environ.get("INFRA_RETRY_MODE", "standard")
+MAX_ATTEMPTS = int(os.environ.get("INFRA_MAX_ATTEMPTS", "10"))
+
+# Requests per second and burst per API family ("service:read" or "service:write"),
+# shared by every client and thread in the process
+RATE_LIMITS = {
+    "ec2:read": (20.0, 40),
+    "ec2:write": (5.0, 10),
+    "cloudformation:read": (8.0, 16),
+    "cloudformation:write": (2.0, 4),
+    "route-53:read": (5.0, 5),
+    "route-53:write": (2.0, 4),
+}
+DEFAULT_RATE_LIMIT = (10.0, 20)
+
+# A throttled family drops to half its rate (never below this fraction) and
+# earns back this fraction of its full rate per successful call
+MIN_RATE_FRACTION = 0.1
+RATE_RECOVERY = 0.05
+
+# Error codes botocore retries as throttling; tracing counts them too
+THROTTLE_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottled",
+    "RequestLimitExceeded", "TooManyRequestsException", "SlowDown", "PriorRequestNotComplete",
+}
+
+READ_PREFIXES = ("Describe", "List", "Get")
+
+# Role assumed in each target account by fan-out deploys, and how long its credentials last
+# (seconds); botocore refreshes them shortly before they expire
+ASSUME_ROLE_NAME = os.environ.get("INFRA_ASSUME_ROLE", "InfrastructureDeployRole")
+ASSUME_ROLE_DURATION = 3600
+ASSUME_ROLE_SESSION_NAME = "aws-infrastructure"
+
+_lock = threading.Lock()
+_session = None
+_region_name = None
+# (account, role name, service, region) -> client
+_clients = {}
+# ((account, region), family) -> bucket
+_buckets = {}
+# (account, role name) -> boto3 Session with refreshable assumed-role credentials
+_target_sessions = {}
+_target_lock = threading.Lock()
+# Per thread (account, region, role name) set by use_target()
+_local = threading.local()
+
+
+class TokenBucket:
+    """ Blocking token bucket whose rate backs off on throttling and recovers on success """
+
+    def __init__(self, rate, burst):
+        self.max_rate = self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY)
+
+
+def api_family(service_id, operation_name):
+    """ Rate limit family of an operation, e.g. ec2 DescribeSubnets -> ec2:read """
+    return f"{service_id}:{'read' if operation_name.startswith(READ_PREFIXES) else 'write'}"
+
+
+def bucket(target_scope, family):
+    """ Bucket for an API family, shared by every client of the same (account, region) """
+    key = (target_scope, family)
+    with _lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(*RATE_LIMITS.get(family, DEFAULT_RATE_LIMIT))
+        return _buckets[key]
+
+
+def _family_from_event(event_name):
+    # before-send.ec2.DescribeVpcs / needs-retry.route-53.ChangeResourceRecordSets
+    _, service_id, operation_name = event_name.split(".", 2)
+    return api_family(service_id, operation_name)
+
+
+def _rate_limit(event_name, target_scope, **kwargs):
+    # Fires once per HTTP attempt, so botocore's retries wait for tokens too
+    bucket(target_scope, _family_from_event(event_name)).acquire()
+
+
+def _adapt_rate(event_name, target_scope, response, **kwargs):
+    if response is None:
+        return
+    family_bucket = bucket(target_scope, _family_from_event(event_name))
+    if response[1].get("Error", {}).get("Code") in THROTTLE_CODES:
+        family_bucket.throttled()
+    else:
+        family_bucket.succeeded()
+
+
+def error_code(error):
+    return error.response.get("Error", {}).get("Code", "")
+
+
+def is_throttle(error):
+    """ True for a ClientError worth retrying after a pause """
+    return error_code(error) in THROTTLE_CODES
+
+
+def is_missing(error):
+    """ True when a ClientError says the resource does not exist, as opposed to a transient failure """
+    code = error_code(error)
+    message = error.response.get("Error", {}).get("Message", "")
+    return code.endswith("NotFound") or code.startswith("NoSuch") or "does not exist" in message
+
+
+def configure(region_name=None):
+    """ Set the region used by clients that do not name one """
+    global _region_name
+    with _lock:
+        _region_name = region_name
+        _clients.clear()
+
+
+@contextmanager
+def use_target(account=None, region=None, role_name=ASSUME_ROLE_NAME):
+    """ Send this thread's calls to an account (through an assumed role) and region """
+    previous = getattr(_local, "target", None)
+    _local.target = (account, region, role_name)
+    try:
+        yield
+    finally:
+        _local.target = previous
+
+
+def current_target():
+    """ (account, region, role name) set by use_target(); account None means the caller's own credentials """
+    return getattr(_local, "target", None) or (None, None, ASSUME_ROLE_NAME)
+
+
+def scope():
+    """ (account, region) this thread's calls go to """
+    account, region, _ = current_target()
+    return account, region or _region_name
+
+
+def scoped(name):
+    """ A stack or VPC name qualified by the thread's target, for state kept across targets """
+    account, region, _ = current_target()
+    if account is None and region is None:
+        return name
+    return f"{account or 'default'}/{region or _region_name}/{name}"
+
+
+def region_name():
+    """ Region of this thread's target, else the one set by configure(), else None for the session default """
+    return current_target()[1] or _region_name
+
+
+def client_config(**overrides):
+    """ botocore Config applied to every client """
+    from botocore.config import Config
+    settings = {
+        "max_pool_connections": MAX_POOL_CONNECTIONS,
+        "retries": {"mode": RETRY_MODE, "max_attempts": MAX_ATTEMPTS},
+    }
+    settings.update(overrides)
+    return Config(**settings)
+
+
+def _instrument(session):
+    from infrastructure import tracing
+    tracing.instrument(session)
+
+
+def _rate_limited(new_client, target_scope):
+    """ Draw a client's requests from its own account and region's buckets, whichever thread sends them """
+    new_client.meta.events.register("before-send", functools.partial(_rate_limit, target_scope=target_scope))
+    new_client.meta.events.register("needs-retry", functools.partial(_adapt_rate, target_scope=target_scope))
+    return new_client
+
+
+def _default_session():
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.Session()
+            _instrument(_session)
+        return _session
+
+
+def _assumed_session(account, role_name):
+    """ Session whose credentials come from assuming a role in another account, refreshed before expiry """
+    import boto3
+    import botocore.session
+    from botocore.credentials import RefreshableCredentials
+    sts = _default_session().client("sts", config=client_config())
+    role_arn = f"arn:aws:iam::{account}:role/{role_name}"
+
+    def assume():
+        credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName=ASSUME_ROLE_SESSION_NAME,
+                                      DurationSeconds=ASSUME_ROLE_DURATION)["Credentials"]
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"].isoformat(),
+        }
+
+    core = botocore.session.get_session()
+    core._credentials = RefreshableCredentials.create_from_metadata(metadata=assume(), refresh_using=assume, method="sts-assume-role")
+    session = boto3.Session(botocore_session=core)
+    _instrument(session)
+    return session
+
+
+def get_session():
+    """ boto3 Session for this thread's target account, created on first use and shared by every module """
+    account, _, role_name = current_target()
+    if account is None:
+        return _default_session()
+    key = (account, role_name)
+    with _target_lock:
+        if key not in _target_sessions:
+            _target_sessions[key] = _assumed_session(account, role_name)
+        return _target_sessions[key]
+
+
+def client(service_name, region_name=None):
+    """ Cached client for a service in this thread's target account, created on first use """
+    account, target_region, role_name = current_target()
+    region_name = region_name or target_region or _region_name
+    key = (account, role_name, service_name, region_name)
+    cached = _clients.get(key)
+    if cached is not None:
+        return cached
+    session = get_session()
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _rate_limited(session.client(service_name, region_name=region_name, config=client_config()),
+                                          (account, region_name))
+        return _clients[key]
+
+
+def reset():
+    """ Drop the sessions and every cached client """
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _buckets.clear()
+    with _target_lock:
+        _target_sessions.clear()
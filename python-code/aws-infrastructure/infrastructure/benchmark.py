@@ -0,0 +1,82 @@
+import contextlib
+import io
+import time
+from infrastructure import ami_catalog, infra_instances, return_vpc_component_ids, template_factory
+
+# Default scale: 500 instances spread over 10 tiers
+BENCH_INSTANCES = 500
+BENCH_TIERS = 10
+BENCH_VPC_NAME = "dev"
+
+
+class _CannedPaginator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return iter(self.pages)
+
+
+class CannedEc2Client:
+    """ In-memory describe_vpcs/describe_subnets stand-in for timing the resolver """
+
+    def __init__(self, vpc_names, subnets_per_vpc=6, page_size=1000):
+        vpcs, subnets = [], []
+        for n, vpc_name in enumerate(vpc_names):
+            vpc_id = f"vpc-{n:017x}"
+            vpcs.append({"VpcId": vpc_id, "Tags": [{"Key": "Name", "Value": vpc_name}]})
+            for s in range(subnets_per_vpc):
+                tier = "public" if s < subnets_per_vpc // 2 else "private"
+                subnets.append({
+                    "SubnetId": f"subnet-{n:08x}{s:09x}",
+                    "VpcId": vpc_id,
+                    "Tags": [{"Key": "Name", "Value": f"{vpc_name}-{tier}subnet{s % (subnets_per_vpc // 2) + 1}"}],
+                })
+        self._pages = {
+            "describe_vpcs": [{"Vpcs": vpcs[i:i + page_size]} for i in range(0, len(vpcs), page_size)],
+            "describe_subnets": [{"Subnets": subnets[i:i + page_size]} for i in range(0, len(subnets), page_size)],
+        }
+
+    def get_paginator(self, operation_name):
+        return _CannedPaginator(self._pages[operation_name])
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def run(instances=BENCH_INSTANCES, tiers=BENCH_TIERS, vpc_name=BENCH_VPC_NAME):
+    """ Time ID resolution, template generation and YAML serialization; return (phase, seconds, items) rows """
+    rows = []
+    per_tier = max(1, instances // tiers)
+    tier_names = [f"bench{n}" for n in range(tiers)]
+
+    # ID resolution: one cold sweep, then a lookup per instance like the generators do
+    resolver = return_vpc_component_ids.VpcComponentResolver(CannedEc2Client([vpc_name] + [f"{vpc_name}{n}" for n in range(tiers)]))
+    seconds, _ = _timed(lambda: resolver.prefetch([vpc_name] + [f"{vpc_name}{n}" for n in range(tiers)]))
+    rows.append(("id resolution (cold sweep)", seconds, tiers + 1))
+    seconds, _ = _timed(lambda: [resolver.get_subnet_id(vpc_name, "publicsubnet1") for _ in range(per_tier * tiers)])
+    rows.append(("id resolution (cached lookups)", seconds, per_tier * tiers))
+
+    # Template generation and serialization with offline IDs
+    saved_counts = dict(infra_instances.INSTANCE_TIER_COUNT)
+    infra_instances.INSTANCE_TIER_COUNT.update({name: per_tier for name in tier_names})
+    try:
+        with return_vpc_component_ids.use_resolver(return_vpc_component_ids.OfflineResolver()), \
+                ami_catalog.cached_only(), contextlib.redirect_stdout(io.StringIO()):
+            seconds, templates = _timed(lambda: [infra_instances.build_instance_cfn_template(vpc_name, name) for name in tier_names])
+        resources = sum(len(t.resources) for t in templates)
+        rows.append(("template generation", seconds, resources))
+        seconds, bodies = _timed(lambda: [template_factory.render(t) for t in templates])
+        rows.append(("yaml serialization", seconds, resources))
+    finally:
+        infra_instances.INSTANCE_TIER_COUNT.clear()
+        infra_instances.INSTANCE_TIER_COUNT.update(saved_counts)
+    return rows
+
+
+def report_rows(rows):
+    """ Rows for a benchmark result table """
+    return [[phase, f"{seconds:.4f}s", items, f"{items / seconds:,.0f}/s" if seconds else "-"] for phase, seconds, items in rows]
@@ -0,0 +1,228 @@
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from infrastructure import aws_clients, deploy_engine, dns_sync, exports, infra_instances, stack_deploy, teardown, tracing
+from infrastructure.config import DNS_RECORD_TTL, INSTANCE_TIER_MODE
+
+# Tier suffix of the alternate stack; a tier's two stacks take turns serving
+GREEN_SUFFIX = "-green"
+
+# TTL of the weighted records; with CUTOVER_STEPS it bounds how long a cutover takes
+BLUE_GREEN_TTL = 60
+
+# Percentage of each record's traffic the new stack gets at each cutover step
+CUTOVER_STEPS = (10, 50, 100)
+
+# Ports probed once status checks pass; a host is up when any one of them accepts
+HEALTH_PORTS = {"bastion": (22,)}
+DEFAULT_HEALTH_PORTS = tuple(range(27016, 27021))
+
+# Seconds to wait for status checks, and between polls
+HEALTH_TIMEOUT = 900
+HEALTH_POLL = 15
+PROBE_TIMEOUT = 3
+PROBE_WORKERS = 32
+
+# describe_instance_status accepts at most this many IDs per call
+STATUS_BATCH = 100
+
+# Instance states that will never pass status checks
+DEAD_STATES = {"shutting-down", "terminated", "stopping", "stopped"}
+
+
+class RolloutFailed(Exception):
+    """ Raised when the new stack's instances do not become healthy """
+
+    def __init__(self, stack_name, unhealthy):
+        self.stack_name = stack_name
+        self.unhealthy = unhealthy
+        super().__init__(f"{stack_name}: {len(unhealthy)} unhealthy instance(s): {', '.join(sorted(unhealthy)[:10])}")
+
+
+def tier_stacks(vpc_name, instance_type):
+    """ (blue, green) stack names of a tier """
+    return (deploy_engine.stack_name_for(vpc_name, "instances", instance_type),
+            deploy_engine.stack_name_for(vpc_name, "instances", f"{instance_type}{GREEN_SUFFIX}"))
+
+
+def _serving_weights(vpc_name, instance_type):
+    """ Total weight per set identifier across a tier's private records """
+    zone_id = exports.export_value(vpc_name, "privateHostedZoneId")
+    weights = {}
+    for record_sets in dns_sync.weighted_records(zone_id, vpc_name, instance_type).values():
+        for set_identifier, record_set in record_sets.items():
+            weights[set_identifier] = weights.get(set_identifier, 0) + record_set["Weight"]
+    return weights
+
+
+def serving_stack(vpc_name, instance_type, client=None):
+    """ The stack currently serving a tier, or None before its first rollout """
+    client = client or aws_clients.client("cloudformation")
+    existing = [name for name in tier_stacks(vpc_name, instance_type) if stack_deploy.stack_status(client, name) not in stack_deploy.CREATE_STATUSES]
+    if len(existing) < 2:
+        return existing[0] if existing else None
+    # Both exist after an interrupted rollout: the records say which one serves
+    weights = _serving_weights(vpc_name, instance_type)
+    return max(existing, key=lambda name: weights.get(name, 0)) if weights else existing[0]
+
+
+def _unhealthy_statuses(ec2, stack_name, instance_ids):
+    unhealthy = set(instance_ids)
+    for start in range(0, len(instance_ids), STATUS_BATCH):
+        response = ec2.describe_instance_status(InstanceIds=instance_ids[start:start + STATUS_BATCH], IncludeAllInstances=True)
+        for status in response["InstanceStatuses"]:
+            if status["InstanceState"]["Name"] in DEAD_STATES:
+                raise RolloutFailed(stack_name, [f"{status['InstanceId']} is {status['InstanceState']['Name']}"])
+            if status["InstanceStatus"]["Status"] == "ok" and status["SystemStatus"]["Status"] == "ok":
+                unhealthy.discard(status["InstanceId"])
+    return unhealthy
+
+
+def probe(address, ports, timeout=PROBE_TIMEOUT):
+    """ True when any of the ports accepts a TCP connection """
+    for port in ports:
+        try:
+            with socket.create_connection((address, port), timeout=timeout):
+                return True
+        except OSError:
+            continue
+    return False
+
+
+@tracing.traced("health gate")
+def wait_healthy(stack_name, instance_type, instances, check_ports=False, timeout=HEALTH_TIMEOUT, poll=HEALTH_POLL):
+    """ Wait for EC2 status checks (and optionally a TCP probe) on every instance; raise RolloutFailed on timeout """
+    if not instances:
+        raise RolloutFailed(stack_name, ["no running instances"])
+    ec2 = aws_clients.client("ec2")
+    by_id = {instance["InstanceId"]: name for name, instance in instances.items()}
+    deadline = time.monotonic() + timeout
+    pending = list(by_id)
+    while True:
+        pending = sorted(_unhealthy_statuses(ec2, stack_name, pending))
+        print(f"{stack_name}: {len(by_id) - len(pending)}/{len(by_id)} instances passed status checks")
+        if not pending:
+            break
+        if time.monotonic() + poll > deadline:
+            raise RolloutFailed(stack_name, [by_id[instance_id] for instance_id in pending])
+        time.sleep(poll)
+
+    if not check_ports:
+        return
+    ports = HEALTH_PORTS.get(instance_type, DEFAULT_HEALTH_PORTS)
+    # Bastions are probed from outside the VPC; other tiers need a route to their private addresses
+    key = "PublicIpAddress" if instance_type == "bastion" else "PrivateIpAddress"
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+        results = dict(zip(instances, pool.map(lambda instance: probe(instance.get(key), ports) if instance.get(key) else False,
+                                               instances.values())))
+    failed = [name for name, up in results.items() if not up]
+    if failed:
+        raise RolloutFailed(stack_name, failed)
+    print(f"{stack_name}: {len(results)} instances accept connections on {', '.join(map(str, ports))}")
+
+
+def weighted_record(name, set_identifier, address, weight, ttl=BLUE_GREEN_TTL):
+    return {"Name": name, "Type": "A", "SetIdentifier": set_identifier, "Weight": weight, "TTL": ttl,
+            "ResourceRecords": [{"Value": address}]}
+
+
+def cutover_changes(new_records, new_stack, old_stack, weight, simple, weighted, ttl=BLUE_GREEN_TTL):
+    """ Route53 changes giving new_stack `weight` percent of each record it serves in one zone """
+    changes = []
+    # Plain records become weighted ones in the same batch; a name cannot hold both kinds.
+    # Each pair weighs 2 and comes first, so dns_sync.batches never splits one
+    for name, record_set in sorted(simple.items()):
+        changes.append({"Action": "DELETE", "ResourceRecordSet": record_set})
+        old_weight = 100 - weight if name in new_records else 100
+        changes.append({"Action": "CREATE", "ResourceRecordSet": weighted_record(
+            name, old_stack, record_set["ResourceRecords"][0]["Value"], old_weight, ttl)})
+    for name, address in sorted(new_records.items()):
+        changes.append({"Action": "UPSERT", "ResourceRecordSet": weighted_record(name, new_stack, address, weight, ttl)})
+        for set_identifier, record_set in sorted(weighted.get(name, {}).items()):
+            if set_identifier != new_stack and record_set["Weight"] != 100 - weight:
+                changes.append({"Action": "UPSERT", "ResourceRecordSet": {**record_set, "Weight": 100 - weight}})
+    return changes
+
+
+def _apply(route53, zone_id, changes, comment):
+    """ Submit changes in batches and wait until Route53 reports them in sync """
+    waiter = route53.get_waiter("resource_record_sets_changed")
+    for batch in dns_sync.batches(changes):
+        response = route53.change_resource_record_sets(HostedZoneId=zone_id, ChangeBatch={"Comment": comment, "Changes": batch})
+        waiter.wait(Id=response["ChangeInfo"]["Id"])
+
+
+@tracing.traced("cutover")
+def cutover(vpc_name, instance_type, new_stack, old_stack, instances, steps=CUTOVER_STEPS, ttl=BLUE_GREEN_TTL):
+    """ Shift a tier's records to new_stack's instances in weighted steps, waiting one TTL after each """
+    route53 = aws_clients.client("route53")
+    desired = dns_sync.desired_records(vpc_name, instance_type, instances)
+    for number, weight in enumerate(steps, start=1):
+        # Resolvers may still hold a plain record for its longer TTL after the first step
+        wait = ttl
+        for zone_id, new_records in desired.items():
+            simple = dns_sync.live_records(zone_id, vpc_name, instance_type) if number == 1 else {}
+            if simple:
+                wait = max(wait, max(record_set.get("TTL", DNS_RECORD_TTL) for record_set in simple.values()))
+            changes = cutover_changes(new_records, new_stack, old_stack or "in-place", weight, simple, dns_sync.weighted_records(zone_id, vpc_name, instance_type), ttl)
+            _apply(route53, zone_id, changes, f"{vpc_name} {instance_type} cutover to {new_stack} at {weight}%")
+        print(f"{vpc_name} {instance_type}: {new_stack} serving {weight}%, waiting {wait}s for resolvers")
+        time.sleep(wait)
+
+
+def retire_records(vpc_name, instance_type, keep=None):
+    """ Delete the weighted records this environment's tier stacks own, except those of `keep`; return how many were deleted """
+    route53 = aws_clients.client("route53")
+    # Plain records converted before the tier's first rollout carry "in-place"
+    owned = (set(tier_stacks(vpc_name, instance_type)) | {"in-place"}) - {keep}
+    total = 0
+    for zone_id in dns_sync.desired_records(vpc_name, instance_type, {}):
+        changes = [{"Action": "DELETE", "ResourceRecordSet": record_set}
+                   for record_sets in dns_sync.weighted_records(zone_id, vpc_name, instance_type).values()
+                   for set_identifier, record_set in sorted(record_sets.items()) if set_identifier in owned]
+        if changes:
+            _apply(route53, zone_id, changes, f"{vpc_name} {instance_type} retire records")
+        total += len(changes)
+    return total
+
+
+def rollout(vpc_name, instance_type, check_ports=False, steps=CUTOVER_STEPS, ttl=BLUE_GREEN_TTL):
+    """ Deploy the idle stack of a tier, health-gate it, move DNS over and delete the old stack """
+    try:
+        if INSTANCE_TIER_MODE.get(instance_type) == "autoscaling":
+            raise ValueError(f"{instance_type} is an Auto Scaling tier; its instances register their own DNS records")
+        client = aws_clients.client("cloudformation")
+        blue, green = tier_stacks(vpc_name, instance_type)
+        old_stack = serving_stack(vpc_name, instance_type, client)
+        new_stack = green if old_stack == blue else blue
+        print(f"{vpc_name} {instance_type}: {old_stack or 'nothing'} is serving, rolling out {new_stack}")
+
+        # The idle stack never serves, so one left unusable by a failed create is deleted first
+        if stack_deploy.stack_status(client, new_stack) in stack_deploy.RECREATE_STATUSES:
+            print(f"Deleting {new_stack} before recreating it")
+            teardown.teardown([new_stack])
+        stack_action = stack_deploy.stack_action(client, new_stack)
+        deployed = infra_instances.generate_instance_cfn_template(vpc_name, new_stack, instance_type, stack_action)
+        try:
+            if not deployed:
+                raise RolloutFailed(new_stack, ["stack deploy failed"])
+            instances = dns_sync.tier_instances(vpc_name, instance_type, stack_name=new_stack)
+            wait_healthy(new_stack, instance_type, instances, check_ports)
+        except RolloutFailed as e:
+            # Nothing points at the new stack yet, so the old one keeps serving
+            print(f"Rollout aborted, deleting {new_stack}: {e}")
+            teardown.teardown([new_stack])
+            return False
+
+        cutover(vpc_name, instance_type, new_stack, old_stack, instances, steps if old_stack else steps[-1:], ttl)
+        print(f"{vpc_name} {instance_type}: deleted {retire_records(vpc_name, instance_type, keep=new_stack)} old records")
+        if old_stack:
+            # Record sets of an in-place stack were removed by the cutover, so they are retained if they fail
+            tasks = teardown.teardown([old_stack], retain_failed=True)
+            if any(task.status != deploy_engine.SUCCEEDED for task in tasks):
+                print(f"{new_stack} is serving but {old_stack} was not deleted")
+                return False
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return False
+    return True
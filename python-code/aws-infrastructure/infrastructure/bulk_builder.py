@@ -0,0 +1,226 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+from infrastructure import ami_catalog, aws_clients, dns_sync, exports, network_layout, return_vpc_component_ids, stack_sharding, template_factory
+from infrastructure.config import INSTANCE_BUILD_ITEMS, INSTANCE_TIER_COUNT, VPC_TOPOLOGY, DNS_RECORD_TTL
+from infrastructure.config import dns_name, public_dns_name
+
+# Instances rendered per write when streaming a template
+BULK_CHUNK = 500
+
+_SEPARATORS = (",", ":")
+
+
+class TierContext(NamedTuple):
+    """ Everything a worker needs to render a tier's resources without AWS calls """
+    vpc_name: str
+    instance_type: str
+    count: int
+    image_id: str
+    size: str
+    keypair: str
+    subnet_id: str
+    security_group_export: str
+    dns_records: bool
+    ttl: str
+
+
+def tier_context(vpc_name, instance_type, region=None):
+    """ Resolve IDs, AMI and size once, in the parent process """
+    topology = (VPC_TOPOLOGY.get(vpc_name) or network_layout.TopologySpec())._replace(region=region or aws_clients.region_name() or network_layout.TopologySpec().region)
+    zones = network_layout.availability_zones(topology.region, topology.az_count)
+    size = ami_catalog.instance_size(vpc_name, instance_type)
+    ami_catalog.check_offered(topology.region, size, zones[:1])
+    return TierContext(
+        vpc_name=vpc_name,
+        instance_type=instance_type,
+        count=INSTANCE_TIER_COUNT[instance_type],
+        image_id=ami_catalog.ami_id(topology.region, vpc_name),
+        size=size,
+        keypair=INSTANCE_BUILD_ITEMS["keypair"],
+        subnet_id=return_vpc_component_ids.get_subnet_id(vpc_name, "publicsubnet1"),
+        security_group_export=exports.export_name(vpc_name, "BastionSg" if instance_type == "bastion" else "MongodbSg"),
+        dns_records=dns_sync.stack_managed(instance_type),
+        ttl=str(DNS_RECORD_TTL),
+    )
+
+
+def resources_per_instance(ctx):
+    if not ctx.dns_records:
+        return 1
+    return 3 if ctx.instance_type == "bastion" else 2
+
+
+def _record(name, zone_parts, comment, record_parts, attribute, ttl):
+    return {
+        "Properties": {
+            "HostedZoneName": {"Fn::Join": ["", zone_parts]},
+            "Comment": comment,
+            "Name": {"Fn::Join": ["", record_parts]},
+            "Type": "A",
+            "TTL": ttl,
+            "ResourceRecords": [{"Fn::GetAtt": [name, attribute]}],
+        },
+        "Type": "AWS::Route53::RecordSet",
+    }
+
+
+def instance_resources(ctx, number):
+    """ (logical id, resource dict) pairs for one instance, matching build_instance_cfn_template """
+    name = f"{ctx.instance_type}{number}"
+    yield name, {
+        "Properties": {
+            "ImageId": ctx.image_id,
+            "UserData": {"Fn::Base64": {"Fn::Join": ["", ["#!/bin/bash\nsudo hostnamectl set-hostname ", name, "\n"]]}},
+            "InstanceType": ctx.size,
+            "KeyName": ctx.keypair,
+            "SecurityGroupIds": [{"Fn::ImportValue": ctx.security_group_export}],
+            "SubnetId": ctx.subnet_id,
+            "Tags": [{"Key": "Environment", "Value": ctx.vpc_name}, {"Key": "Name", "Value": name}],
+        },
+        "Type": "AWS::EC2::Instance",
+    }
+    if not ctx.dns_records:
+        return
+    yield f"{name}PrivateDNSRecord", _record(
+        name, [ctx.vpc_name, ".", dns_name, "."], f"DNS name for {name}.",
+        [name, ".", ctx.vpc_name, ".", dns_name, "."], "PrivateIp", ctx.ttl)
+    if ctx.instance_type == "bastion":
+        yield f"{name}PublicDNSRecord", _record(
+            name, [public_dns_name, "."], f"Public DNS name for {name}.",
+            [name, ".", ctx.vpc_name, ".", public_dns_name, "."], "PublicIp", ctx.ttl)
+
+
+def render_resources(ctx, start, stop):
+    """ JSON members ("id":{...},...) for instances start..stop-1 """
+    return ",".join(
+        f"{json.dumps(name)}:{json.dumps(body, separators=_SEPARATORS)}"
+        for number in range(start, stop) for name, body in instance_resources(ctx, number)
+    )
+
+
+def _head(description):
+    return (f'{{"AWSTemplateFormatVersion":{json.dumps(template_factory.TEMPLATE_VERSION)},'
+            f'"Description":{json.dumps(description)},"Resources":{{')
+
+
+def render_template(ctx, start, stop, description):
+    """ Complete JSON template for instances start..stop-1 """
+    return _head(description) + render_resources(ctx, start, stop) + "}}"
+
+
+def _chunks(start, stop, size):
+    return [(number, min(number + size, stop)) for number in range(start, stop, size)]
+
+
+def stream_template(out, ctx, description, start=0, stop=None, chunk=BULK_CHUNK):
+    """ Write the template for instances start..stop-1 to a file or buffer a chunk at a time; return resources written """
+    stop = ctx.count if stop is None else stop
+    out.write(_head(description))
+    for number, (first, last) in enumerate(_chunks(start, stop, chunk)):
+        if number:
+            out.write(",")
+        out.write(render_resources(ctx, first, last))
+    out.write("}}")
+    return (stop - start) * resources_per_instance(ctx)
+
+
+def _render_shard(args):
+    """ Write one shard to a file in directory, serialized as stack_sharding.nest would; return (path, store key) """
+    ctx, start, stop, stack_name, directory = args
+    resources = dict(pair for number in range(start, stop) for pair in instance_resources(ctx, number))
+    body = stack_sharding.shard_body(stack_name, resources)
+    path = os.path.join(directory, f"shard-{start}.json")
+    with open(path, "w") as f:
+        f.write(body)
+    return path, stack_sharding.shard_key(stack_name, body)
+
+
+def instances_per_shard(ctx):
+    """ Instances that fit in one nested stack under the shard resource and size limits """
+    sample = len(render_resources(ctx, 0, 1)) + 1
+    return max(1, min(stack_sharding.SHARD_MAX_RESOURCES // resources_per_instance(ctx), stack_sharding.SHARD_MAX_BYTES // sample))
+
+
+def needs_nesting(ctx):
+    """ True when the tier will not fit in one TemplateBody """
+    sample = len(render_resources(ctx, 0, 1)) + 1
+    return (ctx.count * resources_per_instance(ctx) > stack_sharding.SHARD_MAX_RESOURCES
+            or ctx.count * sample > template_factory.MAX_TEMPLATE_BODY_BYTES)
+
+
+def nest_tier(ctx, stack_name, store, workers=None):
+    """ Render shards to temporary files across a process pool, upload them, and return the parent template body """
+    ranges = _chunks(0, ctx.count, instances_per_shard(ctx))
+    resources = {}
+    # Spawned workers do not inherit the parent's boto3 clients and locks; shard bodies stay on disk, not in the result pipe
+    with tempfile.TemporaryDirectory(prefix="infra-shards-") as directory, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        shard_args = [(ctx, start, stop, stack_name, directory) for start, stop in ranges]
+        for number, (path, key) in enumerate(pool.map(_render_shard, shard_args), start=1):
+            resources[f"Shard{number}"] = {"Properties": {"TemplateURL": store.put_file(key, path)},
+                                           "Type": "AWS::CloudFormation::Stack"}
+    return json.dumps({
+        "AWSTemplateFormatVersion": template_factory.TEMPLATE_VERSION,
+        "Description": f"{ctx.vpc_name} {ctx.instance_type}-instances stack",
+        "Resources": resources,
+    }, separators=_SEPARATORS)
+
+
+def render_tier(vpc_name, stack_name, instance_type, store=None, workers=None, region=None):
+    """ Bulk-build an instance tier; return (template body, resources, shards) """
+    ctx = tier_context(vpc_name, instance_type, region)
+    if needs_nesting(ctx):
+        if store is None:
+            raise ValueError(f"{stack_name} is too large for one stack; set INFRA_TEMPLATE_BUCKET to deploy it as nested stacks")
+        body = nest_tier(ctx, stack_name, store, workers)
+        return body, ctx.count * resources_per_instance(ctx), len(json.loads(body)["Resources"])
+    # A tier that fits one stack is at most SHARD_MAX_RESOURCES resources, too few to be worth a pool
+    out = io.StringIO()
+    count = stream_template(out, ctx, f"{vpc_name} {instance_type}-instances stack")
+    return out.getvalue(), count, 0
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _measure(path, count, workers):
+    """ Run one build path in a fresh interpreter; return (seconds, resources, self RSS MB, workers RSS MB) """
+    from infrastructure import infra_instances
+    INSTANCE_TIER_COUNT["bench"] = count
+    store = stack_sharding.LocalTemplateStore(tempfile.mkdtemp(prefix="infra-bulk-"))
+    with return_vpc_component_ids.use_resolver(return_vpc_component_ids.OfflineResolver()), \
+            ami_catalog.cached_only(), contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        if path == "template":
+            t = infra_instances.build_instance_cfn_template("dev", "bench")
+            resources = len(t.resources)
+            if stack_sharding.needs_sharding(t):
+                t = stack_sharding.nest(t, "dev-bench-instances", store)
+            template_factory.render(t)
+        else:
+            _, resources, _ = render_tier("dev", "dev-bench-instances", "bench", store, workers)
+        seconds = time.perf_counter() - started
+    return seconds, resources, _peak_rss_mb(resource.RUSAGE_SELF), _peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+
+def compare(count, workers=None):
+    """ Time the troposphere path against the bulk path; return report rows """
+    rows = []
+    spawn = multiprocessing.get_context("spawn")
+    for path in ("template", "bulk"):
+        # A fresh process per path keeps the peak RSS figures separate
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as runner:
+            seconds, resources, self_rss, child_rss = runner.submit(_measure, path, count, workers).result()
+        rows.append([path, resources, f"{seconds:.2f}s", f"{resources / seconds:,.0f}/s" if seconds else "-",
+                     f"{self_rss:.0f} MB", f"{child_rss:.0f} MB" if path == "bulk" else "-"])
+    return rows
@@ -0,0 +1,82 @@
+import os
+
+# Settings shared by the template modules and the CLI. Kept free of boto3
+# and troposphere imports so commands can read them without loading either.
+
+# Enum for VPC CIDR Octet
+NETWORK_OCTETS = {
+    "dev": "192.168",
+    "stage": "10.22",
+    "prod": "10.23",
+}
+
+# Local state (stack fingerprints, caches, CIDR allocations)
+STATE_DIR = os.environ.get("INFRA_STATE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "aws-infrastructure"))
+
+# Octets preflight --auto-allocate gave environments whose default /16 clashed, keyed by
+# aws_clients.scoped(environment); preflight.vpc_octets() prefers them to NETWORK_OCTETS
+# in the target they were allocated for
+ALLOCATIONS_FILE = os.path.join(STATE_DIR, "network_allocations.json")
+
+# Per-environment subnet layouts (network_layout.TopologySpec); environments
+# not listed use the TopologySpec defaults
+VPC_TOPOLOGY = {}
+
+# Dict for build components
+INSTANCE_BUILD_ITEMS = {
+    "keypair": "abs-key",
+    "ubuntu22id": "ami-005fc0f236362e99f",
+    "ubuntu24id": "ami-0e2c8caa4b6378d8c",
+    "baseinstancetype": "m3.medium",
+}
+
+# EC2 instance type per environment and tier, e.g. {"prod": {"appserver": "m7i.large"}};
+# anything unlisted runs INSTANCE_BUILD_ITEMS["baseinstancetype"]. AMI IDs come from
+# ami_catalog, pinned per environment, with the IDs above as the fallback when no catalog is available
+INSTANCE_TIER_SIZE = {}
+
+# Tiers of at least this many instances ("instances" mode) are rendered by bulk_builder
+# across a process pool instead of through troposphere objects
+BULK_BUILD_THRESHOLD = 1000
+
+# Instance Class Count
+INSTANCE_TIER_COUNT = {
+    "bastion": 1,
+    "appserver": 1,
+}
+
+# How each tier is built: "instances" emits one ec2.Instance per count,
+# "autoscaling" a LaunchTemplate and an AutoScalingGroup over the private subnets
+INSTANCE_TIER_MODE = {
+    "bastion": "instances",
+    "appserver": "instances",
+}
+
+# Where instance tiers get their DNS records: "stack" emits RecordSetType resources,
+# "sync" leaves them out of the stack and dns_sync manages them in batches
+INSTANCE_DNS_MODE = {
+    "bastion": "stack",
+    "appserver": "stack",
+}
+
+# How instance tier updates roll out: "in-place" updates the tier's stack, "blue-green"
+# brings up a second stack, health-checks it and moves weighted DNS records over
+INSTANCE_ROLLOUT = {
+    "bastion": "in-place",
+    "appserver": "in-place",
+}
+
+# TTL (seconds) of the records instances register in the private hosted zone
+DNS_RECORD_TTL = 900
+
+# DNS Information and Suffix 
+dns_name = "multilabs"
+public_dns_name = "pubs.com"
+public_dns_id = "847RTR5SC3"
+
+# Environments that keep the unscoped export names (infrastructure-vpcid,
+# Infrastructure-BastionSg, ...) until their stacks are recreated; at most one per region
+LEGACY_EXPORT_ENVIRONMENTS = ()
+
+# S3 bucket holding nested stack templates for tiers too large for one stack
+TEMPLATE_BUCKET = os.environ.get("INFRA_TEMPLATE_BUCKET")
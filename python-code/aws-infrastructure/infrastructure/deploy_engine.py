@@ -0,0 +1,152 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Worker pool size for concurrent stack deploys
+MAX_PARALLEL_STACKS = 4
+
+# Stack kinds and the kinds whose exports they import
+STACK_DEPENDENCIES = {
+    "vpc": [],
+    "security-groups": ["vpc"],
+    "instances": ["vpc", "security-groups"],
+}
+
+# Task states
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+SKIPPED = "SKIPPED"
+
+
+def stack_name_for(vpc_name, kind, tier=None):
+    """ Return the stack name for an environment's VPC, security group or instance tier """
+    if kind == "instances":
+        return f"{vpc_name}-{tier}-instances"
+    return f"{vpc_name}-{kind}"
+
+
+class StackTask:
+    """ One stack deploy in the plan and its dependencies """
+
+    def __init__(self, stack_name, deploy, depends_on=()):
+        self.stack_name = stack_name
+        self.deploy = deploy
+        self.depends_on = list(depends_on)
+        self.status = PENDING
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+
+def print_status(task):
+    """ Default status reporter """
+    print(f"[{time.strftime('%H:%M:%S')}] {task.stack_name:<40} {task.status}")
+
+
+def plan_stacks(vpc_names, tiers):
+    """ List (stack name, kind, vpc name, tier, dependencies) for every stack of each environment """
+    stacks = []
+    for vpc_name in vpc_names:
+        names = {kind: stack_name_for(vpc_name, kind) for kind in ("vpc", "security-groups")}
+        stacks.append((names["vpc"], "vpc", vpc_name, None, []))
+        stacks.append((names["security-groups"], "security-groups", vpc_name, None,
+                       [names[kind] for kind in STACK_DEPENDENCIES["security-groups"]]))
+        for tier in tiers:
+            stacks.append((stack_name_for(vpc_name, "instances", tier), "instances", vpc_name, tier,
+                           [names[kind] for kind in STACK_DEPENDENCIES["instances"]]))
+    return stacks
+
+
+def build_plan(vpc_names, tiers, region, hostedzone_name):
+    """ Build the VPC -> security group -> instance tier DAG for each environment """
+    from infrastructure import create_vpc, infra_instances
+
+    deployers = {
+        "vpc": lambda stack_name, vpc_name, tier: create_vpc.create_update_cfn_template(vpc_name, region, hostedzone_name, stack_name),
+        "security-groups": lambda stack_name, vpc_name, tier: infra_instances.create_update_security_group_template(vpc_name, stack_name),
+        "instances": lambda stack_name, vpc_name, tier: infra_instances.create_update_instance_template(vpc_name, stack_name, tier),
+    }
+    return [
+        StackTask(stack_name, lambda d=deployers[kind], s=stack_name, v=vpc_name, i=tier: d(s, v, i), depends_on)
+        for stack_name, kind, vpc_name, tier, depends_on in plan_stacks(vpc_names, tiers)
+    ]
+
+
+def run_plan(tasks, max_workers=MAX_PARALLEL_STACKS, reporter=print_status):
+    """ Deploy every task once its dependencies succeed, running independent stacks concurrently """
+    by_name = {task.stack_name: task for task in tasks}
+    for task in tasks:
+        missing = [name for name in task.depends_on if name not in by_name]
+        if missing:
+            raise ValueError(f"{task.stack_name} depends on unknown stacks {missing}")
+
+    lock = threading.Lock()
+
+    def set_status(task, status):
+        with lock:
+            task.status = status
+        reporter(task)
+
+    def execute(task):
+        task.started = time.monotonic()
+        set_status(task, RUNNING)
+        try:
+            ok = task.deploy()
+        except Exception as e:
+            task.error = str(e)
+            ok = False
+        task.finished = time.monotonic()
+        set_status(task, SUCCEEDED if ok is not False else FAILED)
+
+    def skip_reason(task):
+        """ Why a task can never run: the first dependency that failed or was skipped, following the graph """
+        for name in task.depends_on:
+            status = by_name[name].status
+            if status == FAILED:
+                return f"{name} failed"
+            if status == SKIPPED:
+                return f"{name} was skipped"
+        return None
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Skips cascade down the graph until nothing changes, whatever order the tasks are listed in
+            skipped = True
+            while skipped:
+                skipped = False
+                for task in tasks:
+                    reason = skip_reason(task) if task.status == PENDING else None
+                    if reason:
+                        task.error = reason
+                        set_status(task, SKIPPED)
+                        skipped = True
+            for task in tasks:
+                if task.status == PENDING and all(by_name[name].status == SUCCEEDED for name in task.depends_on):
+                    task.status = RUNNING
+                    running[executor.submit(execute, task)] = task
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+
+    # Anything still pending sits on a dependency cycle
+    for task in tasks:
+        if task.status == PENDING:
+            task.error = "dependency cycle"
+            set_status(task, SKIPPED)
+    return tasks
+
+
+def summary_rows(tasks):
+    """ Rows for a per-stack result table """
+    return [[task.stack_name, task.status, f"{task.duration:.1f}s", task.error or ""] for task in tasks]
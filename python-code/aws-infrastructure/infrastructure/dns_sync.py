@@ -0,0 +1,131 @@
+import re
+from infrastructure import aws_clients, exports
+from infrastructure.config import DNS_RECORD_TTL, INSTANCE_DNS_MODE, INSTANCE_ROLLOUT, dns_name, public_dns_name, public_dns_id
+
+# Route53 accepts up to 1000 changes per call; an UPSERT counts as two
+MAX_CHANGE_WEIGHT = 1000
+CHANGE_WEIGHT = {"CREATE": 1, "DELETE": 1, "UPSERT": 2}
+
+def stack_managed(instance_type):
+    """ True when a tier's records are RecordSetType resources in its stack """
+    return INSTANCE_DNS_MODE.get(instance_type) != "sync" and INSTANCE_ROLLOUT.get(instance_type) != "blue-green"
+
+
+def _host_pattern(instance_type):
+    return re.compile(rf"^{re.escape(instance_type)}\d+$")
+
+
+def tier_instances(vpc_name, instance_type, stack_name=None):
+    """ Running instances of a tier (optionally of one stack), keyed by their Name tag """
+    instances = {}
+    pattern = _host_pattern(instance_type)
+    paginator = aws_clients.client("ec2").get_paginator("describe_instances")
+    filters = [
+        {"Name": "tag:Environment", "Values": [vpc_name]},
+        {"Name": "tag:Name", "Values": [f"{instance_type}*"]},
+        {"Name": "instance-state-name", "Values": ["pending", "running"]},
+    ]
+    if stack_name:
+        filters.append({"Name": "tag:aws:cloudformation:stack-name", "Values": [stack_name]})
+    for page in paginator.paginate(Filters=filters):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                name = next((tag["Value"] for tag in instance.get("Tags", []) if tag["Key"] == "Name"), None)
+                if name and pattern.match(name):
+                    instances[name] = instance
+    return instances
+
+
+def desired_records(vpc_name, instance_type, instances):
+    """ {zone id: {record name: ip}} for a tier's private (and bastion public) records """
+    private_zone_id = exports.export_value(vpc_name, "privateHostedZoneId")
+    records = {private_zone_id: {}}
+    if instance_type == "bastion":
+        records[public_dns_id] = {}
+    for name, instance in instances.items():
+        if instance.get("PrivateIpAddress"):
+            records[private_zone_id][f"{name}.{vpc_name}.{dns_name}."] = instance["PrivateIpAddress"]
+        if instance_type == "bastion" and instance.get("PublicIpAddress"):
+            records[public_dns_id][f"{name}.{vpc_name}.{public_dns_name}."] = instance["PublicIpAddress"]
+    return records
+
+
+def _owned(record_set, vpc_name, instance_type):
+    """ True for a tier's A record under this environment's names; the public zone is shared by every environment """
+    host, _, domain = record_set["Name"].partition(".")
+    return (record_set["Type"] == "A" and _host_pattern(instance_type).match(host) is not None
+            and domain in (f"{vpc_name}.{dns_name}.", f"{vpc_name}.{public_dns_name}."))
+
+
+def live_records(zone_id, vpc_name, instance_type):
+    """ Plain A records in a zone that belong to an environment's tier, as full record sets """
+    records = {}
+    paginator = aws_clients.client("route53").get_paginator("list_resource_record_sets")
+    for page in paginator.paginate(HostedZoneId=zone_id):
+        for record_set in page["ResourceRecordSets"]:
+            if "SetIdentifier" not in record_set and _owned(record_set, vpc_name, instance_type):
+                records[record_set["Name"]] = record_set
+    return records
+
+
+def weighted_records(zone_id, vpc_name, instance_type):
+    """ Weighted A records in a zone that belong to an environment's tier, as {record name: {set identifier: record set}} """
+    records = {}
+    paginator = aws_clients.client("route53").get_paginator("list_resource_record_sets")
+    for page in paginator.paginate(HostedZoneId=zone_id):
+        for record_set in page["ResourceRecordSets"]:
+            if "Weight" in record_set and _owned(record_set, vpc_name, instance_type):
+                records.setdefault(record_set["Name"], {})[record_set["SetIdentifier"]] = record_set
+    return records
+
+
+def diff_records(desired, live, ttl=DNS_RECORD_TTL):
+    """ Route53 changes that turn the live record sets into the desired ones """
+    changes = []
+    for name, address in sorted(desired.items()):
+        current = live.get(name)
+        values = [record["Value"] for record in current["ResourceRecords"]] if current else None
+        if values != [address] or current.get("TTL") != ttl:
+            changes.append({"Action": "UPSERT", "ResourceRecordSet": {
+                "Name": name, "Type": "A", "TTL": ttl, "ResourceRecords": [{"Value": address}],
+            }})
+    for name in sorted(set(live) - set(desired)):
+        changes.append({"Action": "DELETE", "ResourceRecordSet": live[name]})
+    return changes
+
+
+def batches(changes, max_weight=MAX_CHANGE_WEIGHT):
+    """ Split changes into change batches under the per-call limit """
+    batch, weight = [], 0
+    for change in changes:
+        change_weight = CHANGE_WEIGHT[change["Action"]]
+        if batch and weight + change_weight > max_weight:
+            yield batch
+            batch, weight = [], 0
+        batch.append(change)
+        weight += change_weight
+    if batch:
+        yield batch
+
+
+def sync_tier(vpc_name, instance_type, dry_run=False):
+    """ Bring a tier's DNS records in line with its running instances; return the number of changes """
+    if INSTANCE_ROLLOUT.get(instance_type) == "blue-green":
+        raise ValueError(f"{instance_type} records are weighted and owned by blue/green rollouts")
+    route53 = aws_clients.client("route53")
+    instances = tier_instances(vpc_name, instance_type)
+    total = 0
+    for zone_id, desired in desired_records(vpc_name, instance_type, instances).items():
+        changes = diff_records(desired, live_records(zone_id, vpc_name, instance_type))
+        total += len(changes)
+        for change in changes:
+            print(f"{zone_id} {change['Action']:<6} {change['ResourceRecordSet']['Name']}")
+        if dry_run:
+            continue
+        for batch in batches(changes):
+            route53.change_resource_record_sets(
+                HostedZoneId=zone_id,
+                ChangeBatch={"Comment": f"{vpc_name} {instance_type} DNS sync", "Changes": batch},
+            )
+    print(f"{vpc_name} {instance_type}: {total} DNS changes{' (dry run)' if dry_run else ''}")
+    return total
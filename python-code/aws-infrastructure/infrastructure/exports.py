@@ -0,0 +1,36 @@
+from infrastructure import aws_clients, deploy_engine
+from infrastructure.config import LEGACY_EXPORT_ENVIRONMENTS
+
+# Export keys owned by the security group stack; every other key belongs to the VPC stack
+SECURITY_GROUP_KEYS = ("BastionSg", "MongodbSg")
+
+
+def owner_stack(vpc_name, key):
+    """ Name of the stack that exports a key for an environment """
+    kind = "security-groups" if key in SECURITY_GROUP_KEYS else "vpc"
+    return deploy_engine.stack_name_for(vpc_name, kind)
+
+
+def export_name(vpc_name, key):
+    """ Export name for a key, scoped by the environment's owning stack (dev-vpc-vpcid, dev-security-groups-BastionSg) """
+    if vpc_name in LEGACY_EXPORT_ENVIRONMENTS:
+        # Names used before exports were scoped; only one environment per region can keep them
+        return f"{'Infrastructure' if key in SECURITY_GROUP_KEYS else 'infrastructure'}-{key}"
+    return f"{owner_stack(vpc_name, key)}-{key}"
+
+
+def import_value(vpc_name, key):
+    """ Fn::ImportValue of an environment's export """
+    from troposphere import ImportValue
+    return ImportValue(export_name(vpc_name, key))
+
+
+def export_value(vpc_name, key):
+    """ Live value of an environment's export """
+    name = export_name(vpc_name, key)
+    paginator = aws_clients.client("cloudformation").get_paginator("list_exports")
+    for page in paginator.paginate():
+        for export in page["Exports"]:
+            if export["Name"] == name:
+                return export["Value"]
+    raise LookupError(f"Export {name} not found")
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from infrastructure import aws_clients, deploy_engine, inventory, preflight, tracing
+from infrastructure.config import NETWORK_OCTETS, dns_name
+
+# Account/region groups deployed at once; their stack operations share one global cap
+MAX_PARALLEL_TARGETS = 8
+MAX_PARALLEL_STACKS = 8
+
+
+class Target(NamedTuple):
+    """ One environment in one account and region; account None deploys with the caller's own credentials """
+    account: str
+    region: str
+    environment: str
+
+
+def parse_target(spec):
+    """ Target from ACCOUNT/REGION/ENVIRONMENT; an account of "default" uses the caller's credentials """
+    parts = spec.split("/")
+    if len(parts) != 3 or not all(parts[1:]):
+        raise ValueError(f"Target {spec!r} is not ACCOUNT/REGION/ENVIRONMENT")
+    account, region, environment = parts
+    if environment not in NETWORK_OCTETS:
+        raise ValueError(f"Target {spec!r}: unknown environment {environment}")
+    return Target(None if account in ("", "default") else account, region, environment)
+
+
+def target_matrix(accounts, regions, environments):
+    """ Every account x region x environment combination """
+    return [Target(None if account == "default" else account, region, environment)
+            for account in accounts for region in regions for environment in environments]
+
+
+def target_label(account, region):
+    return f"{account or 'default'}/{region}"
+
+
+def _gated(deploy, gate, account, region, role_name):
+    """ Run a stack deploy under the global cap, with its target's credentials and region """
+    def run():
+        with gate, aws_clients.use_target(account, region, role_name):
+            return deploy()
+    return run
+
+
+def deploy_group(account, region, environments, tiers, gate, role_name=aws_clients.ASSUME_ROLE_NAME,
+                 max_workers=deploy_engine.MAX_PARALLEL_STACKS):
+    """ Preflight and deploy the environments of one account and region; return the finished tasks """
+    label = target_label(account, region)
+    with aws_clients.use_target(account, region, role_name), tracing.span("target", target=label):
+        problems = preflight.check(environments, region)
+        if problems:
+            raise ValueError("; ".join(problems))
+        tasks = deploy_engine.build_plan(environments, tiers, region, dns_name)
+    for task in tasks:
+        task.deploy = _gated(task.deploy, gate, account, region, role_name)
+
+    def reporter(task):
+        print(f"[{time.strftime('%H:%M:%S')}] {label:<24} {task.stack_name:<40} {task.status}")
+
+    return deploy_engine.run_plan(tasks, max_workers=max_workers, reporter=reporter)
+
+
+def fan_out(targets, tiers, max_stacks=MAX_PARALLEL_STACKS, max_targets=MAX_PARALLEL_TARGETS,
+            role_name=aws_clients.ASSUME_ROLE_NAME):
+    """ Deploy every target concurrently, grouped by account and region; return {target: (tasks, error, seconds)} """
+    groups = {}
+    for target in targets:
+        groups.setdefault((target.account, target.region), []).append(target.environment)
+    gate = threading.BoundedSemaphore(max_stacks)
+
+    def run(group):
+        account, region = group
+        started = time.monotonic()
+        try:
+            tasks, error = deploy_group(account, region, groups[group], tiers, gate, role_name, max_stacks), None
+        except Exception as e:
+            print(f"An error occurred in {target_label(account, region)}: {e}")
+            tasks, error = [], str(e)
+        return group, tasks, error, time.monotonic() - started
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_targets) as pool:
+        for (account, region), tasks, error, seconds in pool.map(run, list(groups)):
+            for environment in groups[(account, region)]:
+                own = [task for task in tasks if inventory.stack_identity(task.stack_name)[0] == environment]
+                results[Target(account, region, environment)] = (own, error, seconds)
+    return results
+
+
+def report_rows(results):
+    """ One row per target: stacks succeeded, overall status, time and the first error """
+    rows = []
+    for target, (tasks, error, seconds) in results.items():
+        succeeded = sum(task.status == deploy_engine.SUCCEEDED for task in tasks)
+        failed = next((task for task in tasks if task.status != deploy_engine.SUCCEEDED), None)
+        ran = [task for task in tasks if task.started is not None]
+        if ran:
+            seconds = max(task.finished or time.monotonic() for task in ran) - min(task.started for task in ran)
+        status = deploy_engine.SUCCEEDED if tasks and failed is None and not error else deploy_engine.FAILED
+        detail = error or (f"{failed.stack_name}: {failed.error or failed.status}" if failed else "")
+        rows.append([target.account or "default", target.region, target.environment, f"{succeeded}/{len(tasks)}",
+                     status, f"{seconds:.1f}s", detail])
+    return rows
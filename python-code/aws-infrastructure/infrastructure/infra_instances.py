@@ -1,135 +1,138 @@
-from troposphere import Template, Ref, Tags, GetAtt, Output, Export, Sub, ImportValue, Base64, Join
-from troposphere import ec2, route53
+from troposphere import Ref, GetAtt, Output, Export, Base64, Join, Sub, Parameter
+from troposphere import autoscaling, ec2, iam
 from troposphere.route53 import RecordSetType
-import boto3
-from botocore.exceptions import ClientError
-from infrastructure import return_vpc_component_ids
-
-# Create a new AWS cloudFormation template
-t = Template()
-
-cfn_template = boto3.client('cloudformation')
-
-
-# Dict for build components
-INSTANCE_BUILD_ITEMS = {
-    "keypair": "abs-key",
-    "ubuntu22id": "ami-005fc0f236362e99f",
-    "ubuntu24id": "ami-0e2c8caa4b6378d8c",
-    "baseinstancetype": "m3.medium",
-}
-
-# Instance Class Count
-INSTANCE_TIER_COUNT = {
-    "bastion": 1,
-    "appserver": 1,
-}
-
-# DNS Information and Suffix 
-dns_name = "multilabs"
-public_dns_name = "pubs.com"
-public_dns_id = "847RTR5SC3"
-
-
-# Check Stack Status
-def stack_exists(stack_name, required_status):
-    try:
-        response = cfn_template.describe_stacks(
-            StackName=stack_name
-        )
-    except ClientError:
-        return False
-    return response['Stacks'][0]['StackStatus'] == required_status
+from infrastructure import ami_catalog, aws_clients, dns_sync, exports, network_layout, return_vpc_component_ids, stack_deploy, stack_sharding, template_cache, template_factory, tracing
+from infrastructure.config import BULK_BUILD_THRESHOLD, TEMPLATE_BUCKET, INSTANCE_BUILD_ITEMS, INSTANCE_TIER_COUNT, INSTANCE_TIER_MODE, INSTANCE_DNS_MODE, INSTANCE_ROLLOUT, VPC_TOPOLOGY, DNS_RECORD_TTL
+from infrastructure.config import dns_name, public_dns_name
+
+# Lifecycle hook that holds new Auto Scaling instances until they register in DNS
+DNS_LIFECYCLE_HOOK = "register-private-dns"
+
+# UserData for Auto Scaling instances: set the hostname, register an A record in the
+# private hosted zone (removed again on shutdown) and release the lifecycle hook
+AUTOSCALING_USER_DATA = r"""#!/bin/bash
+set -eu
+snap install aws-cli --classic
+TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+md() { curl -s -H "X-aws-ec2-metadata-token: $TOKEN" "http://169.254.169.254/latest/meta-data/$1"; }
+INSTANCE_ID=$(md instance-id)
+HOST="${Tier}-${!INSTANCE_ID#i-}"
+hostnamectl set-hostname "$HOST"
+cat > /etc/tier-dns.env <<ENV
+AWS_DEFAULT_REGION=$(md placement/region)
+FQDN=$HOST.${VpcName}.${DnsName}.
+ADDRESS=$(md local-ipv4)
+ZONE=${HostedZoneId}
+ENV
+cat > /usr/local/sbin/tier-dns <<'SCRIPT'
+#!/bin/bash
+set -a; . /etc/tier-dns.env; set +a
+/snap/bin/aws route53 change-resource-record-sets --hosted-zone-id "$ZONE" --change-batch "{\"Changes\":[{\"Action\":\"$1\",\"ResourceRecordSet\":{\"Name\":\"$FQDN\",\"Type\":\"A\",\"TTL\":${DnsTtl},\"ResourceRecords\":[{\"Value\":\"$ADDRESS\"}]}}]}"
+SCRIPT
+chmod +x /usr/local/sbin/tier-dns
+cat > /etc/systemd/system/tier-dns.service <<'UNIT'
+[Unit]
+Description=Keep this instance registered in the private hosted zone
+After=network-online.target
+Wants=network-online.target
+[Service]
+Type=oneshot
+RemainAfterExit=yes
+ExecStart=/usr/local/sbin/tier-dns UPSERT
+ExecStop=/usr/local/sbin/tier-dns DELETE
+[Install]
+WantedBy=multi-user.target
+UNIT
+systemctl daemon-reload
+systemctl enable --now tier-dns.service
+/snap/bin/aws autoscaling complete-lifecycle-action --region "$(md placement/region)" \
+  --lifecycle-hook-name ${LifecycleHookName} --lifecycle-action-result CONTINUE --instance-id "$INSTANCE_ID" \
+  --auto-scaling-group-name "$(md tags/instance/aws:autoscaling:groupName)"
+"""
 
 
 # Create or update stack
 def create_update_security_group_template(vpc_name, stack_name):
-    required_status = "CREATE_COMPLETE"
-    if stack_exists(stack_name, required_status):
-        print(f"{stack_name} Exists. Updating Now")
-        generate_sg_cfn_template(vpc_name, stack_name, stack_action="update")
-    else:
-        print(f"{stack_name} Does Not Exist. Creating Now")
-        generate_sg_cfn_template(vpc_name, stack_name, stack_action="create")
-
+    stack_action = stack_deploy.deploy_action(aws_clients.client('cloudformation'), stack_name)
+    if stack_action is None:
+        return False
+    return generate_sg_cfn_template(vpc_name, stack_name, stack_action=stack_action)
+
+
+
+# Build the security group template for one environment
+@tracing.traced("build security-groups")
+def build_sg_cfn_template(vpc_name):
+    t = template_factory.new_template("security-groups", vpc_name)
+
+    print("Creating Security Groups")
+    vpc_id = return_vpc_component_ids.get_vpc_id(vpc_name)
+
+    # Create Bastion Security Group (AWS::EC2::SecurityGroup)
+    bastion_sg_cfn = ec2.SecurityGroup('BastionSecurityGroup')
+    bastion_sg_cfn.GroupDescription = "Bastion Security Group"
+    bastion_sg_cfn.VpcId = vpc_id
+    bastion_sg_cfn.Tags = template_factory.tags(f"{vpc_name}-Bastion-SecurityGroup")
+
+    # Create Bastion Security Group Ingress (AWS::EC2::SecurityGroupIngress)
+    bastion_sg_ingress_cfn = ec2.SecurityGroupIngress('BastionSecurityGroupIngress',
+          Description="Bastion SG Ingress", IpProtocol="tcp", FromPort=22, 
+          ToPort=22,CidrIp="0.0.0.0/0", GroupId=Ref(bastion_sg_cfn)
+    )
+
+    # Create MongoDB Security Group (AWS::EC2::SecurityGroup)
+    mongodb_sg_cfn = ec2.SecurityGroup('MongoDBSecurityGroup')
+    mongodb_sg_cfn.GroupDescription = "MongoDB Security Group"
+    mongodb_sg_cfn.VpcId = vpc_id
+    mongodb_sg_cfn.Tags = template_factory.tags(f"{vpc_name}-MongoDB-SecurityGroup")
+
+    # Create MongoDB Security Group Ingress (AWS::EC2::SecurityGroupIngress)
+    mongodb_bastion_sg_ingress_cfn = ec2.SecurityGroupIngress('MongoDBBastionSecurityGroupIngress',
+        Description="Mongodb Bastion SG Ingress", IpProtocol="tcp", FromPort=22, 
+        ToPort=22,CidrIp="0.0.0.0/0", GroupId=Ref(mongodb_sg_cfn)
+    )
+
+    mongodb_sg_ingress_cfn = ec2.SecurityGroupIngress('MongoSecurityGroupIngress',
+        Description="Mongodb SG Ingress", IpProtocol="tcp", FromPort=27016,
+        ToPort=27020,CidrIp="0.0.0.0/0", GroupId=Ref(mongodb_sg_cfn)
+    )
+
+    # Output Security Groups
+    output_bastion_sg_id = Output('outputBastionSG', Value=Ref(bastion_sg_cfn), Export=Export(exports.export_name(vpc_name, 'BastionSg')))
+    output_mongodb_sg_id = Output('outputMongodbSG', Value=Ref(mongodb_sg_cfn), Export=Export(exports.export_name(vpc_name, 'MongodbSg')))
+
+    # ================================== #
+    # Add objects to template            #
+    # ================================== # 
+    t.add_resource(bastion_sg_cfn)
+    t.add_resource(bastion_sg_ingress_cfn)
+    t.add_resource(mongodb_sg_cfn)
+    t.add_resource(mongodb_bastion_sg_ingress_cfn)
+    t.add_resource(mongodb_sg_ingress_cfn)
+    t.add_output(output_bastion_sg_id)
+    t.add_output(output_mongodb_sg_id)
+    return t
 
 
 # Create Security Groups
 def generate_sg_cfn_template(vpc_name, stack_name, stack_action):
     try:
-        print("Creating Security Groups")
-
-        # Create Bastion Security Group (AWS::EC2::SecurityGroup)
-        bastion_sg_cfn = ec2.SecurityGroup('BastionSecurityGroup')
-        bastion_sg_cfn.GroupDescription = "Bastion Security Group"
-        bastion_sg_cfn.VpcId = return_vpc_component_ids.get_vpc_id(vpc_name)
-        bastion_sg_cfn.Tags = Tags(Name=f"{vpc_name}-Bastion-SecurityGroup")
-
-        # Create Bastion Security Group Ingress (AWS::EC2::SecurityGroupIngress)
-        bastion_sg_ingress_cfn = ec2.SecurityGroupIngress('BastionSecurityGroupIngress',
-              Description="Bastion SG Ingress", IpProtocol="tcp", FromPort=22, 
-              ToPort=22,CidrIp="0.0.0.0/0", GroupId=Ref(bastion_sg_cfn)
-        )
-    
-        # Create MongoDB Security Group (AWS::EC2::SecurityGroup)
-        mongodb_sg_cfn = ec2.SecurityGroup('MongoDBSecurityGroup')
-        mongodb_sg_cfn.GroupDescription = "MongoDB Security Group"
-        mongodb_sg_cfn.VpcId = return_vpc_component_ids.get_vpc_id(vpc_name)
-        mongodb_sg_cfn.Tags = Tags(Name=f"{vpc_name}-MongoDB-SecurityGroup")
-
-        # Create MongoDB Security Group Ingress (AWS::EC2::SecurityGroupIngress)
-        mongodb_bastion_sg_ingress_cfn = ec2.SecurityGroupIngress('MongoDBBastionSecurityGroupIngress',
-            Description="Mongodb Bastion SG Ingress", IpProtocol="tcp", FromPort=22, 
-            ToPort=22,CidrIp="0.0.0.0/0", GroupId=Ref(mongodb_sg_cfn)
-        )
- 
-        mongodb_sg_ingress_cfn = ec2.SecurityGroupIngress('MongoSecurityGroupIngress',
-            Description="Mongodb SG Ingress", IpProtocol="tcp", FromPort=27016,
-            ToPort=27020,CidrIp="0.0.0.0/0", GroupId=Ref(mongodb_sg_cfn)
-        )
+        inputs = {"vpc_name": vpc_name, "vpc_id": return_vpc_component_ids.get_vpc_id(vpc_name)}
+        template_body, fingerprint = template_cache.render(
+            "security-groups", inputs, lambda: template_factory.render(build_sg_cfn_template(vpc_name)))
+        if stack_action == "update" and template_cache.in_sync(stack_name, fingerprint):
+            tracing.count("stacks.unchanged")
+            print(f"{stack_name} is unchanged since its last deploy. Skipping")
+            return True
 
-        # Output Security Groups
-        output_bastion_sg_id = Output('outputBastionSG', Value=Ref(bastion_sg_cfn), Export=Export('Infrastructure-BastionSg'))
-        output_mongodb_sg_id = Output('outputMongodbSG', Value=Ref(mongodb_sg_cfn), Export=Export('Infrastructure-MongodbSg'))
-
-        # ================================== #
-        # Add objects to template            #
-        # ================================== # 
-        t.add_resource(bastion_sg_cfn)
-        t.add_resource(bastion_sg_ingress_cfn)
-        t.add_resource(mongodb_sg_cfn)
-        t.add_resource(mongodb_bastion_sg_ingress_cfn)
-        t.add_resource(mongodb_sg_ingress_cfn)
-        t.add_output(output_bastion_sg_id)
-        t.add_output(output_mongodb_sg_id)
- 
         # Print Cloudformation Template
-        print(t.to_yaml())
+        print(template_body)
 
-        if stack_action == "create":
-            print(f"Creating {stack_name} stack")
-            cfn_template.create_stack(
-                StackName=stack_name,
-                TemplateBody=t.to_yaml()
-            )
-            waiter = cfn_template.get_waiter("stack_create_complete")
-            waiter.wait(
-                StackName=stack_name
-            )
-            print(f"{stack_name} stack creation complete")
-        elif stack_action == "update":
-            print(f"Updating {stack_name} stack")
-            cfn_template.update_stack(
-                StackName=stack_name,
-                TemplateBody=t.to_yaml()
-            )
-            waiter = cfn_template.get_waiter("stack_update_complete")
-            waiter.wait(
-                StackName=stack_name
-            )
-            print(f"{stack_name} stack update complete")
+        stack_deploy.deploy_stack(aws_clients.client('cloudformation'), stack_name, template_body, stack_action)
     except Exception as e:
         print(f"An error occurred: {e}")
+        return False
+    return True
 
 
 
@@ -137,113 +140,257 @@ def generate_sg_cfn_template(vpc_name, stack_name, stack_action):
 
 # Create or update ec2 instance stack
 def create_update_instance_template(vpc_name, stack_name, instance_type):
-    required_status = "CREATE_COMPLETE"
-    if stack_exists(stack_name, required_status):
-        print(f"{stack_name} Exists. Updating Now")
-        generate_instance_cfn_template(vpc_name, stack_name, instance_type, stack_action="update")
-    else:
-        print(f"{stack_name} Does Not Exist. Creating Now")
-        generate_instance_cfn_template(vpc_name, stack_name, instance_type, stack_action="create")
+    if INSTANCE_ROLLOUT.get(instance_type) == "blue-green":
+        from infrastructure import blue_green
+        return blue_green.rollout(vpc_name, instance_type)
+    stack_action = stack_deploy.deploy_action(aws_clients.client('cloudformation'), stack_name)
+    if stack_action is None:
+        return False
+    return generate_instance_cfn_template(vpc_name, stack_name, instance_type, stack_action=stack_action)
 
 
-# Generate EC2 Template and create stack
-def generate_instance_cfn_template(vpc_name, stack_name, instance_type, stack_action):
-    try:
-        if instance_type == "bastion":
-            security_group_id = ImportValue('Infrastructure-BastionSg')
-        else:
-            security_group_id = ImportValue('Infrastructure-MongodbSg') 
-  
-        route53_zone_id = ImportValue('infrastructure-privateHostedZoneId') 
-        for instance_count in range(INSTANCE_TIER_COUNT[instance_type]):
-            print(f"VPC Name => {vpc_name}")
-            print(f"VPC ID   => {return_vpc_component_ids.get_vpc_id(vpc_name)}")
-            print(f"Instance Name => {instance_type}{instance_count}")
-            print(f"Instance FQDN => {instance_type}{instance_count}.{vpc_name}.{dns_name}")
-            print(f"Instance Type => {instance_type}")
-            print(f"Instance Count => {INSTANCE_TIER_COUNT[instance_type]}")
-            print(f"Subnet ID     => {return_vpc_component_ids.get_subnet_id(vpc_name, 'publicsubnet1')}")
-            print(f"Instance Keypair => {INSTANCE_BUILD_ITEMS['keypair']}")
-            print(f"Ubuntu 22 AMI ID => {INSTANCE_BUILD_ITEMS['ubuntu22id']}")
-            print(f"Ubuntu 24 AMI ID => {INSTANCE_BUILD_ITEMS['ubuntu24id']}")
-            print(f"Instance Size    => {INSTANCE_BUILD_ITEMS['baseinstancetype']}")
-            print(f"Instance Security Group => {security_group_id}")
-            print(f"Private Hosted Zone ID  => {route53_zone_id}")
-            print("\n")
-
-            serverName = f"{instance_type}{instance_count}"
-            instance = ec2.Instance(
-                serverName,
-                ImageId=f"{INSTANCE_BUILD_ITEMS['ubuntu22id']}",
-                UserData=Base64(Join('', [
-                  "#!/bin/bash\n"
-                  "sudo hostnamectl set-hostname ",serverName,"\n"
-                ])),
-                InstanceType=f"{INSTANCE_BUILD_ITEMS['baseinstancetype']}",
-                KeyName=f"{INSTANCE_BUILD_ITEMS['keypair']}",
-                SecurityGroupIds=[security_group_id],
-                SubnetId=f"{return_vpc_component_ids.get_subnet_id(vpc_name, 'publicsubnet1')}",
-                Tags=Tags(
-                  Name=serverName,
-                  Environment=vpc_name,
-                ),
-            )
-            t.add_resource(instance)
+# Build the EC2 template for one instance tier
+@tracing.traced("build instances")
+def build_instance_cfn_template(vpc_name, instance_type, region=None):
+    t = template_factory.new_template(f"{instance_type}-instances", vpc_name)
+    topology = (VPC_TOPOLOGY.get(vpc_name) or network_layout.TopologySpec())._replace(region=region or aws_clients.region_name() or network_layout.TopologySpec().region)
+    zones = network_layout.availability_zones(topology.region, topology.az_count)
+
+    # AMI and size come from the catalog cache, once per stack
+    image_id = ami_catalog.ami_id(topology.region, vpc_name)
+    size = ami_catalog.instance_size(vpc_name, instance_type)
 
-            # Set Private DNS 
-            instance_record = RecordSetType(
-               f"{serverName}PrivateDNSRecord",
-               HostedZoneName=Join("", [vpc_name,".", dns_name, "."]),
-               Comment=f"DNS name for {serverName}.",
+    if instance_type == "bastion":
+        security_group_id = exports.import_value(vpc_name, 'BastionSg')
+    else:
+        security_group_id = exports.import_value(vpc_name, 'MongodbSg')
+
+    route53_zone_id = exports.import_value(vpc_name, 'privateHostedZoneId')
+
+    if INSTANCE_TIER_MODE.get(instance_type) == "autoscaling":
+        ami_catalog.check_offered(topology.region, size, [zones[index - 1] for index in network_layout.tier_subnet_indexes(topology, "private")])
+        return build_autoscaling_tier(t, vpc_name, instance_type, security_group_id, route53_zone_id, image_id, size)
+    ami_catalog.check_offered(topology.region, size, zones[:1])
+
+    # Resolve IDs once per stack rather than once per instance
+    vpc_id = return_vpc_component_ids.get_vpc_id(vpc_name)
+    subnet_id = return_vpc_component_ids.get_subnet_id(vpc_name, 'publicsubnet1')
+    for instance_count in range(INSTANCE_TIER_COUNT[instance_type]):
+        print(f"VPC Name => {vpc_name}")
+        print(f"VPC ID   => {vpc_id}")
+        print(f"Instance Name => {instance_type}{instance_count}")
+        print(f"Instance FQDN => {instance_type}{instance_count}.{vpc_name}.{dns_name}")
+        print(f"Instance Type => {instance_type}")
+        print(f"Instance Count => {INSTANCE_TIER_COUNT[instance_type]}")
+        print(f"Subnet ID     => {subnet_id}")
+        print(f"Instance Keypair => {INSTANCE_BUILD_ITEMS['keypair']}")
+        print(f"AMI ID           => {image_id}")
+        print(f"Instance Size    => {size}")
+        print(f"Instance Security Group => {security_group_id}")
+        print(f"Private Hosted Zone ID  => {route53_zone_id}")
+        print("\n")
+
+        serverName = f"{instance_type}{instance_count}"
+        instance = ec2.Instance(
+            serverName,
+            ImageId=image_id,
+            UserData=Base64(Join('', [
+              "#!/bin/bash\n"
+              "sudo hostnamectl set-hostname ",serverName,"\n"
+            ])),
+            InstanceType=size,
+            KeyName=f"{INSTANCE_BUILD_ITEMS['keypair']}",
+            SecurityGroupIds=[security_group_id],
+            SubnetId=subnet_id,
+            Tags=template_factory.tags(serverName, environment=vpc_name),
+        )
+        t.add_resource(instance)
+
+        # DNS records are managed outside the stack by dns_sync or blue_green
+        if not dns_sync.stack_managed(instance_type):
+            continue
+
+        # Set Private DNS 
+        instance_record = RecordSetType(
+           f"{serverName}PrivateDNSRecord",
+           HostedZoneName=Join("", [vpc_name,".", dns_name, "."]),
+           Comment=f"DNS name for {serverName}.",
+           Name=Join(
+                "", [serverName, ".", vpc_name, ".", dns_name, "."]
+           ),
+           Type="A",
+           TTL=str(DNS_RECORD_TTL),
+           ResourceRecords=[GetAtt(serverName, "PrivateIp")],
+        ) 
+        t.add_resource(instance_record)
+
+        # Set public DNS 
+        if instance_type == "bastion":
+            public_instance_record = RecordSetType(
+               f"{serverName}PublicDNSRecord",
+               HostedZoneName=Join("", [public_dns_name, "."]),
+               Comment=f"Public DNS name for {serverName}.",
                Name=Join(
-                    "", [serverName, ".", vpc_name, ".", dns_name, "."]
+                    "", [serverName, ".", vpc_name, ".", public_dns_name, "."]
                ),
                Type="A",
-               TTL="900",
-               ResourceRecords=[GetAtt(serverName, "PrivateIp")],
-            ) 
-            t.add_resource(instance_record)
-
-            # Set public DNS 
-            if instance_type == "bastion":
-                public_instance_record = RecordSetType(
-                   f"{serverName}PublicDNSRecord",
-                   HostedZoneName=Join("", [public_dns_name, "."]),
-                   Comment=f"Public DNS name for {serverName}.",
-                   Name=Join(
-                        "", [serverName, ".", public_dns_name, "."]
-                   ),
-                   Type="A",
-                   TTL="900",
-                   ResourceRecords=[GetAtt(serverName, "PublicIp")],
-                )
-                t.add_resource(public_instance_record)
-
+               TTL=str(DNS_RECORD_TTL),
+               ResourceRecords=[GetAtt(serverName, "PublicIp")],
+            )
+            t.add_resource(public_instance_record)
+    return t
+
+
+# Stack parameters for an instance tier; Auto Scaling tiers take their size as a parameter
+def instance_stack_parameters(instance_type):
+    if INSTANCE_TIER_MODE.get(instance_type) == "autoscaling":
+        return {"TierCapacity": str(INSTANCE_TIER_COUNT[instance_type])}
+    return None
+
+
+# Add a LaunchTemplate and an AutoScalingGroup spread over every private subnet
+def build_autoscaling_tier(t, vpc_name, instance_type, security_group_id, route53_zone_id, image_id, size):
+    topology = VPC_TOPOLOGY.get(vpc_name) or network_layout.TopologySpec()
+    subnet_ids = [exports.import_value(vpc_name, f'privateSubnet{index}Id') for index in network_layout.tier_subnet_indexes(topology, "private")]
+    if not subnet_ids:
+        raise ValueError(f"{vpc_name} has no private subnets for the {instance_type} Auto Scaling group")
+
+    print(f"VPC Name => {vpc_name}")
+    print(f"Instance Tier => {instance_type} (Auto Scaling)")
+    print(f"Instance Count => {INSTANCE_TIER_COUNT[instance_type]}")
+    print(f"Private Subnets => {len(subnet_ids)}")
+    print(f"AMI ID           => {image_id}")
+    print(f"Instance Size    => {size}")
+    print("\n")
+
+    # Tier size; scaling the tier only changes this parameter
+    capacity = t.add_parameter(Parameter(
+        "TierCapacity",
+        Type="Number",
+        MinValue=0,
+        Default=INSTANCE_TIER_COUNT[instance_type],
+        Description=f"Number of {instance_type} instances",
+    ))
+
+    # Create Instance Role (AWS::IAM::Role) allowed to register DNS and release the lifecycle hook
+    role = t.add_resource(iam.Role(
+        f"{instance_type}InstanceRole",
+        AssumeRolePolicyDocument={
+            "Version": "2012-10-17",
+            "Statement": [{"Effect": "Allow", "Principal": {"Service": "ec2.amazonaws.com"}, "Action": "sts:AssumeRole"}],
+        },
+        Policies=[iam.Policy(
+            PolicyName="tier-dns-registration",
+            PolicyDocument={
+                "Version": "2012-10-17",
+                "Statement": [
+                    {"Effect": "Allow", "Action": "route53:ChangeResourceRecordSets",
+                     "Resource": Join("", ["arn:aws:route53:::hostedzone/", route53_zone_id])},
+                    {"Effect": "Allow", "Action": "autoscaling:CompleteLifecycleAction", "Resource": "*"},
+                ],
+            },
+        )],
+    ))
+
+    # Create Instance Profile (AWS::IAM::InstanceProfile)
+    profile = t.add_resource(iam.InstanceProfile(f"{instance_type}InstanceProfile", Roles=[Ref(role)]))
+
+    # Create Launch Template (AWS::EC2::LaunchTemplate)
+    launch_template = t.add_resource(ec2.LaunchTemplate(
+        f"{instance_type}LaunchTemplate",
+        LaunchTemplateData=ec2.LaunchTemplateData(
+            ImageId=image_id,
+            InstanceType=size,
+            KeyName=INSTANCE_BUILD_ITEMS['keypair'],
+            SecurityGroupIds=[security_group_id],
+            IamInstanceProfile=ec2.IamInstanceProfile(Arn=GetAtt(profile, "Arn")),
+            MetadataOptions=ec2.MetadataOptions(HttpTokens="required", InstanceMetadataTags="enabled"),
+            UserData=Base64(Sub(
+                AUTOSCALING_USER_DATA,
+                Tier=instance_type,
+                VpcName=vpc_name,
+                DnsName=dns_name,
+                HostedZoneId=route53_zone_id,
+                DnsTtl=str(DNS_RECORD_TTL),
+                LifecycleHookName=DNS_LIFECYCLE_HOOK,
+            )),
+        ),
+    ))
+
+    # Create Auto Scaling Group (AWS::AutoScaling::AutoScalingGroup)
+    t.add_resource(autoscaling.AutoScalingGroup(
+        f"{instance_type}AutoScalingGroup",
+        LaunchTemplate=autoscaling.LaunchTemplateSpecification(
+            LaunchTemplateId=Ref(launch_template),
+            Version=GetAtt(launch_template, "LatestVersionNumber"),
+        ),
+        MinSize=Ref(capacity),
+        MaxSize=Ref(capacity),
+        DesiredCapacity=Ref(capacity),
+        VPCZoneIdentifier=subnet_ids,
+        LifecycleHookSpecificationList=[autoscaling.LifecycleHookSpecification(
+            LifecycleHookName=DNS_LIFECYCLE_HOOK,
+            LifecycleTransition="autoscaling:EC2_INSTANCE_LAUNCHING",
+            HeartbeatTimeout=600,
+            DefaultResult="ABANDON",
+        )],
+        Tags=autoscaling.Tags(Name=instance_type, Environment=vpc_name),
+    ))
+    return t
+
+
+# Template cache inputs for an instance tier
+def instance_cache_inputs(vpc_name, stack_name, instance_type):
+    """ Everything besides the code that build_instance_cfn_template's output depends on """
+    region = aws_clients.region_name() or network_layout.TopologySpec().region
+    inputs = {"vpc_name": vpc_name, "stack_name": stack_name, "instance_type": instance_type, "region": region,
+              "image_id": ami_catalog.ami_id(region, vpc_name), "size": ami_catalog.instance_size(vpc_name, instance_type),
+              "count": INSTANCE_TIER_COUNT[instance_type], "template_bucket": TEMPLATE_BUCKET}
+    if INSTANCE_TIER_MODE.get(instance_type) != "autoscaling":
+        inputs["vpc_id"] = return_vpc_component_ids.get_vpc_id(vpc_name)
+        inputs["subnet_id"] = return_vpc_component_ids.get_subnet_id(vpc_name, 'publicsubnet1')
+    return inputs
+
+
+# Build, shard if needed, and render an instance tier's template
+def render_instance_template(vpc_name, stack_name, instance_type):
+    t = build_instance_cfn_template(vpc_name, instance_type)
+    if stack_sharding.needs_sharding(t):
+        store = stack_sharding.template_store()
+        if store is None:
+            raise ValueError(f"{stack_name} is too large for one stack; set INFRA_TEMPLATE_BUCKET to deploy it as nested stacks")
+        t = stack_sharding.nest(t, stack_name, store)
+    return template_factory.render(t)
 
-        # Print Cloudformation Template
-        print(t.to_yaml())
 
-        if stack_action == "create":
-            print(f"Creating {stack_name} stack")
-            cfn_template.create_stack(
-                StackName=stack_name,
-                TemplateBody=t.to_yaml()
-            )
-            waiter = cfn_template.get_waiter("stack_create_complete")
-            waiter.wait(
-                StackName=stack_name
-            )
-            print(f"{stack_name} stack creation complete")
-        elif stack_action == "update":
-            print(f"Updating {stack_name} stack")
-            cfn_template.update_stack(
-                StackName=stack_name,
-                TemplateBody=t.to_yaml()
-            )
-            waiter = cfn_template.get_waiter("stack_update_complete")
-            waiter.wait(
-                StackName=stack_name
-            )
-            print(f"{stack_name} stack update complete")
+# Generate EC2 Template and create stack
+def generate_instance_cfn_template(vpc_name, stack_name, instance_type, stack_action):
+    try:
+        if INSTANCE_TIER_MODE.get(instance_type) != "autoscaling" and INSTANCE_TIER_COUNT[instance_type] >= BULK_BUILD_THRESHOLD:
+            from infrastructure import bulk_builder
+            with tracing.span("bulk build", stack=stack_name):
+                template_body, resources, shards = bulk_builder.render_tier(vpc_name, stack_name, instance_type, stack_sharding.template_store())
+            # Too large to be worth printing
+            print(f"{stack_name}: bulk-built {resources} resources in {shards or 1} template(s)")
+        else:
+            template_body, fingerprint = template_cache.render(
+                "instances", instance_cache_inputs(vpc_name, stack_name, instance_type),
+                lambda: render_instance_template(vpc_name, stack_name, instance_type), instance_stack_parameters(instance_type))
+            if stack_action == "update" and template_cache.in_sync(stack_name, fingerprint):
+                tracing.count("stacks.unchanged")
+                print(f"{stack_name} is unchanged since its last deploy. Skipping")
+                return True
+
+            # Print Cloudformation Template
+            print(template_body)
+
+        stack_deploy.deploy_stack(aws_clients.client('cloudformation'), stack_name, template_body, stack_action,
+                                  instance_stack_parameters(instance_type))
+
+        if INSTANCE_DNS_MODE.get(instance_type) == "sync" and INSTANCE_ROLLOUT.get(instance_type) != "blue-green" \
+                and INSTANCE_TIER_MODE.get(instance_type) != "autoscaling":
+            dns_sync.sync_tier(vpc_name, instance_type)
     except Exception as e:
         print(f"An error occurred: {e}")
+        return False
+    return True
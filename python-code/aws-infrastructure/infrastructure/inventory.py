@@ -0,0 +1,222 @@
+import os
+import re
+import sqlite3
+import time
+from infrastructure import aws_clients, stack_deploy
+
+# SQLite snapshot of stacks, exports, instances and subnets across environments
+INVENTORY_FILE = os.path.join(stack_deploy.STATE_DIR, "inventory.sqlite")
+
+# Seconds a sweep stays fresh before a query that asks for fresh data re-runs it
+INVENTORY_MAX_AGE = int(os.environ.get("INFRA_INVENTORY_MAX_AGE", "60"))
+
+# Stack states a deploy cannot start from; stack_deploy.stack_action refuses the same ones
+BLOCKING_STATUSES = tuple(sorted(stack_deploy.RECREATE_STATUSES | stack_deploy.CONTINUE_ROLLBACK_STATUSES))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (source TEXT PRIMARY KEY, swept_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS stacks (
+    name TEXT PRIMARY KEY, env TEXT, kind TEXT, tier TEXT, status TEXT, last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS exports (name TEXT PRIMARY KEY, value TEXT, stack_id TEXT);
+CREATE TABLE IF NOT EXISTS vpcs (vpc_id TEXT PRIMARY KEY, env TEXT, cidr TEXT);
+CREATE TABLE IF NOT EXISTS subnets (
+    subnet_id TEXT PRIMARY KEY, vpc_id TEXT, env TEXT, name TEXT, cidr TEXT, availability_zone TEXT
+);
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY, env TEXT, tier TEXT, name TEXT, state TEXT,
+    private_ip TEXT, public_ip TEXT, subnet_id TEXT, launch_time TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (resource_id TEXT, key TEXT, value TEXT, PRIMARY KEY (resource_id, key));
+CREATE INDEX IF NOT EXISTS stacks_env ON stacks (env, kind, tier);
+CREATE INDEX IF NOT EXISTS subnets_env ON subnets (env);
+CREATE INDEX IF NOT EXISTS instances_env ON instances (env, tier);
+CREATE INDEX IF NOT EXISTS tags_key ON tags (key, value);
+"""
+
+_STACK_NAME = re.compile(r"^(?P<env>[^-]+)-(?:(?P<kind>vpc|security-groups)|(?P<tier>.+)-instances)$")
+
+
+def connect(path=None):
+    """ Open the snapshot, creating its tables on first use """
+    path = path or INVENTORY_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.executescript(SCHEMA)
+    return db
+
+
+def stack_identity(stack_name):
+    """ (env, kind, tier) for a stack named by deploy_engine.stack_name_for, else (None, None, None) """
+    match = _STACK_NAME.match(stack_name)
+    if not match:
+        return None, None, None
+    if match["tier"]:
+        return match["env"], "instances", match["tier"]
+    return match["env"], match["kind"], None
+
+
+def _tag_map(tags):
+    return {tag["Key"]: tag["Value"] for tag in tags or []}
+
+
+def _replace(db, table, rows, tag_rows=None, resource_column=None):
+    """ Swap a table's contents for a fresh sweep, with the tags of the swept resources """
+    if resource_column:
+        db.execute(f"DELETE FROM tags WHERE resource_id IN (SELECT {resource_column} FROM {table})")
+    db.execute(f"DELETE FROM {table}")
+    if rows:
+        placeholders = ", ".join("?" * len(rows[0]))
+        db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows)
+    if tag_rows:
+        db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?, ?)", tag_rows)
+
+
+def sweep_stacks(db):
+    """ One paginated list_stacks sweep """
+    rows = []
+    paginator = aws_clients.client("cloudformation").get_paginator("list_stacks")
+    for page in paginator.paginate():
+        for summary in page["StackSummaries"]:
+            if summary["StackStatus"] == "DELETE_COMPLETE":
+                continue
+            last_updated = summary.get("LastUpdatedTime") or summary["CreationTime"]
+            rows.append((summary["StackName"], *stack_identity(summary["StackName"]),
+                         summary["StackStatus"], str(last_updated)))
+    _replace(db, "stacks", rows)
+    return len(rows)
+
+
+def sweep_exports(db):
+    """ One paginated list_exports sweep """
+    rows = []
+    paginator = aws_clients.client("cloudformation").get_paginator("list_exports")
+    for page in paginator.paginate():
+        for export in page["Exports"]:
+            rows.append((export["Name"], export["Value"], export["ExportingStackId"]))
+    _replace(db, "exports", rows)
+    return len(rows)
+
+
+def sweep_network(db):
+    """ One paginated describe_vpcs and describe_subnets sweep """
+    ec2 = aws_clients.client("ec2")
+    vpc_rows, subnet_rows, tag_rows = [], [], []
+    vpc_envs = {}
+    for page in ec2.get_paginator("describe_vpcs").paginate():
+        for vpc in page["Vpcs"]:
+            tags = _tag_map(vpc.get("Tags"))
+            vpc_envs[vpc["VpcId"]] = tags.get("Name")
+            vpc_rows.append((vpc["VpcId"], tags.get("Name"), vpc["CidrBlock"]))
+            tag_rows += [(vpc["VpcId"], key, value) for key, value in tags.items()]
+    for page in ec2.get_paginator("describe_subnets").paginate():
+        for subnet in page["Subnets"]:
+            tags = _tag_map(subnet.get("Tags"))
+            subnet_rows.append((subnet["SubnetId"], subnet["VpcId"], vpc_envs.get(subnet["VpcId"]), tags.get("Name"),
+                                subnet["CidrBlock"], subnet["AvailabilityZone"]))
+            tag_rows += [(subnet["SubnetId"], key, value) for key, value in tags.items()]
+    _replace(db, "vpcs", vpc_rows, resource_column="vpc_id")
+    _replace(db, "subnets", subnet_rows, tag_rows, resource_column="subnet_id")
+    return len(vpc_rows) + len(subnet_rows)
+
+
+def sweep_instances(db):
+    """ One paginated describe_instances sweep """
+    rows, tag_rows = [], []
+    paginator = aws_clients.client("ec2").get_paginator("describe_instances")
+    filters = [{"Name": "instance-state-name", "Values": ["pending", "running", "stopping", "stopped"]}]
+    for page in paginator.paginate(Filters=filters):
+        for reservation in page["Reservations"]:
+            for instance in reservation["Instances"]:
+                tags = _tag_map(instance.get("Tags"))
+                name = tags.get("Name")
+                tier = re.sub(r"\d+$", "", name) if name else None
+                rows.append((instance["InstanceId"], tags.get("Environment"), tier, name, instance["State"]["Name"],
+                             instance.get("PrivateIpAddress"), instance.get("PublicIpAddress"),
+                             instance.get("SubnetId"), str(instance.get("LaunchTime", ""))))
+                tag_rows += [(instance["InstanceId"], key, value) for key, value in tags.items()]
+    _replace(db, "instances", rows, tag_rows, resource_column="instance_id")
+    return len(rows)
+
+
+# Snapshot sources and the sweep that fills each
+SOURCES = {
+    "stacks": sweep_stacks,
+    "exports": sweep_exports,
+    "network": sweep_network,
+    "instances": sweep_instances,
+}
+
+
+def swept_at(db, source):
+    row = db.execute("SELECT swept_at FROM sweeps WHERE source = ?", (source,)).fetchone()
+    return row["swept_at"] if row else None
+
+
+def refresh(db, sources=None, max_age=None):
+    """ Re-sweep the given sources, skipping any swept within max_age seconds; return {source: rows} """
+    counts = {}
+    now = time.time()
+    for source in sources or SOURCES:
+        last = swept_at(db, source)
+        if max_age is not None and last is not None and now - last < max_age:
+            continue
+        with db:
+            counts[source] = SOURCES[source](db)
+            db.execute("INSERT OR REPLACE INTO sweeps VALUES (?, ?)", (source, time.time()))
+    return counts
+
+
+def status_rows(db, envs=None):
+    """ Per-environment stack, subnet and instance counts from the snapshot """
+    env_filter = f"WHERE env IN ({', '.join('?' * len(envs))})" if envs else "WHERE env IS NOT NULL"
+    params = list(envs or [])
+    stacks, instances, subnets = {}, {}, {}
+    for row in db.execute(f"SELECT env, name, status FROM stacks {env_filter} ORDER BY name", params):
+        stacks.setdefault(row["env"], []).append(f"{row['name']}:{row['status']}")
+    for row in db.execute(f"SELECT env, tier, COUNT(*) AS n FROM instances {env_filter} AND state = 'running' GROUP BY env, tier", params):
+        instances.setdefault(row["env"], []).append(f"{row['tier']}={row['n']}")
+    for row in db.execute(f"SELECT env, COUNT(*) AS n FROM subnets {env_filter} GROUP BY env", params):
+        subnets[row["env"]] = row["n"]
+    return [[env, "\n".join(stacks.get(env, [])), subnets.get(env, 0), " ".join(instances.get(env, []))]
+            for env in sorted(set(stacks) | set(instances) | set(subnets))]
+
+
+def instance_rows(db, env=None, tier=None, tag=None):
+    """ Instances from the snapshot, optionally narrowed by env, tier and a KEY=VALUE tag """
+    query = "SELECT i.* FROM instances i"
+    clauses, params = [], []
+    if tag:
+        key, _, value = tag.partition("=")
+        query += " JOIN tags t ON t.resource_id = i.instance_id AND t.key = ? AND t.value = ?"
+        params += [key, value]
+    if env:
+        clauses.append("i.env = ?")
+        params.append(env)
+    if tier:
+        clauses.append("i.tier = ?")
+        params.append(tier)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    return [[row["env"], row["name"], row["instance_id"], row["state"], row["private_ip"], row["public_ip"]]
+            for row in db.execute(query + " ORDER BY i.env, i.name", params)]
+
+
+def export_rows(db, prefix=None):
+    """ Exports from the snapshot, optionally those whose name starts with prefix """
+    query, params = "SELECT name, value FROM exports", []
+    if prefix:
+        query += " WHERE substr(name, 1, ?) = ?"
+        params += [len(prefix), prefix]
+    return [[row["name"], row["value"]] for row in db.execute(query + " ORDER BY name", params)]
+
+
+def blocked_stacks(stack_names, db=None):
+    """ Planned stacks the snapshot shows in progress or in a state a deploy cannot start from """
+    db = db or connect()
+    refresh(db, ["stacks"], max_age=INVENTORY_MAX_AGE)
+    placeholders = ", ".join("?" * len(stack_names))
+    rows = db.execute(f"SELECT name, status FROM stacks WHERE name IN ({placeholders})", list(stack_names))
+    return [(row["name"], row["status"]) for row in rows
+            if row["status"] in BLOCKING_STATUSES or row["status"].endswith("_IN_PROGRESS")]
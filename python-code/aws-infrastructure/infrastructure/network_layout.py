@@ -0,0 +1,102 @@
+import ipaddress
+from typing import NamedTuple
+
+# AZ suffixes to use per region, in preference order
+REGION_AZ_SUFFIXES = {
+    "us-east-1": ("a", "b", "d", "c", "e", "f"),
+    "us-east-2": ("a", "b", "c"),
+    "us-west-1": ("a", "c"),
+    "us-west-2": ("a", "b", "c", "d"),
+    "eu-west-1": ("a", "b", "c"),
+    "eu-central-1": ("a", "b", "c"),
+}
+DEFAULT_AZ_SUFFIXES = ("a", "b", "c")
+
+# Subnet tiers in allocation order and how each routes to the internet
+TIER_ROUTING = {
+    "public": "internet-gateway",
+    "private": "nat-gateway",
+    "isolated": None,
+}
+
+
+class TopologySpec(NamedTuple):
+    """ Declarative VPC layout: one subnet per tier per AZ, all the same size """
+    region: str = "us-east-1"
+    az_count: int = 3
+    tiers: tuple = ("public", "private")
+    subnet_prefix: int = 24
+    # Index of the first subnet-sized block handed out, keeps existing x.x.11.0/24 numbering
+    first_block: int = 11
+    nat_per_az: bool = False
+
+
+class SubnetSpec(NamedTuple):
+    """ One planned subnet """
+    logical_id: str
+    name: str
+    tier: str
+    index: int
+    availability_zone: str
+    cidr: str
+
+    @property
+    def public(self):
+        return self.tier == "public"
+
+
+def availability_zones(region, az_count):
+    """ Return the AZ names a layout spreads over """
+    suffixes = REGION_AZ_SUFFIXES.get(region, DEFAULT_AZ_SUFFIXES)
+    if az_count < 1 or az_count > len(suffixes):
+        raise ValueError(f"{region} has {len(suffixes)} usable AZs, {az_count} requested")
+    return [f"{region}{suffix}" for suffix in suffixes[:az_count]]
+
+
+def validate(topology):
+    """ Reject layouts the template generator cannot route """
+    unknown = [tier for tier in topology.tiers if tier not in TIER_ROUTING]
+    if unknown:
+        raise ValueError(f"Unknown subnet tiers {unknown}")
+    if len(set(topology.tiers)) != len(topology.tiers):
+        raise ValueError(f"Duplicate subnet tiers in {topology.tiers}")
+    if "private" in topology.tiers and "public" not in topology.tiers:
+        raise ValueError("A private tier needs a public tier for its NAT gateways")
+
+
+def plan_subnets(vpc_name, vpc_cidr, topology):
+    """ Pack one subnet per tier per AZ into the VPC CIDR without overlap """
+    validate(topology)
+    vpc_network = ipaddress.ip_network(vpc_cidr)
+    if topology.subnet_prefix < vpc_network.prefixlen:
+        raise ValueError(f"/{topology.subnet_prefix} subnets do not fit in {vpc_cidr}")
+
+    zones = availability_zones(topology.region, topology.az_count)
+    block_size = 2 ** (vpc_network.max_prefixlen - topology.subnet_prefix)
+    block_count = vpc_network.num_addresses // block_size
+    needed = len(topology.tiers) * len(zones)
+    if topology.first_block + needed > block_count:
+        raise ValueError(f"{needed} /{topology.subnet_prefix} subnets starting at block {topology.first_block} overflow {vpc_cidr}")
+
+    specs = []
+    block = topology.first_block
+    for tier in topology.tiers:
+        for index, zone in enumerate(zones, start=1):
+            network = ipaddress.ip_network((int(vpc_network.network_address) + block * block_size, topology.subnet_prefix))
+            specs.append(SubnetSpec(
+                logical_id=f"{tier.capitalize()}Subnet{index}",
+                name=f"{vpc_name}-{tier}subnet{index}",
+                tier=tier,
+                index=index,
+                availability_zone=zone,
+                cidr=str(network),
+            ))
+            block += 1
+    return specs
+
+
+def tier_subnet_indexes(topology, tier):
+    """ Subnet indexes (1-based, one per AZ) a tier has in a layout """
+    if tier not in topology.tiers:
+        return []
+    return list(range(1, topology.az_count + 1))
@@ -0,0 +1,56 @@
+import contextlib
+import io
+import os
+import tempfile
+from infrastructure import ami_catalog, create_vpc, deploy_engine, infra_instances, return_vpc_component_ids, stack_sharding, template_factory
+
+
+def build_stack_template(kind, vpc_name, tier, region, hostedzone_name):
+    """ Build the template for one planned stack """
+    if kind == "vpc":
+        return create_vpc.build_cfn_template(vpc_name, region, hostedzone_name)
+    if kind == "security-groups":
+        return infra_instances.build_sg_cfn_template(vpc_name)
+    return infra_instances.build_instance_cfn_template(vpc_name, tier, region)
+
+
+def render_stacks(vpc_names, tiers, region, hostedzone_name, output_dir=None):
+    """ Render and validate every planned stack with placeholder IDs; return (stack name, resources, bytes, problems) rows """
+    rendered = []
+    shard_store = stack_sharding.LocalTemplateStore(os.path.join(output_dir or tempfile.mkdtemp(prefix="infra-render-"), "shards"))
+    with return_vpc_component_ids.use_resolver(return_vpc_component_ids.OfflineResolver()), ami_catalog.cached_only():
+        for stack_name, kind, vpc_name, tier, depends_on in deploy_engine.plan_stacks(vpc_names, tiers):
+            try:
+                # The generators narrate every instance; keep render output to the summary
+                with contextlib.redirect_stdout(io.StringIO()):
+                    t = build_stack_template(kind, vpc_name, tier, region, hostedzone_name)
+                    # Imports are read before sharding; the nested stacks carry the same ImportValues
+                    imported = template_factory.imports(t)
+                    if stack_sharding.needs_sharding(t):
+                        t = stack_sharding.nest(t, stack_name, shard_store)
+                    template_body = template_factory.render(t)
+            except Exception as e:
+                rendered.append((stack_name, None, "", set(), [f"render failed: {e}"], depends_on))
+                continue
+            rendered.append((stack_name, t, template_body, imported, template_factory.validate(t, template_body), depends_on))
+
+    # Every import must be exported by a stack the importer depends on
+    exported = {stack_name: template_factory.exports(t) for stack_name, t, _, _, _, _ in rendered if t is not None}
+    owners = {}
+    for stack_name, names in exported.items():
+        for name in names:
+            owners.setdefault(name, []).append(stack_name)
+    rows = []
+    for stack_name, t, template_body, imported, problems, depends_on in rendered:
+        if t is not None:
+            available = set().union(*(exported.get(name, set()) for name in depends_on))
+            problems += [f"imports {name} which no dependency exports" for name in sorted(imported - available)]
+            # Export names are account/region wide; two stacks exporting one name cannot coexist
+            problems += [f"exports {name} which {', '.join(other for other in owners[name] if other != stack_name)} also exports"
+                         for name in sorted(exported[stack_name]) if len(owners[name]) > 1]
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+                with open(os.path.join(output_dir, f"{stack_name}.yaml"), "w") as f:
+                    f.write(template_body)
+        rows.append((stack_name, len(t.resources) if t is not None else 0, len(template_body.encode()), problems))
+    return rows
@@ -0,0 +1,205 @@
+import bisect
+import ipaddress
+import json
+from infrastructure import aws_clients, network_layout, state_files
+from infrastructure.config import ALLOCATIONS_FILE, NETWORK_OCTETS, VPC_TOPOLOGY
+
+# (service code, quota code) for each limit a deploy can hit, and the AWS default used when
+# Service Quotas cannot be read
+QUOTAS = {
+    "vpcs": ("vpc", "L-F678F1CE", 5),
+    "internet_gateways": ("vpc", "L-A4707A72", 5),
+    "nat_gateways_per_az": ("vpc", "L-FE5A380F", 5),
+    "elastic_ips": ("ec2", "L-0263D0A3", 5),
+}
+
+# Private range new environments are allocated from, one /16 each
+ALLOCATION_POOL = "10.0.0.0/8"
+ALLOCATION_PREFIX = 16
+
+
+class CidrIndex:
+    """ Interval index over CIDR blocks; blocks are either nested or disjoint, which keeps queries logarithmic """
+
+    def __init__(self):
+        self._starts = []
+        self._blocks = []
+        # (network address, prefix length) -> [(block, label, owner)]
+        self._by_network = {}
+
+    def add(self, cidr, label, owner=None):
+        network = ipaddress.ip_network(cidr)
+        entry = (str(network), label, owner)
+        start = int(network.network_address)
+        position = bisect.bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._blocks.insert(position, entry)
+        self._by_network.setdefault((start, network.prefixlen), []).append(entry)
+
+    def overlaps(self, cidr):
+        """ (block, label, owner) of every indexed block overlapping cidr """
+        network = ipaddress.ip_network(cidr)
+        start, end = int(network.network_address), int(network.broadcast_address)
+        # Blocks inside the query (including the query itself) start within its range; a larger
+        # block starting at the same address contains the query and is found as a supernet below
+        found = [entry for entry in self._blocks[bisect.bisect_left(self._starts, start):bisect.bisect_right(self._starts, end)]
+                 if int(entry[0].split("/")[1]) >= network.prefixlen]
+        # Blocks containing the query are one of its supernets
+        for prefix in range(network.prefixlen):
+            supernet = network.supernet(new_prefix=prefix)
+            found += self._by_network.get((int(supernet.network_address), prefix), [])
+        return found
+
+
+def _quota(service_code, quota_code, default):
+    try:
+        quotas = aws_clients.client("service-quotas")
+        return int(quotas.get_service_quota(ServiceCode=service_code, QuotaCode=quota_code)["Quota"]["Value"])
+    except Exception as e:
+        print(f"Using the default {quota_code} quota of {default}: {e}")
+        return default
+
+
+def load_account():
+    """ Existing VPC and peered CIDRs, resource counts and quotas, in a few batched calls """
+    ec2 = aws_clients.client("ec2")
+    index = CidrIndex()
+    vpcs = {}
+    for page in ec2.get_paginator("describe_vpcs").paginate():
+        for vpc in page["Vpcs"]:
+            name = next((tag["Value"] for tag in vpc.get("Tags", []) if tag["Key"] == "Name"), vpc["VpcId"])
+            vpcs[name] = vpc["VpcId"]
+            for association in vpc.get("CidrBlockAssociationSet", [{"CidrBlock": vpc["CidrBlock"]}]):
+                index.add(association["CidrBlock"], f"vpc {name} ({vpc['VpcId']})", vpc["VpcId"])
+
+    for page in ec2.get_paginator("describe_vpc_peering_connections").paginate(
+            Filters=[{"Name": "status-code", "Values": ["active", "pending-acceptance", "provisioning"]}]):
+        for peering in page["VpcPeeringConnections"]:
+            for side in ("AccepterVpcInfo", "RequesterVpcInfo"):
+                info = peering.get(side, {})
+                if info.get("VpcId") not in vpcs.values() and info.get("CidrBlock"):
+                    index.add(info["CidrBlock"], f"peer {info.get('VpcId')} via {peering['VpcPeeringConnectionId']}")
+
+    nat_per_az = {}
+    for page in ec2.get_paginator("describe_nat_gateways").paginate(
+            Filter=[{"Name": "state", "Values": ["pending", "available"]}]):
+        for nat in page["NatGateways"]:
+            nat_per_az[nat["SubnetId"]] = nat_per_az.get(nat["SubnetId"], 0) + 1
+    subnet_zones = {}
+    if nat_per_az:
+        for page in ec2.get_paginator("describe_subnets").paginate(SubnetIds=list(nat_per_az)):
+            subnet_zones.update({subnet["SubnetId"]: subnet["AvailabilityZone"] for subnet in page["Subnets"]})
+    zone_counts = {}
+    for subnet_id, count in nat_per_az.items():
+        zone = subnet_zones.get(subnet_id)
+        zone_counts[zone] = zone_counts.get(zone, 0) + count
+
+    return {
+        "index": index,
+        "vpcs": vpcs,
+        "counts": {
+            "vpcs": len(vpcs),
+            "internet_gateways": sum(len(page["InternetGateways"]) for page in ec2.get_paginator("describe_internet_gateways").paginate()),
+            "elastic_ips": len(ec2.describe_addresses()["Addresses"]),
+        },
+        "nat_per_az": zone_counts,
+        "quotas": {name: _quota(*spec) for name, spec in QUOTAS.items()},
+    }
+
+
+def allocate(index, taken=(), pool=ALLOCATION_POOL, prefix=ALLOCATION_PREFIX):
+    """ First block in the pool that overlaps nothing indexed or already taken """
+    for candidate in ipaddress.ip_network(pool).subnets(new_prefix=prefix):
+        if not index.overlaps(candidate) and str(candidate) not in taken:
+            return str(candidate)
+    raise ValueError(f"No free /{prefix} left in {pool}")
+
+
+def load_allocations():
+    """ Auto-allocated octets of every target, keyed by aws_clients.scoped(environment) """
+    try:
+        with open(ALLOCATIONS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def vpc_octets(vpc_name):
+    """ First two octets of an environment's /16 in this thread's target """
+    return load_allocations().get(aws_clients.scoped(vpc_name), NETWORK_OCTETS[vpc_name])
+
+
+def save_allocations(allocations):
+    """ Record auto-allocated octets under this thread's target so its later runs give the environments the same blocks """
+    saved = load_allocations()
+    saved.update({aws_clients.scoped(vpc_name): octets for vpc_name, octets in allocations.items()})
+    state_files.write_json(ALLOCATIONS_FILE, saved, indent=2, sort_keys=True)
+
+
+def plan(vpc_names, region, account, auto_allocate=False, allocations=None):
+    """ Check the proposed environments against the account; return problems (empty when the plan fits) """
+    index = account["index"]
+    octets = {name: vpc_octets(name) for name in NETWORK_OCTETS}
+    problems = []
+    proposed = CidrIndex()
+    new_vpcs, new_eips, new_nat = 0, 0, {}
+
+    for vpc_name in vpc_names:
+        topology = (VPC_TOPOLOGY.get(vpc_name) or network_layout.TopologySpec())._replace(region=region)
+        vpc_cidr = f"{octets[vpc_name]}.0.0/16"
+        existing = account["vpcs"].get(vpc_name)
+        # An environment's own VPC is an update, not a clash
+        clashes = [clash for clash in index.overlaps(vpc_cidr) + proposed.overlaps(vpc_cidr) if not existing or clash[2] != existing]
+        # Allocated blocks are reported through allocations so a passing deploy can save them
+        if clashes and auto_allocate and not existing:
+            # Other environments' configured blocks are skipped too, created yet or not
+            taken = [block for block, _, _ in proposed.overlaps(ALLOCATION_POOL)]
+            taken += [f"{block}.0.0/16" for name, block in octets.items() if name != vpc_name]
+            vpc_cidr = allocate(index, taken)
+            octets[vpc_name] = ".".join(vpc_cidr.split(".")[:2])
+            if allocations is not None:
+                allocations[vpc_name] = octets[vpc_name]
+            print(f"{vpc_name}: allocated {vpc_cidr} instead of the clashing default")
+            clashes = []
+        problems += [f"{vpc_name} {vpc_cidr} overlaps {label} {block}" for block, label, _ in clashes]
+        proposed.add(vpc_cidr, f"planned {vpc_name}")
+
+        try:
+            network_layout.plan_subnets(vpc_name, vpc_cidr, topology)
+        except ValueError as e:
+            problems.append(f"{vpc_name}: {e}")
+            continue
+
+        if existing:
+            continue
+        new_vpcs += 1
+        if "public" in topology.tiers and "private" in topology.tiers:
+            zones = network_layout.availability_zones(topology.region, topology.az_count)
+            for zone in zones if topology.nat_per_az else zones[:1]:
+                new_nat[zone] = new_nat.get(zone, 0) + 1
+                new_eips += 1
+
+    quotas, counts = account["quotas"], account["counts"]
+    if counts["vpcs"] + new_vpcs > quotas["vpcs"]:
+        problems.append(f"{new_vpcs} new VPCs on top of {counts['vpcs']} exceeds the quota of {quotas['vpcs']}")
+    if counts["internet_gateways"] + new_vpcs > quotas["internet_gateways"]:
+        problems.append(f"{new_vpcs} new internet gateways on top of {counts['internet_gateways']} exceeds the quota of {quotas['internet_gateways']}")
+    if counts["elastic_ips"] + new_eips > quotas["elastic_ips"]:
+        problems.append(f"{new_eips} new Elastic IPs on top of {counts['elastic_ips']} exceeds the quota of {quotas['elastic_ips']}")
+    for zone, count in sorted(new_nat.items()):
+        in_use = account["nat_per_az"].get(zone, 0)
+        if in_use + count > quotas["nat_gateways_per_az"]:
+            problems.append(f"{count} new NAT gateways in {zone} on top of {in_use} exceeds the quota of {quotas['nat_gateways_per_az']}")
+    return problems
+
+
+def check(vpc_names, region, auto_allocate=False, persist=False):
+    """ Load the account once and plan the environments; print and return the problems, saving auto-allocated blocks when persist is set """
+    allocations = {}
+    problems = plan(vpc_names, region, load_account(), auto_allocate, allocations)
+    for problem in problems:
+        print(f"Preflight: {problem}")
+    if persist and allocations and not problems:
+        save_allocations(allocations)
+        print(f"Saved the allocated blocks of {', '.join(sorted(allocations))} to {ALLOCATIONS_FILE}")
+    return problems
@@ -1,41 +1,139 @@
-import boto3
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from infrastructure import aws_clients, tracing
+
+# Seconds a resolved VPC/subnet lookup stays valid
+ID_CACHE_TTL = 300
+
+
+def _tag_name(resource):
+    """ Return the Name tag of an EC2 resource """
+    for tag in resource.get('Tags', []):
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return None
+
+
+class VpcComponentResolver:
+    """ Batched, memoized VPC and subnet ID lookups keyed by tag Name """
+
+    def __init__(self, ec2_client=None, ttl=ID_CACHE_TTL):
+        self._client = ec2_client
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # vpc name (qualified by the fan-out target, if any) -> (vpc id or None, {subnet tag name: subnet id}, fetched at)
+        self._cache = {}
+
+    @property
+    def client(self):
+        return self._client or aws_clients.client('ec2')
+
+    def _is_fresh(self, vpc_name):
+        entry = self._cache.get(aws_clients.scoped(vpc_name))
+        return entry is not None and time.monotonic() - entry[2] < self.ttl
+
+    def prefetch(self, vpc_names):
+        """ Load every VPC and its subnets with one describe_* sweep each """
+        with self._lock:
+            stale = sorted({name for name in vpc_names if not self._is_fresh(name)})
+            if not stale:
+                tracing.count("ids.cache_hits")
+                return
+            tracing.count("ids.sweeps")
+            with tracing.span("resolve_ids", vpcs=len(stale)):
+                self._sweep(stale)
+
+    def _sweep(self, stale):
+        """ describe_vpcs and describe_subnets for the stale VPC names; caller holds the lock """
+        vpc_ids = {}
+        paginator = self.client.get_paginator('describe_vpcs')
+        for page in paginator.paginate(Filters=[{'Name': 'tag:Name', 'Values': stale}]):
+            for vpc in page['Vpcs']:
+                vpc_ids.setdefault(_tag_name(vpc), vpc['VpcId'])
+
+        subnets = {vpc_id: {} for vpc_id in vpc_ids.values()}
+        if subnets:
+            paginator = self.client.get_paginator('describe_subnets')
+            for page in paginator.paginate(Filters=[{'Name': 'vpc-id', 'Values': list(subnets)}]):
+                for subnet in page['Subnets']:
+                    name = _tag_name(subnet)
+                    if name:
+                        subnets[subnet['VpcId']].setdefault(name, subnet['SubnetId'])
+
+        fetched_at = time.monotonic()
+        for name in stale:
+            vpc_id = vpc_ids.get(name)
+            self._cache[aws_clients.scoped(name)] = (vpc_id, subnets.get(vpc_id, {}), fetched_at)
+
+    def invalidate(self, vpc_name=None):
+        """ Drop one VPC (or everything) from the cache """
+        with self._lock:
+            if vpc_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(aws_clients.scoped(vpc_name), None)
+
+    def get_vpc_id(self, vpc_name):
+        """ Get VPC ID """
+        self.prefetch([vpc_name])
+        vpc_id = self._cache[aws_clients.scoped(vpc_name)][0]
+        if vpc_id:
+            return vpc_id
+        return f"vpc {vpc_name} not found"
+
+    def get_subnet_id(self, vpc_name, subnet_name):
+        """ Get Subnet ID """
+        self.prefetch([vpc_name])
+        subnet_name = f"{vpc_name}-{subnet_name}"
+        subnet_id = self._cache[aws_clients.scoped(vpc_name)][1].get(subnet_name)
+        if subnet_id:
+            return subnet_id
+        return f"{subnet_name} not found"
+
+
+class OfflineResolver:
+    """ Deterministic placeholder IDs for rendering templates without AWS access """
+
+    def _placeholder(self, prefix, name):
+        return f"{prefix}-{hashlib.sha256(name.encode()).hexdigest()[:17]}"
+
+    def prefetch(self, vpc_names):
+        pass
+
+    def invalidate(self, vpc_name=None):
+        pass
+
+    def get_vpc_id(self, vpc_name):
+        """ Get VPC ID """
+        return self._placeholder("vpc", vpc_name)
+
+    def get_subnet_id(self, vpc_name, subnet_name):
+        """ Get Subnet ID """
+        return self._placeholder("subnet", f"{vpc_name}-{subnet_name}")
+
+
+# Shared by the VPC, security group and instance generators
+resolver = VpcComponentResolver()
+
+
+@contextmanager
+def use_resolver(new_resolver):
+    """ Temporarily route every lookup through another resolver """
+    global resolver
+    previous, resolver = resolver, new_resolver
+    try:
+        yield new_resolver
+    finally:
+        resolver = previous
 
-client = boto3.client('ec2')
 
 def get_vpc_id(vpc_name):
     """ Get VPC ID """
-    response = client.describe_vpcs(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    vpc_name,
-                ]
-            }
-        ]
-    )
-    resp = response['Vpcs']
-    if resp:
-        return resp[0]['VpcId']
-    else:
-       return f"vpc {vpc_name} not found"
+    return resolver.get_vpc_id(vpc_name)
+
 
 def get_subnet_id(vpc_name, subnet_name):
     """ Get Subnet ID """
-    subnet_name = f"{vpc_name}-{subnet_name}"
-    response = client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    subnet_name,
-                ]
-            }
-        ]
-    )
-    resp_val = response['Subnets'][0]['SubnetId']
-    if resp_val:
-       return resp_val 
-    else:
-       return f"{subnet_name} not found"
-
+    return resolver.get_subnet_id(vpc_name, subnet_name)
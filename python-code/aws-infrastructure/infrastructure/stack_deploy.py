@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from infrastructure import aws_clients, stack_monitor, state_files, tracing
+from infrastructure.config import STATE_DIR
+
+# Local record of the template fingerprint last deployed to each stack
+STATE_FILE = os.path.join(STATE_DIR, "stack_state.json")
+
+# Capabilities acknowledged on every change set
+CAPABILITIES = ["CAPABILITY_IAM"]
+
+# Change set poll delay (seconds)
+CHANGE_SET_POLL_DELAY = 2
+
+# Status reasons CloudFormation gives for a change set with nothing to do
+NO_CHANGE_REASONS = ("didn't contain changes", "No updates are to be performed")
+
+# Results of deploy_stack
+UNCHANGED = "UNCHANGED"
+
+# Stack states a CREATE change set applies to (None: no such stack)
+CREATE_STATUSES = {None, "DELETE_COMPLETE", "REVIEW_IN_PROGRESS"}
+
+# States no change set can be applied to; the stack has to be deleted and created again
+RECREATE_STATUSES = {"ROLLBACK_COMPLETE", "ROLLBACK_FAILED", "DELETE_FAILED"}
+
+# States an update can only leave once the failed rollback is continued (continue-update-rollback)
+CONTINUE_ROLLBACK_STATUSES = {"UPDATE_ROLLBACK_FAILED"}
+
+_state_lock = threading.Lock()
+
+
+def template_fingerprint(template_body, parameters=None):
+    """ Hash of a rendered template and its parameters """
+    digest = hashlib.sha256(template_body.encode())
+    digest.update(json.dumps(sorted((parameters or {}).items())).encode())
+    return digest.hexdigest()
+
+
+def _load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def recorded_state(stack_name):
+    """ Fingerprint and last updated time recorded at the stack's last deploy, or {} """
+    return _load_state().get(aws_clients.scoped(stack_name), {})
+
+
+def _record_state(stack_name, fingerprint, last_updated):
+    with _state_lock:
+        state = _load_state()
+        state[aws_clients.scoped(stack_name)] = {"fingerprint": fingerprint, "last_updated": last_updated}
+        state_files.write_json(STATE_FILE, state, indent=2, sort_keys=True)
+
+
+def _describe(client, stack_name):
+    try:
+        return client.describe_stacks(StackName=stack_name)["Stacks"][0]
+    except ClientError as e:
+        if aws_clients.is_missing(e):
+            return None
+        raise
+
+
+def stack_status(client, stack_name):
+    """ Current status of a stack, or None when it does not exist """
+    stack = _describe(client, stack_name)
+    return stack["StackStatus"] if stack else None
+
+
+@tracing.traced("stack_action")
+def stack_action(client, stack_name):
+    """ "create" or "update" for a stack's next deploy; raise ValueError when neither can run """
+    status = stack_status(client, stack_name)
+    if status in CREATE_STATUSES:
+        return "create"
+    if status in RECREATE_STATUSES:
+        raise ValueError(f"{stack_name} is {status}; delete it (delete-stack -s {stack_name}) and deploy again")
+    if status in CONTINUE_ROLLBACK_STATUSES:
+        raise ValueError(f"{stack_name} is {status}; continue its rollback (aws cloudformation continue-update-rollback) and deploy again")
+    if status.endswith("_IN_PROGRESS"):
+        raise ValueError(f"{stack_name} is {status}; wait for it to settle and deploy again")
+    return "update"
+
+
+def deploy_action(client, stack_name):
+    """ stack_action() with the choice printed; None (after printing why) when the stack cannot be deployed """
+    try:
+        action = stack_action(client, stack_name)
+    except ValueError as e:
+        print(f"An error occurred: {e}")
+        return None
+    if action == "update":
+        print(f"{stack_name} Exists. Updating Now")
+    else:
+        print(f"{stack_name} Does Not Exist. Creating Now")
+    return action
+
+
+def last_updated(stack):
+    """ Timestamp that changes whenever the stack is updated """
+    return str(stack.get("LastUpdatedTime") or stack["CreationTime"])
+
+
+def _deployed_fingerprint(client, stack):
+    """ Fingerprint of the template and parameters the stack is running """
+    body = client.get_template(StackName=stack["StackName"], TemplateStage="Original")["TemplateBody"]
+    if not isinstance(body, str):
+        # JSON templates come back already parsed
+        body = json.dumps(body)
+    parameters = {p["ParameterKey"]: p["ParameterValue"] for p in stack.get("Parameters", [])}
+    return template_fingerprint(body, parameters)
+
+
+def is_unchanged(client, stack_name, fingerprint):
+    """ True when the deployed stack already runs this exact template and parameters """
+    stack = _describe(client, stack_name)
+    if stack is None:
+        return False
+    updated = last_updated(stack)
+    recorded = recorded_state(stack_name)
+    if recorded.get("fingerprint") == fingerprint and recorded.get("last_updated") == updated:
+        return True
+    if _deployed_fingerprint(client, stack) == fingerprint:
+        _record_state(stack_name, fingerprint, updated)
+        return True
+    return False
+
+
+def _wait_for_change_set(client, stack_name, change_set_name):
+    """ Wait for a change set to finish computing; None means it contains no changes """
+    while True:
+        change_set = client.describe_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        if change_set["Status"] == "CREATE_COMPLETE":
+            return change_set
+        if change_set["Status"] == "FAILED":
+            reason = change_set.get("StatusReason", "")
+            if any(text in reason for text in NO_CHANGE_REASONS):
+                client.delete_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+                return None
+            raise RuntimeError(f"Change set {change_set_name} failed: {reason}")
+        time.sleep(CHANGE_SET_POLL_DELAY)
+
+
+def print_changes(change_set):
+    """ Print the resource-level diff of a change set """
+    for change in change_set.get("Changes", []):
+        rc = change["ResourceChange"]
+        replacement = f" (replacement: {rc['Replacement']})" if rc.get("Replacement") else ""
+        print(f"  {rc['Action']:<8} {rc['LogicalResourceId']:<40} {rc['ResourceType']}{replacement}")
+
+
+def deploy_stack(client, stack_name, template_body, stack_action, parameters=None):
+    """ Create or update a stack through a change set, skipping stacks already in sync """
+    fingerprint = template_fingerprint(template_body, parameters)
+    if stack_action == "update":
+        with tracing.span("unchanged_check", stack=stack_name):
+            unchanged = is_unchanged(client, stack_name, fingerprint)
+        if unchanged:
+            tracing.count("stacks.unchanged")
+            print(f"{stack_name} is unchanged. Skipping")
+            return UNCHANGED
+
+    change_set_type = "CREATE" if stack_action == "create" else "UPDATE"
+    change_set_name = f"{stack_name}-{fingerprint[:12]}-{int(time.time())}"
+    print(f"{'Creating' if stack_action == 'create' else 'Updating'} {stack_name} stack")
+    with tracing.span("change_set", stack=stack_name, type=change_set_type):
+        client.create_change_set(
+            StackName=stack_name,
+            ChangeSetName=change_set_name,
+            ChangeSetType=change_set_type,
+            TemplateBody=template_body,
+            Parameters=[{"ParameterKey": k, "ParameterValue": v} for k, v in (parameters or {}).items()],
+            Capabilities=CAPABILITIES,
+        )
+        change_set = _wait_for_change_set(client, stack_name, change_set_name)
+    if change_set is None:
+        tracing.count("stacks.unchanged")
+        print(f"{stack_name} has no changes. Skipping")
+        stack = _describe(client, stack_name)
+        if stack is not None:
+            _record_state(stack_name, fingerprint, last_updated(stack))
+        return UNCHANGED
+
+    print(f"{stack_name} change set {change_set_name}:")
+    print_changes(change_set)
+    started = stack_monitor.operation_start()
+    with tracing.span("provision", stack=stack_name, changes=len(change_set.get("Changes", []))):
+        client.execute_change_set(StackName=stack_name, ChangeSetName=change_set_name)
+        status = stack_monitor.wait_for_stack(client, stack_name, since=started)
+    tracing.count("stacks.deployed")
+    _record_state(stack_name, fingerprint, last_updated(_describe(client, stack_name)))
+    print(f"{stack_name} stack {stack_action} complete")
+    return status
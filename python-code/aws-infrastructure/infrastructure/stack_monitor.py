@@ -0,0 +1,124 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from infrastructure import aws_clients
+
+# Poll delay bounds (seconds); the delay resets whenever new events arrive
+MIN_POLL_DELAY = 1.0
+MAX_POLL_DELAY = 15.0
+BACKOFF_FACTOR = 1.5
+
+# Allowance for skew between the local clock and CloudFormation event timestamps
+CLOCK_SKEW = timedelta(seconds=5)
+
+SUCCESS_STATUSES = {
+    "CREATE_COMPLETE",
+    "UPDATE_COMPLETE",
+    "DELETE_COMPLETE",
+    "IMPORT_COMPLETE",
+}
+
+FAILURE_STATUSES = {
+    "CREATE_FAILED",
+    "ROLLBACK_COMPLETE",
+    "ROLLBACK_FAILED",
+    "DELETE_FAILED",
+    "UPDATE_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE",
+    "UPDATE_ROLLBACK_FAILED",
+    "IMPORT_ROLLBACK_COMPLETE",
+    "IMPORT_ROLLBACK_FAILED",
+}
+
+# Event loop every blocking wait shares, so N watched stacks poll from one loop
+_loop = None
+_loop_lock = threading.Lock()
+
+
+class StackFailed(Exception):
+    """ Raised when a stack operation ends in a failure or rollback state """
+
+    def __init__(self, stack_name, status, reasons):
+        self.stack_name = stack_name
+        self.status = status
+        self.reasons = reasons
+        detail = "; ".join(reasons) if reasons else "no resource failure reported"
+        super().__init__(f"{stack_name} finished in {status}: {detail}")
+
+
+def operation_start():
+    """ Timestamp to pass as `since` before submitting a stack operation """
+    return datetime.now(timezone.utc) - CLOCK_SKEW
+
+
+def print_event(event):
+    """ Default event reporter """
+    reason = event.get("ResourceStatusReason", "")
+    print(f"{event['Timestamp']:%H:%M:%S} {event['StackName']:<30} {event['LogicalResourceId']:<40} {event['ResourceStatus']:<20} {reason}")
+
+
+def _new_events(client, stack_name, seen, since):
+    """ Fetch events newer than those already seen, oldest first """
+    events = []
+    paginator = client.get_paginator("describe_stack_events")
+    for page in paginator.paginate(StackName=stack_name):
+        for event in page["StackEvents"]:
+            if event["EventId"] in seen or event["Timestamp"] < since:
+                return list(reversed(events))
+            seen.add(event["EventId"])
+            events.append(event)
+    return list(reversed(events))
+
+
+async def watch_stack(client, stack_name, since=None, on_event=print_event,
+                      min_delay=MIN_POLL_DELAY, max_delay=MAX_POLL_DELAY, seen=None):
+    """ Stream a stack's events until it reaches a terminal state; return that state. Event IDs in `seen` are skipped """
+    loop = asyncio.get_running_loop()
+    since = since or operation_start()
+    seen = set() if seen is None else seen
+    reasons = []
+    delay = min_delay
+    while True:
+        try:
+            events = await loop.run_in_executor(None, _new_events, client, stack_name, seen, since)
+        except ClientError as e:
+            # A deleted stack can no longer be described by name
+            if aws_clients.is_missing(e):
+                return "DELETE_COMPLETE"
+            if not aws_clients.is_throttle(e):
+                raise
+            # Throttled polls slow this watcher down instead of failing the deploy
+            delay = max_delay
+            await asyncio.sleep(delay)
+            continue
+
+        for event in events:
+            on_event(event)
+            status = event["ResourceStatus"]
+            if status.endswith("_FAILED") and event.get("ResourceStatusReason"):
+                reasons.append(f"{event['LogicalResourceId']}: {event['ResourceStatusReason']}")
+            if event["ResourceType"] == "AWS::CloudFormation::Stack" and event["LogicalResourceId"] == event["StackName"]:
+                if status in SUCCESS_STATUSES:
+                    return status
+                if status in FAILURE_STATUSES:
+                    raise StackFailed(stack_name, status, reasons)
+
+        delay = min_delay if events else min(delay * BACKOFF_FACTOR, max_delay)
+        await asyncio.sleep(delay)
+
+
+def _monitor_loop():
+    """ The one event loop every blocking wait runs its watch on, started in a daemon thread on first use """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="stack-monitor", daemon=True).start()
+        return _loop
+
+
+def wait_for_stack(client, stack_name, since=None, on_event=print_event, seen=None):
+    """ Block until a stack settles; the watch runs on the shared monitor loop alongside every other stack's """
+    future = asyncio.run_coroutine_threadsafe(watch_stack(client, stack_name, since, on_event, seen=seen), _monitor_loop())
+    return future.result()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+from troposphere import Export, GetAtt, Output, Parameter, Ref, Template
+from troposphere import cloudformation
+from infrastructure import aws_clients, template_factory
+from infrastructure.config import TEMPLATE_BUCKET
+
+# Resources and JSON bytes per nested stack; kept well under the 500 resource / 1 MB limits
+SHARD_MAX_RESOURCES = 200
+SHARD_MAX_BYTES = 400 * 1024
+
+
+class S3TemplateStore:
+    """ Upload shard templates to S3 and hand back their TemplateURL """
+
+    def __init__(self, bucket, prefix="templates"):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, key, body):
+        s3 = aws_clients.client("s3")
+        key = f"{self.prefix}/{key}"
+        s3.put_object(Bucket=self.bucket, Key=key, Body=body.encode(), ContentType="application/json")
+        region = s3.meta.region_name
+        return f"https://{self.bucket}.s3.{region}.amazonaws.com/{key}"
+
+    def put_file(self, key, path):
+        s3 = aws_clients.client("s3")
+        key = f"{self.prefix}/{key}"
+        s3.upload_file(path, self.bucket, key, ExtraArgs={"ContentType": "application/json"})
+        region = s3.meta.region_name
+        return f"https://{self.bucket}.s3.{region}.amazonaws.com/{key}"
+
+
+class LocalTemplateStore:
+    """ Write shard templates to a directory; stands in for S3 offline and in tests """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, key, body):
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(body)
+        return f"file://{os.path.abspath(path)}"
+
+    def put_file(self, key, source):
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(source, path)
+        return f"file://{os.path.abspath(path)}"
+
+
+def template_store():
+    """ Store configured through INFRA_TEMPLATE_BUCKET, or None """
+    return S3TemplateStore(TEMPLATE_BUCKET) if TEMPLATE_BUCKET else None
+
+
+def _references(node, found):
+    """ Collect the logical IDs a resource or output refers to """
+    if isinstance(node, dict):
+        if "Ref" in node and isinstance(node["Ref"], str):
+            found.add(node["Ref"])
+        if "Fn::GetAtt" in node:
+            target = node["Fn::GetAtt"]
+            found.add(target[0] if isinstance(target, list) else target.split(".")[0])
+        depends_on = node.get("DependsOn")
+        if depends_on:
+            found.update([depends_on] if isinstance(depends_on, str) else depends_on)
+        for value in node.values():
+            _references(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _references(value, found)
+    return found
+
+
+def needs_sharding(t):
+    """ True when a template is too large to deploy as a single stack """
+    if len(t.resources) > SHARD_MAX_RESOURCES:
+        return True
+    return len(json.dumps(t.to_dict(), separators=(",", ":"))) > template_factory.MAX_TEMPLATE_BODY_BYTES
+
+
+def partition(resources, outputs=None):
+    """ Group resources that reference each other (or share an output), then pack the groups into shards """
+    parent = {name: name for name in resources}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for name, body in resources.items():
+        for target in _references(body, set()):
+            if target in resources:
+                parent[find(name)] = find(target)
+    for output in (outputs or {}).values():
+        targets = [target for target in _references(output["Value"], set()) if target in resources]
+        for target in targets[1:]:
+            parent[find(target)] = find(targets[0])
+
+    groups = {}
+    for name in resources:
+        groups.setdefault(find(name), []).append(name)
+
+    shards, current, current_bytes = [], [], 0
+    for names in groups.values():
+        size = sum(len(json.dumps(resources[name], separators=(",", ":"))) for name in names)
+        if len(names) > SHARD_MAX_RESOURCES or size > SHARD_MAX_BYTES:
+            raise ValueError(f"Resources {names[:5]}... reference each other and cannot be split below the shard limits")
+        if current and (len(current) + len(names) > SHARD_MAX_RESOURCES or current_bytes + size > SHARD_MAX_BYTES):
+            shards.append(current)
+            current, current_bytes = [], 0
+        current.extend(names)
+        current_bytes += size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def shard_body(stack_name, resources, parameters=None, outputs=None):
+    """ Canonical JSON of a nested stack template, shared by every path that writes shards """
+    # Nothing that depends on the other shards (such as their count) goes in, so a shard's body, and
+    # with it its content-addressed URL, only changes when its own resources do
+    child = {
+        "AWSTemplateFormatVersion": template_factory.TEMPLATE_VERSION,
+        "Description": f"{stack_name} shard",
+        "Resources": resources,
+    }
+    if parameters:
+        child["Parameters"] = parameters
+    if outputs:
+        child["Outputs"] = outputs
+    return json.dumps(child, separators=(",", ":"), sort_keys=True)
+
+
+def shard_key(stack_name, body):
+    """ Content-addressed store key of a shard body """
+    return f"{stack_name}/{hashlib.sha256(body.encode()).hexdigest()}.json"
+
+
+def nest(t, stack_name, store):
+    """ Move a template's resources into nested stacks uploaded to store; return the parent template """
+    body = t.to_dict()
+    resources = body.get("Resources", {})
+    parameters = body.get("Parameters", {})
+    outputs = body.get("Outputs", {})
+    shards = partition(resources, outputs)
+
+    parent_t = Template()
+    parent_t.set_version(template_factory.TEMPLATE_VERSION)
+    parent_t.set_description(body.get("Description", stack_name))
+    for name, spec in parameters.items():
+        parent_t.add_parameter(Parameter(name, **spec))
+
+    owner = {}
+    for number, names in enumerate(shards, start=1):
+        shard_name = f"Shard{number}"
+        child_resources = {name: resources[name] for name in names}
+        for name in names:
+            owner[name] = shard_name
+        used = _references(child_resources, set())
+        child_parameters = {name: spec for name, spec in parameters.items() if name in used}
+        child_outputs = {}
+        for name, output in outputs.items():
+            if _references(output["Value"], set()) & set(names):
+                child_outputs[name] = {"Value": output["Value"]}
+
+        child_body = shard_body(stack_name, child_resources, child_parameters, child_outputs)
+        # Content-addressed key: an unchanged shard keeps its URL and is left alone on update
+        key = shard_key(stack_name, child_body)
+        shard = cloudformation.Stack(shard_name, TemplateURL=store.put(key, child_body))
+        if child_parameters:
+            shard.Parameters = {name: Ref(name) for name in child_parameters}
+        parent_t.add_resource(shard)
+
+    for name, output in outputs.items():
+        shard_name = next((owner[target] for target in _references(output["Value"], set()) if target in owner), None)
+        if shard_name is None:
+            raise ValueError(f"Output {name} does not reference any resource")
+        parent_output = Output(name, Value=GetAtt(shard_name, f"Outputs.{name}"))
+        if "Export" in output:
+            parent_output.Export = Export(output["Export"]["Name"])
+        parent_t.add_output(parent_output)
+    return parent_t
@@ -0,0 +1,13 @@
+import json
+import os
+import threading
+
+
+def write_json(path, data, **options):
+    """ Write JSON through a temp file and os.replace, so readers never see a partial file """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per process and thread, so concurrent writers never share a temp file
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f, **options)
+    os.replace(tmp_file, path)
@@ -0,0 +1,109 @@
+from botocore.exceptions import ClientError
+from infrastructure import aws_clients, deploy_engine, inventory, stack_monitor, tracing
+
+# Attempts per stack when a deletion ends in DELETE_FAILED
+DELETE_ATTEMPTS = 3
+
+
+def _stack_name_from_id(stack_id):
+    """ arn:aws:cloudformation:region:account:stack/NAME/uuid -> NAME """
+    return stack_id.split(":stack/", 1)[-1].split("/", 1)[0]
+
+
+def stack_exports(client):
+    """ Map each stack name to the export names it owns """
+    owned = {}
+    for page in client.get_paginator("list_exports").paginate():
+        for export in page["Exports"]:
+            owned.setdefault(_stack_name_from_id(export["ExportingStackId"]), []).append(export["Name"])
+    return owned
+
+
+def importers(client, export_name):
+    """ Names of the stacks importing an export """
+    try:
+        return [name for page in client.get_paginator("list_imports").paginate(ExportName=export_name)
+                for name in page["Imports"]]
+    except ClientError as e:
+        if "is not imported by any stack" in e.response.get("Error", {}).get("Message", ""):
+            return []
+        raise
+
+
+def deletion_order(client, stack_names):
+    """ Map each stack to the stacks that must be gone before it can be deleted """
+    wanted = set(stack_names)
+    blockers = {name: set() for name in stack_names}
+
+    # Kind ordering covers references that do not go through exports (subnet IDs resolved by tag)
+    by_env = {}
+    for name in stack_names:
+        env, kind, _ = inventory.stack_identity(name)
+        if kind:
+            by_env.setdefault(env, []).append((name, kind))
+    for stacks in by_env.values():
+        for name, kind in stacks:
+            for other, other_kind in stacks:
+                if kind in deploy_engine.STACK_DEPENDENCIES.get(other_kind, []):
+                    blockers[name].add(other)
+
+    outside = []
+    owned = stack_exports(client)
+    for name in stack_names:
+        for export_name in owned.get(name, []):
+            for importer in importers(client, export_name):
+                if importer in wanted:
+                    blockers[name].add(importer)
+                elif importer != name:
+                    outside.append(f"{importer} imports {export_name} from {name}")
+    if outside:
+        raise ValueError("Stacks outside the teardown still import exports: " + "; ".join(outside))
+    return blockers
+
+
+def _failed_resources(client, stack_name):
+    failed = []
+    for page in client.get_paginator("list_stack_resources").paginate(StackName=stack_name):
+        failed += [resource["LogicalResourceId"] for resource in page["StackResourceSummaries"]
+                   if resource["ResourceStatus"] == "DELETE_FAILED"]
+    return failed
+
+
+def delete_stack(client, stack_name, attempts=DELETE_ATTEMPTS, retain_failed=False, on_event=stack_monitor.print_event):
+    """ Delete a stack and stream its events, retrying after DELETE_FAILED """
+    retain = []
+    # Shared by every attempt: CLOCK_SKEW puts the last attempt's DELETE_FAILED inside the next one's window
+    seen = set()
+    for attempt in range(1, attempts + 1):
+        started = stack_monitor.operation_start()
+        if retain:
+            client.delete_stack(StackName=stack_name, RetainResources=retain)
+        else:
+            client.delete_stack(StackName=stack_name)
+        try:
+            with tracing.span("delete", stack=stack_name, attempt=attempt):
+                return stack_monitor.wait_for_stack(client, stack_name, since=started, on_event=on_event, seen=seen)
+        except stack_monitor.StackFailed as e:
+            if e.status != "DELETE_FAILED" or attempt == attempts:
+                raise
+            failed = _failed_resources(client, stack_name)
+            print(f"{stack_name} delete attempt {attempt} failed on {', '.join(failed) or 'unknown resources'}, retrying")
+            # Resources that keep failing are left behind on the last attempt when asked
+            if retain_failed and attempt == attempts - 1:
+                retain = failed
+
+
+def build_plan(stack_names, client=None, retain_failed=False):
+    """ One StackTask per deletion, depending on the stacks that must go first """
+    client = client or aws_clients.client("cloudformation")
+    blockers = deletion_order(client, stack_names)
+    return [
+        deploy_engine.StackTask(name, lambda s=name: delete_stack(client, s, retain_failed=retain_failed), sorted(blockers[name]))
+        for name in stack_names
+    ]
+
+
+def teardown(stack_names, max_workers=deploy_engine.MAX_PARALLEL_STACKS, retain_failed=False):
+    """ Delete stacks concurrently in reverse dependency order; return the finished tasks """
+    tasks = build_plan(stack_names, retain_failed=retain_failed)
+    return deploy_engine.run_plan(tasks, max_workers=max_workers)
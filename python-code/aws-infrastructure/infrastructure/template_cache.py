@@ -0,0 +1,119 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+from infrastructure import aws_clients, stack_deploy, state_files, tracing
+
+# Rendered templates keyed by a hash of their generator's inputs and the code version
+CACHE_DIR = os.path.join(stack_deploy.STATE_DIR, "templates")
+
+# Entries kept; the least recently used are evicted beyond this
+CACHE_MAX_ENTRIES = int(os.environ.get("INFRA_TEMPLATE_CACHE_SIZE", "256"))
+
+# Set to False (--no-template-cache) to always rebuild and deploy
+ENABLED = os.environ.get("INFRA_TEMPLATE_CACHE", "1") != "0"
+
+_lock = threading.Lock()
+# (account, region) -> {stack name: last updated}, from one describe_stacks sweep per run
+_stacks = {}
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """ Hash of this package's sources (config included) and the troposphere version """
+    import troposphere
+    digest = hashlib.sha256(troposphere.__version__.encode())
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode() + b"\0" + f.read())
+    return digest.hexdigest()
+
+
+def cache_key(kind, inputs):
+    """ Content address of a generator's output """
+    payload = json.dumps({"kind": kind, "inputs": inputs, "code": code_version()}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def _get(key):
+    try:
+        with open(_path(key)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # The file's mtime is its last use
+    os.utime(_path(key))
+    return entry
+
+
+def _put(key, entry):
+    state_files.write_json(_path(key), entry)
+    evict()
+
+
+def evict(max_entries=None):
+    """ Delete the least recently used entries beyond max_entries; return how many were deleted """
+    max_entries = CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    with _lock:
+        paths = glob.glob(os.path.join(CACHE_DIR, "*.json"))
+        if len(paths) <= max_entries:
+            return 0
+        by_use = sorted(paths, key=lambda path: os.stat(path).st_mtime if os.path.exists(path) else 0)
+        for path in by_use[:len(paths) - max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(paths) - max_entries
+
+
+def render(kind, inputs, build, parameters=None):
+    """ (template body, fingerprint) for a generator's inputs; build() only runs on a miss """
+    key = cache_key(kind, inputs)
+    entry = _get(key) if ENABLED else None
+    if entry is not None:
+        tracing.count("templates.cache_hits")
+        return entry["template_body"], entry["fingerprint"]
+    tracing.count("templates.cache_misses")
+    template_body = build()
+    fingerprint = stack_deploy.template_fingerprint(template_body, parameters)
+    if ENABLED:
+        _put(key, {"kind": kind, "inputs": inputs, "template_body": template_body, "fingerprint": fingerprint})
+    return template_body, fingerprint
+
+
+def _sweep():
+    """ Last updated time of every stack in the thread's account and region, in one paginated describe_stacks call per run """
+    scope = aws_clients.scope()
+    with _lock:
+        if scope not in _stacks:
+            stacks = {}
+            paginator = aws_clients.client("cloudformation").get_paginator("describe_stacks")
+            with tracing.span("stack sweep"):
+                for page in paginator.paginate():
+                    for stack in page["Stacks"]:
+                        stacks[stack["StackName"]] = stack_deploy.last_updated(stack)
+            _stacks[scope] = stacks
+        return _stacks[scope]
+
+
+def in_sync(stack_name, fingerprint):
+    """ True when the stack was last deployed with this fingerprint and has not changed since """
+    if not ENABLED:
+        return False
+    recorded = stack_deploy.recorded_state(stack_name)
+    if recorded.get("fingerprint") != fingerprint:
+        return False
+    return _sweep().get(stack_name) == recorded.get("last_updated")
+
+
+def reset():
+    """ Forget the stack sweep so the next check sees stacks deployed since """
+    with _lock:
+        _stacks.clear()
@@ -0,0 +1,88 @@
+from functools import lru_cache
+from troposphere import Template, Tags
+from infrastructure import network_layout, tracing
+
+# CloudFormation template format version
+TEMPLATE_VERSION = "2010-09-09"
+
+# CloudFormation quotas checked before a template is submitted
+MAX_RESOURCES = 500
+MAX_OUTPUTS = 200
+MAX_TEMPLATE_BODY_BYTES = 51200
+MAX_TEMPLATE_URL_BYTES = 1024 * 1024
+
+
+class StackTemplate(Template):
+    """ Template that leaves the resource limit to validate() so large tiers can be sharded """
+
+    def add_resource(self, resource):
+        return self._update(self.resources, resource)
+
+
+def new_template(kind, vpc_name):
+    """ Return a fresh Template for one stack of one environment """
+    t = StackTemplate()
+    t.set_version(TEMPLATE_VERSION)
+    t.set_description(f"{vpc_name} {kind} stack")
+    return t
+
+
+@lru_cache(maxsize=None)
+def tags(name, department=None, environment=None):
+    """ Shared Tags block; resources only read it when the template renders """
+    values = {"Name": name}
+    if department:
+        values["Department"] = department
+    if environment:
+        values["Environment"] = environment
+    return Tags(**values)
+
+
+@lru_cache(maxsize=None)
+def subnet_specs(vpc_name, vpc_cidr, topology):
+    """ Subnet layout of an environment's VPC """
+    return tuple(network_layout.plan_subnets(vpc_name, vpc_cidr, topology))
+
+
+def render(t):
+    """ Serialize a template once; print and deploy the same string """
+    with tracing.span("render", resources=len(t.resources)):
+        return t.to_yaml()
+
+
+def validate(t, template_body):
+    """ Return the CloudFormation limits a rendered template breaks """
+    problems = []
+    if len(t.resources) > MAX_RESOURCES:
+        problems.append(f"{len(t.resources)} resources exceeds the {MAX_RESOURCES} resource limit")
+    if len(t.outputs) > MAX_OUTPUTS:
+        problems.append(f"{len(t.outputs)} outputs exceeds the {MAX_OUTPUTS} output limit")
+    size = len(template_body.encode())
+    if size > MAX_TEMPLATE_URL_BYTES:
+        problems.append(f"{size} byte template exceeds the {MAX_TEMPLATE_URL_BYTES} byte S3 template limit")
+    elif size > MAX_TEMPLATE_BODY_BYTES:
+        problems.append(f"{size} byte template exceeds the {MAX_TEMPLATE_BODY_BYTES} byte TemplateBody limit")
+    return problems
+
+
+def exports(t):
+    """ Export names a template publishes """
+    return {output.Export.data["Name"] for output in t.outputs.values() if hasattr(output, "Export")}
+
+
+def imports(t):
+    """ Export names a template imports through Fn::ImportValue """
+    found = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "Fn::ImportValue" in node and isinstance(node["Fn::ImportValue"], str):
+                found.add(node["Fn::ImportValue"])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(t.to_dict())
+    return found
@@ -0,0 +1,137 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from infrastructure.aws_clients import THROTTLE_CODES
+
+# JSON lines file receiving every span and API call; unset keeps traces in memory only
+TRACE_FILE = os.environ.get("INFRA_TRACE_FILE")
+
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+_run_started = time.perf_counter()
+# span or call name -> [count, total seconds, max seconds, errors]
+_totals = {}
+# counter name -> value
+_counters = {}
+_exporter = None
+
+
+def _export(record):
+    global _exporter
+    if not TRACE_FILE:
+        return
+    line = json.dumps(record, default=str)
+    with _lock:
+        if _exporter is None:
+            _exporter = open(TRACE_FILE, "a")
+        _exporter.write(line + "\n")
+        _exporter.flush()
+
+
+def _add(name, seconds, error):
+    with _lock:
+        entry = _totals.setdefault(name, [0, 0.0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += 1 if error else 0
+
+
+def count(name, value=1):
+    """ Add to a run counter """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def span(name, **attributes):
+    """ Time a block as a span nested under the thread's current span """
+    stack = _local.__dict__.setdefault("stack", [])
+    span_id = next(_ids)
+    parent_id = stack[-1] if stack else None
+    stack.append(span_id)
+    started_at = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        stack.pop()
+        _add(name, seconds, error)
+        _export({"type": "span", "name": name, "id": span_id, "parent": parent_id, "thread": threading.current_thread().name,
+                 "start": started_at, "seconds": round(seconds, 6), "error": error, **attributes})
+
+
+def traced(name):
+    """ Decorator form of span() """
+    def decorate(fn):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__ = fn.__name__, fn.__doc__
+        return wrapper
+    return decorate
+
+
+def _before_call(context, **kwargs):
+    context["trace_started"] = time.perf_counter()
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    # before-call is skipped when another handler short-circuits the request
+    started = context.get("trace_started")
+    seconds = time.perf_counter() - started if started is not None else 0.0
+    metadata = parsed.get("ResponseMetadata", {})
+    error = parsed.get("Error", {}).get("Code")
+    name = f"api {model.service_model.service_name}.{model.name}"
+    _add(name, seconds, error)
+    count("api.calls")
+    count("api.retries", metadata.get("RetryAttempts", 0))
+    if error:
+        count("api.errors")
+    _export({"type": "api", "name": name, "seconds": round(seconds, 6), "status": metadata.get("HTTPStatusCode"),
+             "retries": metadata.get("RetryAttempts", 0), "error": error, "thread": threading.current_thread().name})
+
+
+def _needs_retry(response, **kwargs):
+    # Fires once per attempt; only throttled attempts are counted
+    if response is not None and response[1].get("Error", {}).get("Code") in THROTTLE_CODES:
+        count("api.throttles")
+
+
+def instrument(session):
+    """ Register API call, retry and throttle hooks on a boto3 Session """
+    session.events.register("before-call", _before_call)
+    session.events.register("after-call", _after_call)
+    session.events.register("needs-retry", _needs_retry)
+
+
+def summary_rows():
+    """ Per span/call rows sorted by total time, with each one's share of the run's wall clock """
+    wall = time.perf_counter() - _run_started
+    with _lock:
+        totals = sorted(_totals.items(), key=lambda item: item[1][1], reverse=True)
+    return [[name, n, f"{total:.3f}s", f"{longest:.3f}s", f"{100 * total / wall:.1f}%" if wall else "-", errors]
+            for name, (n, total, longest, errors) in totals]
+
+
+def counter_rows():
+    with _lock:
+        return sorted([name, value] for name, value in _counters.items())
+
+
+def reset():
+    """ Clear totals and counters and restart the run clock """
+    global _run_started
+    with _lock:
+        _totals.clear()
+        _counters.clear()
+        _run_started = time.perf_counter()
@@ -0,0 +1,35 @@
+import os
+import sys
+import pytest
+
+# The infrastructure package is imported from the project directory, as build_infra_cli.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def stubbed():
+    """ Factory for clients whose calls are answered by an activated botocore Stubber """
+    import boto3
+    from botocore.stub import Stubber
+    stubbers = []
+
+    def make(service_name, region_name="us-east-1"):
+        client = boto3.client(service_name, region_name=region_name,
+                              aws_access_key_id="testing", aws_secret_access_key="testing")
+        stubber = Stubber(client)
+        stubber.activate()
+        stubbers.append(stubber)
+        return client, stubber
+
+    yield make
+    for stubber in stubbers:
+        stubber.assert_no_pending_responses()
+        stubber.deactivate()
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """ Keep stack state written by deploys out of the real state directory """
+    from infrastructure import stack_deploy
+    monkeypatch.setattr(stack_deploy, "STATE_FILE", str(tmp_path / "stack_state.json"))
+    return tmp_path
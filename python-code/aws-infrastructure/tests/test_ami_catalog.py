@@ -0,0 +1,59 @@
+import json
+import time
+import pytest
+from infrastructure import ami_catalog, aws_clients
+
+
+def entry(ami):
+    return {"fetched_at": time.time(), "amis": {"ubuntu22": ami},
+            "offerings": {size: ["us-east-1a"] for size in ami_catalog.wanted_sizes()}}
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr(ami_catalog, "CATALOG_FILE", str(tmp_path / "ami_catalog.json"))
+    monkeypatch.setattr(ami_catalog, "PINS_FILE", str(tmp_path / "ami_pins.json"))
+    (tmp_path / "ami_catalog.json").write_text(json.dumps({"us-east-1": entry("ami-old")}))
+    releases = ["ami-new"]
+    monkeypatch.setattr(ami_catalog, "fetch_region", lambda region, sizes=None: entry(releases[-1]))
+    ami_catalog.reset()
+    yield releases
+    ami_catalog.reset()
+
+
+def test_first_lookup_pins_the_latest_ami(catalog, tmp_path):
+    assert ami_catalog.ami_id("us-east-1", "dev") == "ami-old"
+    assert json.loads((tmp_path / "ami_pins.json").read_text()) == {"dev": {"us-east-1": {"ubuntu22": "ami-old"}}}
+
+
+def test_catalog_refresh_does_not_move_a_pinned_environment(catalog):
+    ami_catalog.ami_id("us-east-1", "dev")
+    ami_catalog.refresh(["us-east-1"])
+    assert ami_catalog.ami_id("us-east-1", "dev") == "ami-old"
+    # An environment deployed after the refresh starts on the new release
+    assert ami_catalog.ami_id("us-east-1", "prod") == "ami-new"
+
+
+def test_repin_moves_only_the_named_environments(catalog):
+    ami_catalog.ami_id("us-east-1", "dev")
+    ami_catalog.ami_id("us-east-1", "prod")
+    assert ami_catalog.repin(["dev"], "us-east-1") == {"dev": {"ubuntu22": "ami-new"}}
+    assert ami_catalog.ami_id("us-east-1", "dev") == "ami-new"
+    assert ami_catalog.ami_id("us-east-1", "prod") == "ami-old"
+
+
+def test_pins_are_kept_per_target(catalog):
+    with aws_clients.use_target("111111111111", "us-east-1"):
+        ami_catalog.ami_id("us-east-1", "dev")
+    catalog.append("ami-newer")
+    ami_catalog.refresh(["us-east-1"])
+    with aws_clients.use_target("222222222222", "us-east-1"):
+        assert ami_catalog.ami_id("us-east-1", "dev") == "ami-newer"
+    with aws_clients.use_target("111111111111", "us-east-1"):
+        assert ami_catalog.ami_id("us-east-1", "dev") == "ami-old"
+
+
+def test_offline_lookups_do_not_pin(catalog, tmp_path):
+    with ami_catalog.cached_only():
+        assert ami_catalog.ami_id("us-east-1", "dev") == "ami-old"
+    assert not (tmp_path / "ami_pins.json").exists()
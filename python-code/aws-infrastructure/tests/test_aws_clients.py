@@ -0,0 +1,102 @@
+import threading
+import pytest
+from botocore.awsrequest import AWSResponse
+from infrastructure import aws_clients
+
+THROTTLE = (b'<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>'
+            b'</Error></Errors><RequestID>1</RequestID></Response>')
+VPCS = (b'<DescribeVpcsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/"><requestId>2</requestId>'
+        b'<vpcSet/></DescribeVpcsResponse>')
+
+
+class FakeRaw:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+
+def test_bucket_allows_a_burst_then_waits(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(aws_clients, "time", clock)
+    bucket = aws_clients.TokenBucket(rate=10.0, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.1)]
+    # Idle time refills no more than the burst
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.slept) == 1
+
+
+def test_throttling_halves_the_rate_down_to_the_floor_and_success_recovers_it():
+    bucket = aws_clients.TokenBucket(rate=20.0, burst=40)
+    bucket.throttled()
+    assert bucket.rate == 10.0
+    for _ in range(10):
+        bucket.throttled()
+    assert bucket.rate == 20.0 * aws_clients.MIN_RATE_FRACTION
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 20.0
+
+
+@pytest.mark.parametrize("service, operation, family", [
+    ("ec2", "DescribeSubnets", "ec2:read"),
+    ("cloudformation", "ListExports", "cloudformation:read"),
+    ("ssm", "GetParameters", "ssm:read"),
+    ("ec2", "CreateVpc", "ec2:write"),
+    ("route-53", "ChangeResourceRecordSets", "route-53:write"),
+])
+def test_api_family(service, operation, family):
+    assert aws_clients.api_family(service, operation) == family
+
+
+def test_hooks_use_the_clients_own_target_from_any_thread(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    aws_clients.reset()
+    try:
+        with aws_clients.use_target(None, "eu-west-1"):
+            ec2 = aws_clients.client("ec2")
+        responses = [(503, THROTTLE), (200, VPCS)]
+
+        def send(request, **kwargs):
+            status, body = responses.pop(0)
+            return AWSResponse(request.url, status, {}, FakeRaw(body))
+
+        # Registered after the rate limiter, so each attempt still draws a token first
+        ec2.meta.events.register("before-send", send)
+        rates = []
+        family_bucket = aws_clients.bucket((None, "eu-west-1"), "ec2:read")
+        monkeypatch.setattr(family_bucket, "throttled",
+                            lambda original=family_bucket.throttled: (original(), rates.append(family_bucket.rate)))
+        # Sent from a thread with no target, as the monitor's executor threads are
+        worker = threading.Thread(target=ec2.describe_vpcs)
+        worker.start()
+        worker.join()
+
+        assert responses == []
+        assert rates == [10.0]
+        assert family_bucket.rate == 10.0 + 20.0 * aws_clients.RATE_RECOVERY
+        assert [key for key in aws_clients._buckets if key[1] == "ec2:read"] == [((None, "eu-west-1"), "ec2:read")]
+    finally:
+        aws_clients.reset()
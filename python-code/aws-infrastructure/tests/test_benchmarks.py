@@ -0,0 +1,62 @@
+import contextlib
+import io
+import pytest
+from infrastructure import ami_catalog, benchmark as bench, bulk_builder, infra_instances, return_vpc_component_ids, template_factory
+
+# Per-phase timings at the CLI benchmark's default scale (BENCH_INSTANCES over BENCH_TIERS tiers);
+# `./build_infra_cli.py benchmark` reports the same phases once, this suite repeats them and keeps
+# history (--benchmark-autosave / --benchmark-compare). pytest-benchmark is in requirements-dev.txt
+pytest.importorskip("pytest_benchmark")
+
+VPC_NAMES = [bench.BENCH_VPC_NAME] + [f"{bench.BENCH_VPC_NAME}{n}" for n in range(bench.BENCH_TIERS)]
+PER_TIER = max(1, bench.BENCH_INSTANCES // bench.BENCH_TIERS)
+TIER_NAMES = [f"bench{n}" for n in range(bench.BENCH_TIERS)]
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """ BENCH_TIERS tiers of PER_TIER instances, built with offline IDs and no AWS calls """
+    for name in TIER_NAMES:
+        monkeypatch.setitem(infra_instances.INSTANCE_TIER_COUNT, name, PER_TIER)
+    with return_vpc_component_ids.use_resolver(return_vpc_component_ids.OfflineResolver()), \
+            ami_catalog.cached_only(), contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def build_tiers():
+    return [infra_instances.build_instance_cfn_template(bench.BENCH_VPC_NAME, name) for name in TIER_NAMES]
+
+
+def test_id_resolution_cold_sweep(benchmark):
+    def sweep():
+        resolver = return_vpc_component_ids.VpcComponentResolver(bench.CannedEc2Client(VPC_NAMES))
+        resolver.prefetch(VPC_NAMES)
+        return resolver
+
+    resolver = benchmark(sweep)
+    assert resolver.get_subnet_id(bench.BENCH_VPC_NAME, "publicsubnet1")
+
+
+def test_id_resolution_cached_lookups(benchmark):
+    resolver = return_vpc_component_ids.VpcComponentResolver(bench.CannedEc2Client(VPC_NAMES))
+    resolver.prefetch(VPC_NAMES)
+    ids = benchmark(lambda: [resolver.get_subnet_id(bench.BENCH_VPC_NAME, "publicsubnet1") for _ in range(PER_TIER * bench.BENCH_TIERS)])
+    assert len(set(ids)) == 1
+
+
+def test_template_generation(benchmark, offline):
+    templates = benchmark(build_tiers)
+    assert len(templates) == bench.BENCH_TIERS
+    assert all(len([name for name in t.resources if name.startswith(tier)]) >= PER_TIER for t, tier in zip(templates, TIER_NAMES))
+
+
+def test_yaml_serialization(benchmark, offline):
+    templates = build_tiers()
+    bodies = benchmark(lambda: [template_factory.render(t) for t in templates])
+    assert len(bodies) == bench.BENCH_TIERS and all(bodies)
+
+
+def test_bulk_rendering(benchmark, offline):
+    contexts = [bulk_builder.tier_context(bench.BENCH_VPC_NAME, name, region="us-east-1") for name in TIER_NAMES]
+    bodies = benchmark(lambda: [bulk_builder.render_template(ctx, 0, ctx.count, ctx.instance_type) for ctx in contexts])
+    assert sum(body.count('"AWS::EC2::Instance"') for body in bodies) == PER_TIER * bench.BENCH_TIERS
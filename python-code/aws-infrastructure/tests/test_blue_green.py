@@ -0,0 +1,38 @@
+from infrastructure import blue_green
+
+
+def weighted(name, set_identifier, address, weight):
+    return blue_green.weighted_record(name, set_identifier, address, weight)
+
+
+def test_first_cutover_converts_plain_records_in_pairs():
+    simple = {"appserver1.dev.multilabs.": {"Name": "appserver1.dev.multilabs.", "Type": "A", "TTL": 900,
+                                            "ResourceRecords": [{"Value": "192.168.14.10"}]}}
+    new_records = {"appserver1.dev.multilabs.": "192.168.14.20"}
+    changes = blue_green.cutover_changes(new_records, "dev-appserver-green-instances", "in-place", 10, simple, {})
+    assert [change["Action"] for change in changes] == ["DELETE", "CREATE", "UPSERT"]
+    assert changes[0]["ResourceRecordSet"] is simple["appserver1.dev.multilabs."]
+    assert changes[1]["ResourceRecordSet"] == weighted("appserver1.dev.multilabs.", "in-place", "192.168.14.10", 90)
+    assert changes[2]["ResourceRecordSet"] == weighted("appserver1.dev.multilabs.", "dev-appserver-green-instances", "192.168.14.20", 10)
+
+
+def test_plain_records_the_new_stack_does_not_serve_keep_all_traffic():
+    simple = {"appserver2.dev.multilabs.": {"Name": "appserver2.dev.multilabs.", "Type": "A", "TTL": 900,
+                                            "ResourceRecords": [{"Value": "192.168.14.11"}]}}
+    changes = blue_green.cutover_changes({}, "dev-appserver-green-instances", "in-place", 50, simple, {})
+    assert changes[1]["ResourceRecordSet"]["Weight"] == 100
+
+
+def test_later_steps_reweight_only_the_records_that_changed():
+    blue, green = blue_green.tier_stacks("dev", "appserver")
+    name = "appserver1.dev.multilabs."
+    live = {name: {blue: weighted(name, blue, "192.168.14.10", 90), green: weighted(name, green, "192.168.14.20", 10)}}
+    changes = blue_green.cutover_changes({name: "192.168.14.20"}, green, blue, 50, {}, live)
+    assert [(change["Action"], change["ResourceRecordSet"]["SetIdentifier"], change["ResourceRecordSet"]["Weight"])
+            for change in changes] == [("UPSERT", green, 50), ("UPSERT", blue, 50)]
+    settled = {name: {blue: weighted(name, blue, "192.168.14.10", 50), green: weighted(name, green, "192.168.14.20", 50)}}
+    assert len(blue_green.cutover_changes({name: "192.168.14.20"}, green, blue, 50, {}, settled)) == 1
+
+
+def test_tier_stacks():
+    assert blue_green.tier_stacks("dev", "bastion") == ("dev-bastion-instances", "dev-bastion-green-instances")
@@ -0,0 +1,50 @@
+import io
+import json
+from infrastructure import bulk_builder, stack_sharding
+
+
+def context(count, instance_type="appserver"):
+    return bulk_builder.TierContext(vpc_name="dev", instance_type=instance_type, count=count, image_id="ami-005fc0f236362e99f",
+                                    size="m3.medium", keypair="abs-key", subnet_id="subnet-0", security_group_export="dev-security-groups-MongodbSg",
+                                    dns_records=True, ttl="900")
+
+
+def test_stream_template_matches_render_template():
+    ctx = context(1200)
+    out = io.StringIO()
+    assert bulk_builder.stream_template(out, ctx, "dev appserver-instances stack", chunk=500) == 2400
+    assert out.getvalue() == bulk_builder.render_template(ctx, 0, 1200, "dev appserver-instances stack")
+    assert len(json.loads(out.getvalue())["Resources"]) == 2400
+
+
+def test_nest_tier_streams_shards_to_the_store(tmp_path):
+    ctx = context(1000, "bastion")
+    assert bulk_builder.needs_nesting(ctx)
+    body = json.loads(bulk_builder.nest_tier(ctx, "dev-bastion-instances", stack_sharding.LocalTemplateStore(str(tmp_path)), workers=2))
+    shards = [json.loads(open(shard["Properties"]["TemplateURL"][len("file://"):]).read()) for shard in body["Resources"].values()]
+    assert all(len(shard["Resources"]) <= stack_sharding.SHARD_MAX_RESOURCES for shard in shards)
+    names = [name for shard in shards for name in shard["Resources"]]
+    assert len(names) == len(set(names)) == 3000
+
+
+def test_bulk_and_template_paths_share_shard_urls(tmp_path, monkeypatch):
+    import contextlib
+    from infrastructure import ami_catalog, infra_instances, return_vpc_component_ids
+
+    def urls(body):
+        return [resource["Properties"]["TemplateURL"] for resource in json.loads(body)["Resources"].values()]
+
+    store = stack_sharding.LocalTemplateStore(str(tmp_path))
+    shards = {}
+    with return_vpc_component_ids.use_resolver(return_vpc_component_ids.OfflineResolver()), \
+            ami_catalog.cached_only(), contextlib.redirect_stdout(io.StringIO()):
+        for count in (132, 140):
+            monkeypatch.setitem(infra_instances.INSTANCE_TIER_COUNT, "bastion", count)
+            t = infra_instances.build_instance_cfn_template("dev", "bastion")
+            template_path = urls(json.dumps(stack_sharding.nest(t, "dev-bastion-instances", store).to_dict()))
+            bulk_path = urls(bulk_builder.render_tier("dev", "dev-bastion-instances", "bastion", store, workers=2, region="us-east-1")[0])
+            # A tier crossing BULK_BUILD_THRESHOLD keeps its nested stacks
+            assert template_path == bulk_path
+            shards[count] = bulk_path
+    assert len(shards[132]) == 2 and len(shards[140]) == 3
+    assert shards[140][:2] == shards[132]
@@ -0,0 +1,165 @@
+import threading
+import time
+import pytest
+from infrastructure import deploy_engine
+from infrastructure.deploy_engine import StackTask
+
+
+def quiet(task):
+    pass
+
+
+def recorder(order, result=True, delay=0.0):
+    """ Stub deploy that records when it ran """
+    def deploy_for(name):
+        def deploy():
+            order.append(name)
+            time.sleep(delay)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return deploy
+    return deploy_for
+
+
+def environment_plan(vpc_names, tiers, deploy_for):
+    return [StackTask(stack_name, deploy_for(stack_name), depends_on)
+            for stack_name, _, _, _, depends_on in deploy_engine.plan_stacks(vpc_names, tiers)]
+
+
+def test_dependencies_deploy_first():
+    order = []
+    tasks = environment_plan(["dev", "stage"], ["bastion", "appserver"], recorder(order))
+    deploy_engine.run_plan(tasks, max_workers=4, reporter=quiet)
+    assert all(task.status == deploy_engine.SUCCEEDED for task in tasks)
+    assert sorted(order) == sorted(task.stack_name for task in tasks)
+    for vpc_name in ("dev", "stage"):
+        assert order.index(f"{vpc_name}-vpc") < order.index(f"{vpc_name}-security-groups")
+        for tier in ("bastion", "appserver"):
+            assert order.index(f"{vpc_name}-security-groups") < order.index(f"{vpc_name}-{tier}-instances")
+
+
+def test_workers_are_bounded():
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def deploy():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return True
+
+    tasks = [StackTask(f"dev-tier{number}-instances", deploy) for number in range(12)]
+    deploy_engine.run_plan(tasks, max_workers=3, reporter=quiet)
+    assert peak[0] == 3
+    assert all(task.status == deploy_engine.SUCCEEDED for task in tasks)
+
+
+def test_failure_skips_dependents_only():
+    order = []
+
+    def deploy_for(name):
+        if name == "dev-security-groups":
+            return recorder(order, RuntimeError("Security group limit exceeded"))(name)
+        return recorder(order)(name)
+
+    tasks = environment_plan(["dev", "stage"], ["bastion"], deploy_for)
+    deploy_engine.run_plan(tasks, reporter=quiet)
+    status = {task.stack_name: task.status for task in tasks}
+    assert status == {
+        "dev-vpc": deploy_engine.SUCCEEDED,
+        "dev-security-groups": deploy_engine.FAILED,
+        "dev-bastion-instances": deploy_engine.SKIPPED,
+        "stage-vpc": deploy_engine.SUCCEEDED,
+        "stage-security-groups": deploy_engine.SUCCEEDED,
+        "stage-bastion-instances": deploy_engine.SUCCEEDED,
+    }
+    assert "dev-bastion-instances" not in order
+    assert next(task for task in tasks if task.stack_name == "dev-security-groups").error == "Security group limit exceeded"
+
+
+def test_false_result_fails_and_skips_transitively():
+    tasks = [StackTask("dev-vpc", lambda: False),
+             StackTask("dev-security-groups", lambda: True, ["dev-vpc"]),
+             StackTask("dev-bastion-instances", lambda: True, ["dev-security-groups"])]
+    deploy_engine.run_plan(tasks, reporter=quiet)
+    assert [task.status for task in tasks] == [deploy_engine.FAILED, deploy_engine.SKIPPED, deploy_engine.SKIPPED]
+    # None (no return value) counts as success
+    assert deploy_engine.run_plan([StackTask("dev-vpc", lambda: None)], reporter=quiet)[0].status == deploy_engine.SUCCEEDED
+
+
+def test_reporter_sees_every_transition():
+    seen = []
+    tasks = [StackTask("dev-vpc", lambda: True), StackTask("dev-security-groups", lambda: True, ["dev-vpc"])]
+    deploy_engine.run_plan(tasks, reporter=lambda task: seen.append((task.stack_name, task.status)))
+    assert seen == [("dev-vpc", deploy_engine.RUNNING), ("dev-vpc", deploy_engine.SUCCEEDED),
+                    ("dev-security-groups", deploy_engine.RUNNING), ("dev-security-groups", deploy_engine.SUCCEEDED)]
+
+
+def test_unknown_dependencies_and_cycles():
+    with pytest.raises(ValueError, match="unknown stacks"):
+        deploy_engine.run_plan([StackTask("dev-security-groups", lambda: True, ["dev-vpc"])], reporter=quiet)
+    tasks = [StackTask("a", lambda: True, ["b"]), StackTask("b", lambda: True, ["a"])]
+    deploy_engine.run_plan(tasks, reporter=quiet)
+    assert [(task.status, task.error) for task in tasks] == [(deploy_engine.SKIPPED, "dependency cycle")] * 2
+
+
+def test_skip_reason_follows_the_graph_not_list_order():
+    # Dependents listed before the stack that fails are still skipped for the failure, not a cycle
+    tasks = [StackTask("dev-bastion-instances", lambda: True, ["dev-security-groups"]),
+             StackTask("dev-security-groups", lambda: True, ["dev-vpc"]),
+             StackTask("dev-vpc", lambda: False)]
+    deploy_engine.run_plan(tasks, reporter=quiet)
+    assert [(task.status, task.error) for task in tasks] == [
+        (deploy_engine.SKIPPED, "dev-security-groups was skipped"),
+        (deploy_engine.SKIPPED, "dev-vpc failed"),
+        (deploy_engine.FAILED, None),
+    ]
+
+
+def stub_create(stubber, stack_name, final_status):
+    """ Queue the calls deploy_stack makes to create a stack through a change set """
+    from datetime import datetime, timezone
+    from botocore.stub import ANY
+    stack_id = f"arn:aws:cloudformation:us-east-1:123456789012:stack/{stack_name}/1"
+    now = datetime.now(timezone.utc)
+    stubber.add_response("create_change_set", {"Id": "arn:change-set", "StackId": stack_id},
+                         {"StackName": stack_name, "ChangeSetName": ANY, "ChangeSetType": "CREATE", "TemplateBody": ANY,
+                          "Parameters": [], "Capabilities": ["CAPABILITY_IAM"]})
+    stubber.add_response("describe_change_set", {"Status": "CREATE_COMPLETE", "Changes": [{"Type": "Resource", "ResourceChange": {
+        "Action": "Add", "LogicalResourceId": "VPC", "ResourceType": "AWS::EC2::VPC"}}]},
+        {"StackName": stack_name, "ChangeSetName": ANY})
+    stubber.add_response("execute_change_set", {}, {"StackName": stack_name, "ChangeSetName": ANY})
+    stubber.add_response("describe_stack_events", {"StackEvents": [{
+        "StackId": stack_id, "EventId": "2", "StackName": stack_name, "LogicalResourceId": stack_name,
+        "ResourceType": "AWS::CloudFormation::Stack", "Timestamp": now, "ResourceStatus": final_status}]},
+        {"StackName": stack_name})
+    if final_status == "CREATE_COMPLETE":
+        stubber.add_response("describe_stacks", {"Stacks": [{"StackName": stack_name, "CreationTime": now, "StackStatus": final_status}]},
+                             {"StackName": stack_name})
+
+
+def test_change_set_deploys_through_the_plan(stubbed, state_dir, capsys):
+    from infrastructure import stack_deploy
+    tasks = []
+    for stack_name, _, _, _, depends_on in deploy_engine.plan_stacks(["dev", "stage"], ["bastion"]):
+        client, stubber = stubbed("cloudformation")
+        # dev-bastion-instances gets no responses: a dependent of the failed stack must never reach AWS
+        if stack_name != "dev-bastion-instances":
+            stub_create(stubber, stack_name, "ROLLBACK_COMPLETE" if stack_name == "dev-security-groups" else "CREATE_COMPLETE")
+        tasks.append(StackTask(stack_name, lambda c=client, s=stack_name: stack_deploy.deploy_stack(c, s, "{}", "create"), depends_on))
+    deploy_engine.run_plan(tasks, reporter=quiet)
+    status = {task.stack_name: task.status for task in tasks}
+    assert status == {
+        "dev-vpc": deploy_engine.SUCCEEDED,
+        "dev-security-groups": deploy_engine.FAILED,
+        "dev-bastion-instances": deploy_engine.SKIPPED,
+        "stage-vpc": deploy_engine.SUCCEEDED,
+        "stage-security-groups": deploy_engine.SUCCEEDED,
+        "stage-bastion-instances": deploy_engine.SUCCEEDED,
+    }
+    assert "finished in ROLLBACK_COMPLETE" in tasks[1].error
+    assert set(stack_deploy._load_state()) == {"dev-vpc", "stage-vpc", "stage-security-groups", "stage-bastion-instances"}
@@ -0,0 +1,49 @@
+from infrastructure import dns_sync
+
+
+def record(name, address, ttl=900):
+    return {"Name": name, "Type": "A", "TTL": ttl, "ResourceRecords": [{"Value": address}]}
+
+
+def test_diff_records_upserts_changed_and_deletes_stale():
+    desired = {"appserver1.dev.multilabs.": "192.168.14.10", "appserver2.dev.multilabs.": "192.168.14.11"}
+    live = {
+        "appserver1.dev.multilabs.": record("appserver1.dev.multilabs.", "192.168.14.10"),
+        "appserver2.dev.multilabs.": record("appserver2.dev.multilabs.", "192.168.14.99"),
+        "appserver3.dev.multilabs.": record("appserver3.dev.multilabs.", "192.168.14.12"),
+    }
+    changes = dns_sync.diff_records(desired, live, ttl=900)
+    assert [(change["Action"], change["ResourceRecordSet"]["Name"]) for change in changes] == [
+        ("UPSERT", "appserver2.dev.multilabs."),
+        ("DELETE", "appserver3.dev.multilabs."),
+    ]
+    assert changes[0]["ResourceRecordSet"]["ResourceRecords"] == [{"Value": "192.168.14.11"}]
+    assert changes[1]["ResourceRecordSet"] is live["appserver3.dev.multilabs."]
+
+
+def test_diff_records_upserts_on_ttl_change():
+    live = {"bastion1.dev.multilabs.": record("bastion1.dev.multilabs.", "192.168.11.5", ttl=300)}
+    changes = dns_sync.diff_records({"bastion1.dev.multilabs.": "192.168.11.5"}, live, ttl=900)
+    assert [change["Action"] for change in changes] == ["UPSERT"]
+    assert dns_sync.diff_records({"bastion1.dev.multilabs.": "192.168.11.5"}, live, ttl=300) == []
+
+
+def test_batches_respect_change_weights():
+    changes = [{"Action": "UPSERT"}] * 3 + [{"Action": "DELETE"}] * 3
+    assert [len(batch) for batch in dns_sync.batches(changes, max_weight=4)] == [2, 3, 1]
+    assert [sum(dns_sync.CHANGE_WEIGHT[change["Action"]] for change in batch)
+            for batch in dns_sync.batches(changes, max_weight=4)] == [4, 4, 1]
+
+
+def test_batches_of_the_default_limit():
+    changes = [{"Action": "UPSERT"}] * 1200
+    assert [len(batch) for batch in dns_sync.batches(changes)] == [500, 500, 200]
+    assert list(dns_sync.batches([])) == []
+
+
+def test_owned_stays_inside_the_environment():
+    assert dns_sync._owned(record("bastion1.dev.pubs.com.", "1.2.3.4"), "dev", "bastion")
+    assert dns_sync._owned(record("bastion1.dev.multilabs.", "192.168.11.5"), "dev", "bastion")
+    assert not dns_sync._owned(record("bastion1.stage.pubs.com.", "1.2.3.5"), "dev", "bastion")
+    assert not dns_sync._owned(record("bastion-old.dev.pubs.com.", "1.2.3.6"), "dev", "bastion")
+    assert not dns_sync._owned({**record("bastion1.dev.pubs.com.", "1.2.3.4"), "Type": "AAAA"}, "dev", "bastion")
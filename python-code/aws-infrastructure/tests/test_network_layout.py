@@ -0,0 +1,56 @@
+import ipaddress
+import pytest
+from infrastructure import network_layout
+from infrastructure.network_layout import TopologySpec
+
+
+def test_default_layout_keeps_existing_subnets():
+    specs = network_layout.plan_subnets("dev", "192.168.0.0/16", TopologySpec())
+    assert [(spec.name, spec.cidr, spec.availability_zone) for spec in specs] == [
+        ("dev-publicsubnet1", "192.168.11.0/24", "us-east-1a"),
+        ("dev-publicsubnet2", "192.168.12.0/24", "us-east-1b"),
+        ("dev-publicsubnet3", "192.168.13.0/24", "us-east-1d"),
+        ("dev-privatesubnet1", "192.168.14.0/24", "us-east-1a"),
+        ("dev-privatesubnet2", "192.168.15.0/24", "us-east-1b"),
+        ("dev-privatesubnet3", "192.168.16.0/24", "us-east-1d"),
+    ]
+    assert [spec.logical_id for spec in specs[:3]] == ["PublicSubnet1", "PublicSubnet2", "PublicSubnet3"]
+    assert all(spec.public for spec in specs[:3]) and not any(spec.public for spec in specs[3:])
+
+
+def test_six_az_three_tier_layout_has_no_overlaps():
+    topology = TopologySpec(az_count=6, tiers=("public", "private", "isolated"), subnet_prefix=22)
+    specs = network_layout.plan_subnets("prod", "10.23.0.0/16", topology)
+    assert len(specs) == 18
+    assert len({spec.availability_zone for spec in specs}) == 6
+    networks = [ipaddress.ip_network(spec.cidr) for spec in specs]
+    vpc = ipaddress.ip_network("10.23.0.0/16")
+    assert all(network.subnet_of(vpc) for network in networks)
+    for position, network in enumerate(networks):
+        assert not any(network.overlaps(other) for other in networks[position + 1:])
+
+
+def test_overflowing_layout_raises():
+    topology = TopologySpec(az_count=6, tiers=("public", "private", "isolated"), subnet_prefix=20)
+    with pytest.raises(ValueError, match="overflow"):
+        network_layout.plan_subnets("prod", "10.23.0.0/16", topology)
+
+
+def test_subnets_larger_than_the_vpc_raise():
+    with pytest.raises(ValueError, match="do not fit"):
+        network_layout.plan_subnets("dev", "192.168.0.0/16", TopologySpec(subnet_prefix=12))
+
+
+@pytest.mark.parametrize("tiers, message", [
+    (("public", "dmz"), "Unknown subnet tiers"),
+    (("private",), "needs a public tier"),
+    (("public", "public"), "Duplicate subnet tiers"),
+])
+def test_unroutable_tiers_raise(tiers, message):
+    with pytest.raises(ValueError, match=message):
+        network_layout.plan_subnets("dev", "192.168.0.0/16", TopologySpec(tiers=tiers))
+
+
+def test_too_many_availability_zones_raise():
+    with pytest.raises(ValueError, match="usable AZs"):
+        network_layout.availability_zones("us-west-1", 3)
@@ -0,0 +1,81 @@
+import pytest
+from infrastructure import aws_clients, preflight
+
+
+@pytest.fixture(autouse=True)
+def allocations_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(preflight, "ALLOCATIONS_FILE", str(tmp_path / "network_allocations.json"))
+
+
+def index_of(*blocks):
+    index = preflight.CidrIndex()
+    for cidr, label, owner in blocks:
+        index.add(cidr, label, owner)
+    return index
+
+
+def test_overlaps_finds_nested_and_containing_blocks_once():
+    index = index_of(("10.0.0.0/8", "pool", None), ("10.0.0.0/16", "vpc a", "vpc-a"),
+                     ("10.0.5.0/24", "subnet", "vpc-a"), ("10.1.0.0/16", "vpc b", "vpc-b"))
+    assert sorted(index.overlaps("10.0.0.0/16")) == sorted([
+        ("10.0.0.0/8", "pool", None), ("10.0.0.0/16", "vpc a", "vpc-a"), ("10.0.5.0/24", "subnet", "vpc-a")])
+    assert sorted(index.overlaps("10.0.5.128/25")) == sorted([
+        ("10.0.0.0/8", "pool", None), ("10.0.0.0/16", "vpc a", "vpc-a"), ("10.0.5.0/24", "subnet", "vpc-a")])
+    assert index.overlaps("192.168.0.0/16") == []
+
+
+def test_overlaps_of_the_same_block_lists_every_owner():
+    index = index_of(("10.22.0.0/16", "vpc stage", "vpc-1"), ("10.22.0.0/16", "peer", None))
+    assert len(index.overlaps("10.22.0.0/16")) == 2
+
+
+def test_allocate_skips_indexed_and_taken_blocks():
+    index = index_of(("10.0.0.0/16", "vpc a", "vpc-a"), ("10.1.128.0/17", "peer", None))
+    assert preflight.allocate(index, taken=["10.2.0.0/16"]) == "10.3.0.0/16"
+    with pytest.raises(ValueError, match="No free"):
+        preflight.allocate(index, pool="10.0.0.0/15")
+
+
+def account(index, vpcs=None):
+    return {"index": index, "vpcs": vpcs or {}, "nat_per_az": {},
+            "counts": {"vpcs": len(vpcs or {}), "internet_gateways": len(vpcs or {}), "elastic_ips": 0},
+            "quotas": {"vpcs": 5, "internet_gateways": 5, "elastic_ips": 5, "nat_gateways_per_az": 5}}
+
+
+def test_plan_reports_clashes_and_accepts_an_environments_own_vpc(monkeypatch):
+    monkeypatch.setitem(preflight.NETWORK_OCTETS, "stage", "10.22")
+    index = index_of(("10.22.0.0/16", "vpc stage", "vpc-stage"))
+    assert preflight.plan(["stage"], "us-east-1", account(index, {"stage": "vpc-stage"})) == []
+    problems = preflight.plan(["stage"], "us-east-1", account(index))
+    assert problems == ["stage 10.22.0.0/16 overlaps vpc stage 10.22.0.0/16"]
+
+
+def test_plan_auto_allocates_clashing_new_environments(monkeypatch):
+    monkeypatch.setitem(preflight.NETWORK_OCTETS, "stage", "10.22")
+    monkeypatch.setitem(preflight.NETWORK_OCTETS, "prod", "10.0")
+    allocations = {}
+    index = index_of(("10.22.0.0/16", "vpc other", "vpc-other"))
+    assert preflight.plan(["stage"], "us-east-1", account(index), auto_allocate=True, allocations=allocations) == []
+    # 10.0.0.0/16 is prod's configured block
+    assert allocations == {"stage": "10.1"}
+    # Nothing is kept until a passing deploy saves the allocation
+    assert preflight.NETWORK_OCTETS["stage"] == "10.22" and preflight.vpc_octets("stage") == "10.22"
+
+
+def test_saved_allocations_apply_only_to_their_target(monkeypatch):
+    monkeypatch.setitem(preflight.NETWORK_OCTETS, "stage", "10.22")
+    with aws_clients.use_target("111111111111", "us-east-1"):
+        preflight.save_allocations({"stage": "10.1"})
+        assert preflight.vpc_octets("stage") == "10.1"
+    with aws_clients.use_target("111111111111", "eu-west-1"):
+        assert preflight.vpc_octets("stage") == "10.22"
+    with aws_clients.use_target("222222222222", "us-east-1"):
+        assert preflight.vpc_octets("stage") == "10.22"
+    assert preflight.vpc_octets("stage") == "10.22"
+
+
+def test_plan_counts_quotas_for_new_environments(monkeypatch):
+    monkeypatch.setitem(preflight.NETWORK_OCTETS, "dev", "192.168")
+    full = account(preflight.CidrIndex())
+    full["counts"]["elastic_ips"] = 5
+    assert preflight.plan(["dev"], "us-east-1", full) == ["1 new Elastic IPs on top of 5 exceeds the quota of 5"]
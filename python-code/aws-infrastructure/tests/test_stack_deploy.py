@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+import pytest
+from botocore.stub import ANY
+from infrastructure import inventory, stack_deploy
+
+CREATED = datetime(2026, 1, 5, tzinfo=timezone.utc)
+TEMPLATE = '{"Resources": {"VPC": {"Type": "AWS::EC2::VPC"}}}'
+
+
+def stack(status, name="dev-vpc"):
+    return {"Stacks": [{"StackName": name, "CreationTime": CREATED, "StackStatus": status}]}
+
+
+def stub_status(stubber, status, name="dev-vpc"):
+    if status is None:
+        stubber.add_client_error("describe_stacks", "ValidationError", f"Stack with id {name} does not exist",
+                                 expected_params={"StackName": name})
+    else:
+        stubber.add_response("describe_stacks", stack(status, name), {"StackName": name})
+
+
+@pytest.mark.parametrize("status, action", [
+    (None, "create"), ("DELETE_COMPLETE", "create"), ("REVIEW_IN_PROGRESS", "create"),
+    ("CREATE_COMPLETE", "update"), ("UPDATE_COMPLETE", "update"), ("UPDATE_ROLLBACK_COMPLETE", "update"),
+])
+def test_stack_action_from_status(stubbed, status, action):
+    client, stubber = stubbed("cloudformation")
+    stub_status(stubber, status)
+    assert stack_deploy.stack_action(client, "dev-vpc") == action
+
+
+@pytest.mark.parametrize("status, hint", [
+    ("ROLLBACK_COMPLETE", "delete-stack -s dev-vpc"), ("ROLLBACK_FAILED", "delete-stack -s dev-vpc"),
+    ("DELETE_FAILED", "delete-stack -s dev-vpc"), ("UPDATE_ROLLBACK_FAILED", "continue-update-rollback"),
+    ("UPDATE_IN_PROGRESS", "wait for it to settle"),
+])
+def test_stack_action_refuses_stuck_stacks(stubbed, capsys, status, hint):
+    client, stubber = stubbed("cloudformation")
+    stub_status(stubber, status)
+    with pytest.raises(ValueError, match=hint):
+        stack_deploy.stack_action(client, "dev-vpc")
+    stub_status(stubber, status)
+    assert stack_deploy.deploy_action(client, "dev-vpc") is None
+    assert hint in capsys.readouterr().out
+
+
+def test_inventory_blocks_what_stack_action_refuses():
+    assert set(inventory.BLOCKING_STATUSES) == stack_deploy.RECREATE_STATUSES | stack_deploy.CONTINUE_ROLLBACK_STATUSES
+
+
+def test_recorded_fingerprint_skips_without_reading_the_template(stubbed, state_dir):
+    client, stubber = stubbed("cloudformation")
+    stack_deploy._record_state("dev-vpc", stack_deploy.template_fingerprint(TEMPLATE), str(CREATED))
+    stub_status(stubber, "CREATE_COMPLETE")
+    assert stack_deploy.deploy_stack(client, "dev-vpc", TEMPLATE, "update") == stack_deploy.UNCHANGED
+
+
+def test_stale_record_falls_back_to_the_deployed_template(stubbed, state_dir):
+    client, stubber = stubbed("cloudformation")
+    # Recorded before the stack was last changed, so the deployed template is compared instead
+    stack_deploy._record_state("dev-vpc", stack_deploy.template_fingerprint(TEMPLATE), "2025-12-01 00:00:00+00:00")
+    stub_status(stubber, "CREATE_COMPLETE")
+    stubber.add_response("get_template", {"TemplateBody": TEMPLATE}, {"StackName": "dev-vpc", "TemplateStage": "Original"})
+    assert stack_deploy.deploy_stack(client, "dev-vpc", TEMPLATE, "update") == stack_deploy.UNCHANGED
+    assert stack_deploy.recorded_state("dev-vpc")["last_updated"] == str(CREATED)
+
+
+def stub_change_set(stubber, change_set_type, status, reason=None):
+    stubber.add_response("create_change_set", {"Id": "arn:change-set", "StackId": "arn:stack"},
+                         {"StackName": "dev-vpc", "ChangeSetName": ANY, "ChangeSetType": change_set_type,
+                          "TemplateBody": TEMPLATE, "Parameters": [], "Capabilities": stack_deploy.CAPABILITIES})
+    response = {"Status": status}
+    if reason:
+        response["StatusReason"] = reason
+    stubber.add_response("describe_change_set", response, {"StackName": "dev-vpc", "ChangeSetName": ANY})
+
+
+def test_empty_change_set_is_deleted_and_recorded(stubbed, state_dir):
+    client, stubber = stubbed("cloudformation")
+    stub_status(stubber, "UPDATE_COMPLETE")
+    stubber.add_response("get_template", {"TemplateBody": '{"Resources": {}}'}, {"StackName": "dev-vpc", "TemplateStage": "Original"})
+    stub_change_set(stubber, "UPDATE", "FAILED", "The submitted information didn't contain changes.")
+    stubber.add_response("delete_change_set", {}, {"StackName": "dev-vpc", "ChangeSetName": ANY})
+    stub_status(stubber, "UPDATE_COMPLETE")
+    assert stack_deploy.deploy_stack(client, "dev-vpc", TEMPLATE, "update") == stack_deploy.UNCHANGED
+    assert stack_deploy.recorded_state("dev-vpc") == {"fingerprint": stack_deploy.template_fingerprint(TEMPLATE),
+                                                      "last_updated": str(CREATED)}
+
+
+def test_failed_change_set_raises(stubbed, state_dir):
+    client, stubber = stubbed("cloudformation")
+    stub_change_set(stubber, "CREATE", "FAILED", "Template format error")
+    with pytest.raises(RuntimeError, match="Template format error"):
+        stack_deploy.deploy_stack(client, "dev-vpc", TEMPLATE, "create")
+    assert stack_deploy.recorded_state("dev-vpc") == {}
+
+
+def test_create_executes_and_records(stubbed, state_dir):
+    client, stubber = stubbed("cloudformation")
+    stub_change_set(stubber, "CREATE", "CREATE_COMPLETE")
+    stubber.add_response("execute_change_set", {}, {"StackName": "dev-vpc", "ChangeSetName": ANY})
+    stubber.add_response("describe_stack_events", {"StackEvents": [{
+        "StackId": "arn:stack", "EventId": "1", "StackName": "dev-vpc", "LogicalResourceId": "dev-vpc",
+        "ResourceType": "AWS::CloudFormation::Stack", "Timestamp": datetime.now(timezone.utc), "ResourceStatus": "CREATE_COMPLETE"}]},
+        {"StackName": "dev-vpc"})
+    stub_status(stubber, "CREATE_COMPLETE")
+    assert stack_deploy.deploy_stack(client, "dev-vpc", TEMPLATE, "create") == "CREATE_COMPLETE"
+    assert stack_deploy.recorded_state("dev-vpc")["fingerprint"] == stack_deploy.template_fingerprint(TEMPLATE)
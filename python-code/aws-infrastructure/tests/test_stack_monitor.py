@@ -0,0 +1,85 @@
+import threading
+from datetime import datetime, timedelta, timezone
+import pytest
+from infrastructure import stack_monitor
+
+STACK_ID = "arn:aws:cloudformation:us-east-1:123456789012:stack/dev-vpc/1"
+NOW = datetime.now(timezone.utc)
+SINCE = NOW - timedelta(seconds=60)
+
+
+def event(number, status, logical_id="dev-vpc", reason=None, age=0):
+    body = {"StackId": STACK_ID, "EventId": str(number), "StackName": "dev-vpc", "LogicalResourceId": logical_id,
+            "ResourceType": "AWS::CloudFormation::Stack" if logical_id == "dev-vpc" else "AWS::EC2::VPC",
+            "Timestamp": NOW - timedelta(seconds=age), "ResourceStatus": status}
+    if reason:
+        body["ResourceStatusReason"] = reason
+    return body
+
+
+def quiet(event):
+    pass
+
+
+def test_new_events_pages_until_seen_or_older_than_since(stubbed):
+    client, stubber = stubbed("cloudformation")
+    stubber.add_response("describe_stack_events", {"StackEvents": [event(5, "CREATE_COMPLETE"), event(4, "CREATE_COMPLETE", "VPC")],
+                                                   "NextToken": "page2"}, {"StackName": "dev-vpc"})
+    stubber.add_response("describe_stack_events", {"StackEvents": [event(3, "CREATE_IN_PROGRESS"), event(2, "DELETE_FAILED", age=600)],
+                                                   "NextToken": "page3"}, {"StackName": "dev-vpc", "NextToken": "page2"})
+    seen = set()
+    # Page three is never requested: event 2 predates the operation
+    assert [e["EventId"] for e in stack_monitor._new_events(client, "dev-vpc", seen, SINCE)] == ["3", "4", "5"]
+    stubber.add_response("describe_stack_events", {"StackEvents": [event(6, "UPDATE_IN_PROGRESS"), event(5, "CREATE_COMPLETE")],
+                                                   "NextToken": "page2"}, {"StackName": "dev-vpc"})
+    assert [e["EventId"] for e in stack_monitor._new_events(client, "dev-vpc", seen, SINCE)] == ["6"]
+
+
+@pytest.mark.parametrize("status", sorted(stack_monitor.SUCCESS_STATUSES))
+def test_success_statuses_end_the_watch(stubbed, status):
+    client, stubber = stubbed("cloudformation")
+    stubber.add_response("describe_stack_events", {"StackEvents": [event(2, status), event(1, "CREATE_IN_PROGRESS")]},
+                         {"StackName": "dev-vpc"})
+    assert stack_monitor.wait_for_stack(client, "dev-vpc", since=SINCE, on_event=quiet) == status
+
+
+@pytest.mark.parametrize("status", sorted(stack_monitor.FAILURE_STATUSES))
+def test_failure_statuses_raise_with_resource_reasons(stubbed, status):
+    client, stubber = stubbed("cloudformation")
+    stubber.add_response("describe_stack_events", {"StackEvents": [
+        event(3, status), event(2, "CREATE_FAILED", "VPC", reason="CIDR overlaps"), event(1, "CREATE_IN_PROGRESS")]},
+        {"StackName": "dev-vpc"})
+    with pytest.raises(stack_monitor.StackFailed) as failed:
+        stack_monitor.wait_for_stack(client, "dev-vpc", since=SINCE, on_event=quiet)
+    assert failed.value.status == status and failed.value.reasons == ["VPC: CIDR overlaps"]
+
+
+def test_events_before_since_are_ignored(stubbed):
+    client, stubber = stubbed("cloudformation")
+    # The previous operation's failure is older than since and must not end this watch
+    stubber.add_response("describe_stack_events", {"StackEvents": [event(2, "UPDATE_COMPLETE"), event(1, "UPDATE_ROLLBACK_COMPLETE", age=600)]},
+                         {"StackName": "dev-vpc"})
+    assert stack_monitor.wait_for_stack(client, "dev-vpc", since=SINCE, on_event=quiet) == "UPDATE_COMPLETE"
+
+
+def test_missing_stack_counts_as_deleted(stubbed):
+    client, stubber = stubbed("cloudformation")
+    stubber.add_client_error("describe_stack_events", "ValidationError", "Stack with id dev-vpc does not exist")
+    assert stack_monitor.wait_for_stack(client, "dev-vpc", on_event=quiet) == "DELETE_COMPLETE"
+
+
+def test_waits_share_one_monitor_loop(stubbed):
+    threads = []
+    clients = []
+    for _ in range(4):
+        client, stubber = stubbed("cloudformation")
+        stubber.add_response("describe_stack_events", {"StackEvents": [event(1, "CREATE_COMPLETE")]}, {"StackName": "dev-vpc"})
+        clients.append(client)
+    workers = [threading.Thread(target=stack_monitor.wait_for_stack,
+                                args=(client, "dev-vpc", SINCE, lambda e: threads.append(threading.current_thread().name)))
+               for client in clients]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert threads == ["stack-monitor"] * 4
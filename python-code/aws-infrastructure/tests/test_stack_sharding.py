@@ -0,0 +1,73 @@
+import pytest
+from infrastructure import stack_sharding
+
+
+def instance(number, *refs):
+    properties = {"ImageId": "ami-005fc0f236362e99f", "Tags": [{"Key": "Name", "Value": f"appserver{number}"}]}
+    if refs:
+        properties["NetworkInterfaces"] = [{"GroupSet": [{"Ref": ref} for ref in refs]}]
+    return {"Type": "AWS::EC2::Instance", "Properties": properties}
+
+
+def test_partition_packs_independent_resources_under_the_limit():
+    resources = {f"appserver{number}": instance(number) for number in range(1, 451)}
+    shards = stack_sharding.partition(resources)
+    assert [len(shard) for shard in shards] == [200, 200, 50]
+    assert sorted(name for shard in shards for name in shard) == sorted(resources)
+
+
+def test_partition_keeps_referencing_resources_together():
+    resources = {f"appserver{number}": instance(number) for number in range(1, 200)}
+    resources["AppserverSg"] = {"Type": "AWS::EC2::SecurityGroup", "Properties": {}}
+    resources["appserver200"] = instance(200, "AppserverSg")
+    resources["appserver201"] = {**instance(201), "DependsOn": "appserver200"}
+    shards = stack_sharding.partition(resources)
+    together = [shard for shard in shards if "AppserverSg" in shard]
+    assert len(together) == 1 and {"appserver200", "appserver201"} <= set(together[0])
+    assert all(len(shard) <= stack_sharding.SHARD_MAX_RESOURCES for shard in shards)
+
+
+def test_partition_keeps_an_outputs_resources_together():
+    resources = {f"appserver{number}": instance(number) for number in range(1, 301)}
+    outputs = {"Pair": {"Value": {"Fn::Join": [",", [{"Ref": "appserver1"}, {"Fn::GetAtt": ["appserver300", "PrivateIp"]}]]}}}
+    shards = stack_sharding.partition(resources, outputs)
+    assert any({"appserver1", "appserver300"} <= set(shard) for shard in shards)
+
+
+def test_partition_rejects_groups_over_the_limit():
+    resources = {"Sg": {"Type": "AWS::EC2::SecurityGroup", "Properties": {}}}
+    resources.update({f"appserver{number}": instance(number, "Sg") for number in range(1, stack_sharding.SHARD_MAX_RESOURCES + 1)})
+    with pytest.raises(ValueError, match="cannot be split"):
+        stack_sharding.partition(resources)
+
+
+def tier_template(count):
+    from troposphere import GetAtt, Template, ec2, route53
+    t = Template()
+    for number in range(count):
+        name = f"bastion{number}"
+        t.add_resource(ec2.Instance(name, ImageId="ami-005fc0f236362e99f", InstanceType="m3.medium"))
+        t.add_resource(route53.RecordSetType(f"{name}PrivateDNSRecord", HostedZoneName="dev.multilabs.", Name=f"{name}.dev.multilabs.",
+                                             Type="A", TTL="900", ResourceRecords=[GetAtt(name, "PrivateIp")]))
+    return t
+
+
+def shard_urls(t, tmp_path):
+    parent = stack_sharding.nest(t, "dev-bastion-instances", stack_sharding.LocalTemplateStore(str(tmp_path))).to_dict()
+    return [resource["Properties"]["TemplateURL"] for resource in parent["Resources"].values()]
+
+
+def test_growing_a_tier_keeps_unchanged_shard_urls(tmp_path):
+    # 100 instances (200 resources) per shard: only the partly filled last shard changes
+    before = shard_urls(tier_template(132), tmp_path)
+    after = shard_urls(tier_template(240), tmp_path)
+    assert len(before) == 2 and len(after) == 3
+    assert after[0] == before[0] and after[1] != before[1]
+
+
+def test_shard_body_is_canonical():
+    resources = {"b": {"Type": "AWS::EC2::Instance", "Properties": {"InstanceType": "m3.medium", "ImageId": "ami-1"}},
+                 "a": {"Properties": {"ImageId": "ami-1", "InstanceType": "m3.medium"}, "Type": "AWS::EC2::Instance"}}
+    body = stack_sharding.shard_body("dev-bastion-instances", resources)
+    assert body == stack_sharding.shard_body("dev-bastion-instances", dict(reversed(list(resources.items()))))
+    assert stack_sharding.shard_key("dev-bastion-instances", body).startswith("dev-bastion-instances/")
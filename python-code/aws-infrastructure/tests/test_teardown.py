@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+import pytest
+from infrastructure import stack_monitor, teardown
+
+STACK_ID = "arn:aws:cloudformation:us-east-1:123456789012:stack/dev-vpc/1"
+
+
+def event(number, status, logical_id="dev-vpc", reason=None):
+    body = {"StackId": STACK_ID, "EventId": str(number), "StackName": "dev-vpc", "LogicalResourceId": logical_id,
+            "ResourceType": "AWS::CloudFormation::Stack" if logical_id == "dev-vpc" else "AWS::EC2::VPCGatewayAttachment",
+            "Timestamp": datetime.now(timezone.utc), "ResourceStatus": status}
+    if reason:
+        body["ResourceStatusReason"] = reason
+    return body
+
+
+def failed_attempt(first):
+    """ Events of one failed delete attempt, newest first """
+    return [event(first + 2, "DELETE_FAILED"), event(first + 1, "DELETE_FAILED", "GatewayAttachment", reason="Network vpc-1 has mapped addresses"),
+            event(first, "DELETE_IN_PROGRESS")]
+
+
+def stub_attempts(stubber, last_status, retain=None):
+    history = []
+    for first in (1, 4):
+        stubber.add_response("delete_stack", {}, {"StackName": "dev-vpc"})
+        history = failed_attempt(first) + history
+        # Every attempt's events fall inside the next attempt's CLOCK_SKEW window
+        stubber.add_response("describe_stack_events", {"StackEvents": history}, {"StackName": "dev-vpc"})
+        stubber.add_response("list_stack_resources", {"StackResourceSummaries": [{
+            "LogicalResourceId": "GatewayAttachment", "ResourceType": "AWS::EC2::VPCGatewayAttachment",
+            "LastUpdatedTimestamp": datetime.now(timezone.utc), "ResourceStatus": "DELETE_FAILED"}]}, {"StackName": "dev-vpc"})
+    stubber.add_response("delete_stack", {}, {"StackName": "dev-vpc", "RetainResources": retain} if retain else {"StackName": "dev-vpc"})
+    if last_status == "DELETE_FAILED":
+        last = [event(9, "DELETE_FAILED"), event(8, "DELETE_FAILED", "GatewayAttachment", reason="still mapped"), event(7, "DELETE_IN_PROGRESS")]
+    else:
+        last = [event(8, last_status), event(7, "DELETE_IN_PROGRESS")]
+    stubber.add_response("describe_stack_events", {"StackEvents": last + history}, {"StackName": "dev-vpc"})
+
+
+def quiet(event):
+    pass
+
+
+def test_retained_last_attempt_succeeds_despite_earlier_failures(stubbed, capsys):
+    client, stubber = stubbed("cloudformation")
+    stub_attempts(stubber, "DELETE_COMPLETE", retain=["GatewayAttachment"])
+    assert teardown.delete_stack(client, "dev-vpc", retain_failed=True, on_event=quiet) == "DELETE_COMPLETE"
+    assert capsys.readouterr().out.count("failed on GatewayAttachment, retrying") == 2
+
+
+def test_last_attempt_reports_its_own_failure(stubbed, capsys):
+    client, stubber = stubbed("cloudformation")
+    stub_attempts(stubber, "DELETE_FAILED")
+    with pytest.raises(stack_monitor.StackFailed) as failed:
+        teardown.delete_stack(client, "dev-vpc", on_event=quiet)
+    assert failed.value.reasons == ["GatewayAttachment: still mapped"]
+
+
+def test_deletion_order_and_outside_importers(stubbed):
+    client, stubber = stubbed("cloudformation")
+    exports = {"Exports": [{"ExportingStackId": STACK_ID, "Name": "dev-vpc-vpcid", "Value": "vpc-1"}]}
+    stubber.add_response("list_exports", exports, {})
+    stubber.add_response("list_imports", {"Imports": ["dev-security-groups", "dev-bastion-instances"]}, {"ExportName": "dev-vpc-vpcid"})
+    blockers = teardown.deletion_order(client, ["dev-vpc", "dev-security-groups", "dev-bastion-instances"])
+    assert blockers == {"dev-vpc": {"dev-security-groups", "dev-bastion-instances"},
+                        "dev-security-groups": {"dev-bastion-instances"}, "dev-bastion-instances": set()}
+
+    stubber.add_response("list_exports", exports, {})
+    stubber.add_response("list_imports", {"Imports": ["stage-peering"]}, {"ExportName": "dev-vpc-vpcid"})
+    with pytest.raises(ValueError, match="stage-peering imports dev-vpc-vpcid from dev-vpc"):
+        teardown.deletion_order(client, ["dev-vpc"])
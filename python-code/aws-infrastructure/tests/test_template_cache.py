@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timezone
+import pytest
+from infrastructure import aws_clients, stack_deploy, state_files, template_cache
+
+CREATED = datetime(2026, 1, 5, tzinfo=timezone.utc)
+INPUTS = {"vpc_name": "dev", "region": "us-east-1", "octets": "192.168"}
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch, state_dir):
+    monkeypatch.setattr(template_cache, "CACHE_DIR", str(tmp_path / "templates"))
+    monkeypatch.setattr(template_cache, "ENABLED", True)
+    template_cache.reset()
+    yield tmp_path / "templates"
+    template_cache.reset()
+
+
+def builder(body):
+    calls = []
+
+    def build():
+        calls.append(body)
+        return body
+    return build, calls
+
+
+def test_cache_key_depends_on_kind_inputs_and_code_only(monkeypatch):
+    key = template_cache.cache_key("vpc", INPUTS)
+    assert template_cache.cache_key("vpc", dict(reversed(list(INPUTS.items())))) == key
+    assert template_cache.cache_key("security-groups", INPUTS) != key
+    assert template_cache.cache_key("vpc", {**INPUTS, "octets": "10.1"}) != key
+    monkeypatch.setattr(template_cache, "code_version", lambda: "edited")
+    assert template_cache.cache_key("vpc", INPUTS) != key
+
+
+def test_render_builds_once_per_key(cache_dir):
+    build, calls = builder('{"Resources": {}}')
+    first = template_cache.render("vpc", INPUTS, build)
+    assert template_cache.render("vpc", INPUTS, build) == first
+    assert calls == ['{"Resources": {}}']
+    assert first[1] == stack_deploy.template_fingerprint('{"Resources": {}}')
+    template_cache.render("vpc", {**INPUTS, "octets": "10.1"}, build)
+    assert len(calls) == 2
+
+
+def test_code_change_invalidates_entries(cache_dir, monkeypatch):
+    build, calls = builder('{"Resources": {}}')
+    template_cache.render("vpc", INPUTS, build)
+    monkeypatch.setattr(template_cache, "code_version", lambda: "edited")
+    template_cache.render("vpc", INPUTS, build)
+    assert len(calls) == 2
+
+
+def test_disabled_cache_always_builds_and_writes_nothing(cache_dir, monkeypatch):
+    monkeypatch.setattr(template_cache, "ENABLED", False)
+    build, calls = builder('{"Resources": {}}')
+    template_cache.render("vpc", INPUTS, build)
+    template_cache.render("vpc", INPUTS, build)
+    assert len(calls) == 2 and not cache_dir.exists()
+    assert not template_cache.in_sync("dev-vpc", "anything")
+
+
+def test_evict_drops_the_least_recently_used(cache_dir):
+    for age, name in enumerate(["newest", "used", "oldest"]):
+        state_files.write_json(str(cache_dir / f"{name}.json"), {"template_body": name})
+        os.utime(cache_dir / f"{name}.json", (1000 - age * 100, 1000 - age * 100))
+    # A hit counts as a use
+    assert template_cache._get("used") == {"template_body": "used"}
+    assert template_cache.evict(max_entries=2) == 1
+    assert sorted(path.name for path in cache_dir.iterdir()) == ["newest.json", "used.json"]
+    assert template_cache.evict(max_entries=2) == 0
+
+
+def test_put_keeps_the_cache_within_its_limit(cache_dir, monkeypatch):
+    monkeypatch.setattr(template_cache, "CACHE_MAX_ENTRIES", 3)
+    for octets in range(5):
+        template_cache.render("vpc", {**INPUTS, "octets": f"10.{octets}"}, lambda: "{}")
+    assert len(list(cache_dir.glob("*.json"))) == 3
+
+
+def test_in_sync_needs_the_recorded_fingerprint_and_an_untouched_stack(cache_dir, stubbed, monkeypatch):
+    client, stubber = stubbed("cloudformation")
+    monkeypatch.setattr(aws_clients, "client", lambda service_name, region_name=None: client)
+    stack_deploy._record_state("dev-vpc", "abc", str(CREATED))
+    stubber.add_response("describe_stacks", {"Stacks": [
+        {"StackName": "dev-vpc", "StackStatus": "UPDATE_COMPLETE", "CreationTime": CREATED}]})
+    assert template_cache.in_sync("dev-vpc", "abc")
+    assert not template_cache.in_sync("dev-vpc", "def")
+    # The sweep is taken once per run; after a reset it sees the stack's later update
+    template_cache.reset()
+    stubber.add_response("describe_stacks", {"Stacks": [
+        {"StackName": "dev-vpc", "StackStatus": "UPDATE_COMPLETE", "CreationTime": CREATED,
+         "LastUpdatedTime": datetime(2026, 2, 1, tzinfo=timezone.utc)}]})
+    assert not template_cache.in_sync("dev-vpc", "abc")